@@ -1,6 +1,11 @@
+import os
+import sys
 import pandas as pd
 import json
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'pir_distance_sensor_ex'))
+from time_windows import count_events_in_window, to_ns, window_ns
+
 pir_distance_sensor_file = 'pir_distance_sensor_data/AggregatedData.csv'
 gyro_sensor_file = 'gyro_sensor_data/aggregated_sensor_data.csv'
 annotation_file = 'annotation/aggregated_annotation.csv'
@@ -91,16 +96,12 @@ def compute_human_collision_pred(df, time_window='1s'):
     # Initialize the human collision prediction column as False
     df['human_collision_pred'] = False
 
-    # For each turning start event, check for a PIRvalue of 1 within the specified time window
-    for idx, row in df.iterrows():
-        if row['is_start_turning']:
-            turning_time = row['timestamp']
-            window_mask = (df['timestamp'] >= turning_time - pd.Timedelta(time_window)) & \
-                          (df['timestamp'] <= turning_time + pd.Timedelta(time_window))
-            if (df.loc[window_mask, 'PIRvalue'] == 1).any():
-                df.at[idx, 'human_collision_pred'] = True
-            else:
-                df.at[idx, 'human_collision_pred'] = False
+    # Turning starts and PIR hits as sorted timestamp arrays; count the hits within ±time_window of each start
+    timestamps = to_ns(df['timestamp'])
+    is_start = df['is_start_turning'].to_numpy(dtype=bool)
+    pir_hit_ns = timestamps[(df['PIRvalue'] == 1).to_numpy()]
+    w = window_ns(time_window)
+    df.loc[is_start, 'human_collision_pred'] = count_events_in_window(pir_hit_ns, timestamps[is_start], w, w) > 0
     
     # Optionally, drop temporary columns used in computation
     df = df.drop(columns=['prev_turning'])
@@ -1,13 +1,12 @@
+import argparse
 import os
+import sys
 import pandas as pd
 import re
 import json
 
-# Directory containing raw data
-base_directory = "raw_data"
-
-# Output aggregated CSV file
-output_csv = "aggregated_annotation.csv"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from raw_catalog import RawCatalog, file_digest
 
 # Extract relevant data from filenames
 def parse_filename(filename):
@@ -16,44 +15,71 @@ def parse_filename(filename):
         return int(match.group(1)), int(match.group(2)), int(match.group(3))
     return None, None, None
 
-# Process all CSV files
-dataframes = []
-experiment_durations = []
-
-for file in sorted(os.listdir(base_directory)):
-    if file.endswith(".csv"):
-        filepath = os.path.join(base_directory, file)
-        df = pd.read_csv(filepath)
-        
-        # Extract obstacles and trial number
-        filename_base = os.path.splitext(file)[0]
-        num_human, num_obstacles, trial = parse_filename(filename_base)
-        
-        # Filter relevant events
-        experiment_start = df[df['event'] == 'experiment_start']['timestamp'].values[0]
-        experiment_end = df[df['event'] == 'experiment_end']['timestamp'].values[0]
-        
-        df_filtered = df[(df['timestamp'] >= experiment_start) & (df['timestamp'] <= experiment_end)]
-
-        # TODO: assert len(start) == len(end)
-        df_filtered = df_filtered[~df_filtered['event'].isin(['experiment_start', 'experiment_end'])]
-        
-        # Append metadata
-        experiment_durations.append({
-            'num_obstacles': num_obstacles,
-            'trial': trial,
-            'experiment_start': experiment_start,
-            'experiment_end': experiment_end
-        })
-        
-        # Store processed data
-        dataframes.append(df_filtered)
-
-# Save aggregated CSV
-aggregated_df = pd.concat(dataframes).sort_values(by='timestamp')
-aggregated_df.to_csv(output_csv, index=False)
-
-# Save experiment durations config
-ex_duration_config = "ex_duration_config.json"
-with open(ex_duration_config, "w") as f:
-    json.dump(experiment_durations, f, indent=4)
+def parse_annotation_file(filepath, partition_path):
+    """
+    Writes the events of one annotation file between its experiment start and end to partition_path
+    and returns the experiment's duration record.
+    """
+    df = pd.read_csv(filepath)
+
+    # Extract obstacles and trial number
+    filename_base = os.path.splitext(os.path.basename(filepath))[0]
+    num_human, num_obstacles, trial = parse_filename(filename_base)
+
+    # Filter relevant events
+    experiment_start = df[df['event'] == 'experiment_start']['timestamp'].values[0]
+    experiment_end = df[df['event'] == 'experiment_end']['timestamp'].values[0]
+
+    df_filtered = df[(df['timestamp'] >= experiment_start) & (df['timestamp'] <= experiment_end)]
+
+    # TODO: assert len(start) == len(end)
+    df_filtered = df_filtered[~df_filtered['event'].isin(['experiment_start', 'experiment_end'])]
+
+    # Pickled, so the partition keeps the dtypes of the parsed file
+    df_filtered.to_pickle(partition_path)
+    return {
+        'num_obstacles': num_obstacles,
+        'trial': trial,
+        'experiment_start': float(experiment_start),
+        'experiment_end': float(experiment_end)
+    }
+
+def aggregate(base_directory, catalog_dir):
+    """
+    Aggregates the annotation files, parsing only those that are new or changed since the last run.
+    Returns the events of all experiments sorted by time and the experiment durations.
+    """
+    catalog = RawCatalog(catalog_dir, file_digest(__file__))
+    files = {file: os.path.join(base_directory, file) for file in os.listdir(base_directory) if file.endswith(".csv")}
+    for file in catalog.stale({file: [path] for file, path in files.items()}):
+        partition = catalog.partition_path(file, '.pkl')
+        catalog.record(file, partition, duration=parse_annotation_file(files[file], partition))
+    catalog.save()
+
+    # Combine the processed data of all files
+    partitions = catalog.partitions()
+    aggregated_df = pd.concat([pd.read_pickle(path) for _, path, _ in partitions]).sort_values(by='timestamp')
+    experiment_durations = [entry['duration'] for _, _, entry in partitions]
+    return aggregated_df, experiment_durations
+
+def main():
+    parser = argparse.ArgumentParser(description='Aggregate the annotation files.')
+    # Directory containing raw data
+    parser.add_argument('--base-dir', default="raw_data")
+    parser.add_argument('--catalog-dir', default="catalog", help='parsed annotation files, reused while they are unchanged')
+    # Output aggregated CSV file
+    parser.add_argument('--output', default="aggregated_annotation.csv")
+    parser.add_argument('--config', default="ex_duration_config.json")
+    args = parser.parse_args()
+
+    aggregated_df, experiment_durations = aggregate(args.base_dir, args.catalog_dir)
+
+    # Save aggregated CSV
+    aggregated_df.to_csv(args.output, index=False)
+
+    # Save experiment durations config
+    with open(args.config, "w") as f:
+        json.dump(experiment_durations, f, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -1,157 +1,215 @@
+import argparse
 import os
 import glob
-import csv
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+import numpy as np
 import pandas as pd
 
-def read_pir_files(directory):
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from raw_catalog import RawCatalog, file_digest
+
+TIMEDIFF_NS = 2 * 3600 * 10**9  # UTC+2
+# Columns read from every row; rows never have more fields than the header
+MAX_FIELDS = 8
+# Raw file prefix: (column of the value, output column)
+SENSOR_FILES = {"PIRData_": (3, 'PIRvalue'), "UltrasonicData_": (4, 'distance')}
+
+
+def file_date(filepath, prefix):
     """
-    Reads all PIR CSV files (filenames starting with 'PIRData_') from the given directory.
-    Expected CSV format: Hrs,minn,sec,PirVal (with optional header).
-    The filename is assumed to be in the format: PIRData_YYYY_MM_DD_HH_mm.csv or PIRData_YYYY_MM_DD_HH_mm_SS.csv.
-    Combines the file's date with the row's time.
-    Returns a list of dictionaries with keys: 'dt', 'pir', and 'ms' (initially 0).
+    The date encoded in the filename: <prefix>YYYY_MM_DD_HH_mm.csv or <prefix>YYYY_MM_DD_HH_mm_SS.csv,
+    or None if the filename does not match.
     """
-    pir_records = []
-    pattern = os.path.join(directory, "PIRData_*.csv")
-    for filepath in sorted(glob.glob(pattern)):
-        base = os.path.basename(filepath)
-        # Extract date string from filename
-        date_str = base.replace("PIRData_", "").replace(".csv", "")
+    date_str = os.path.basename(filepath).replace(prefix, "").replace(".csv", "")
+    # Try the format with seconds first
+    for fmt in ("%Y_%m_%d_%H_%M_%S", "%Y_%m_%d_%H_%M"):
         try:
-            # Try the format with seconds first
-            file_date = datetime.strptime(date_str, "%Y_%m_%d_%H_%M_%S")
+            return datetime.strptime(date_str, fmt)
         except ValueError:
-            try:
-                # If that fails, try the format without seconds
-                file_date = datetime.strptime(date_str, "%Y_%m_%d_%H_%M")
-            except ValueError:
-                continue
-
-        with open(filepath, newline='') as csvfile:
-            reader = csv.reader(csvfile)
-            for row in reader:
-                # Skip header or malformed rows.
-                if not row or not row[0].strip().isdigit():
-                    continue
-                try:
-                    hr = int(row[0].strip())
-                    minute = int(row[1].strip())
-                    sec = int(row[2].strip())
-                    pir_value = row[3].strip()
-                    # Combine the file date with the row's time values.
-                    full_dt = file_date.replace(hour=hr, minute=minute, second=sec)
-                    pir_records.append({'dt': full_dt, 'pir': pir_value, 'ms': 0})
-                except (ValueError, IndexError):
-                    continue
-    return pir_records
-
-def read_distance_files(directory):
-    """
-    Reads all distance CSV files (filenames starting with 'UltrasonicData_') from the given directory.
-    Expected CSV format: Hrs,minn,sec,mic,Dis (with optional header).
-    The filename is assumed to be in the format: UltrasonicData_YYYY_MM_DD_HH_mm.csv or UltrasonicData_YYYY_MM_DD_HH_mm_SS.csv.
-    Combines the file's date with the row's time.
-    Returns a list of dictionaries with keys: 'dt', 'distance', and 'ms' (initially 0).
-    """
-    distance_records = []
-    pattern = os.path.join(directory, "UltrasonicData_*.csv")
-    for filepath in sorted(glob.glob(pattern)):
-        base = os.path.basename(filepath)
-        date_str = base.replace("UltrasonicData_", "").replace(".csv", "")
-        try:
-            # Try the format with seconds first
-            file_date = datetime.strptime(date_str, "%Y_%m_%d_%H_%M_%S")
-        except ValueError:
-            try:
-                # If that fails, try the format without seconds
-                file_date = datetime.strptime(date_str, "%Y_%m_%d_%H_%M")
-            except ValueError:
-                continue
-
-        with open(filepath, newline='') as csvfile:
-            reader = csv.reader(csvfile)
-            for row in reader:
-                if not row or not row[0].strip().isdigit():
-                    continue
-                try:
-                    hr = int(row[0].strip())
-                    minute = int(row[1].strip())
-                    sec = int(row[2].strip())
-                    # Column index 4 (fifth column) holds the distance value.
-                    distance_value = row[4].strip()
-                    full_dt = file_date.replace(hour=hr, minute=minute, second=sec)
-                    distance_records.append({'dt': full_dt, 'distance': distance_value, 'ms': 0})
-                except (ValueError, IndexError):
-                    continue
-    return distance_records
-
-def assign_milliseconds(records):
-    """
-    Groups records by their full datetime (ignoring milliseconds) and assigns a millisecond offset.
-    For each group with count c, the increment is calculated as 1000/c.
-    Then, for each record in that group (in the original order), the i-th record gets an offset of int(round(i * (1000/c))).
-    """
-    # First pass: count occurrences per second (ignoring ms)
-    counts = {}
-    for rec in records:
-        key = rec['dt'].strftime("%Y-%m-%d %H:%M:%S")
-        counts[key] = counts.get(key, 0) + 1
-
-    # Second pass: assign offsets according to the order of occurrence.
-    group_counter = {}
-    for rec in records:
-        key = rec['dt'].strftime("%Y-%m-%d %H:%M:%S")
-        total = counts[key]
-        increment = 1000 / total  # even spacing within one second
-        count = group_counter.get(key, 0)
-        rec['ms'] = int(round(count * increment))
-        group_counter[key] = count + 1
-
-def create_dataframe(records, sensor_col, col_name):
-    """
-    Given a list of records, creates a pandas DataFrame with a timestamp column (formatted as
-    'YYYY-MM-DD HH:MM:SS.mmm') and one sensor value column.
-    sensor_col: the key in the record that holds the sensor value.
-    col_name: the column name to use in the DataFrame.
-    """
-    timediff = 2 # UTC+2
-
-    # Build a list of timestamps using dt and ms.
-    timestamps = [
-        f"{(rec['dt'] - pd.Timedelta(hours=timediff)).strftime('%Y-%m-%d %H:%M:%S')}.{rec['ms']:03d}"
-        for rec in records
-    ]
-    values = [rec[sensor_col] for rec in records]
-    df = pd.DataFrame({ 'timestamp': timestamps, col_name: values })
-    # Use the timestamp as the index.
-    df.set_index('timestamp', inplace=True)
-    return df
+            continue
+    return None
 
-def main():
-    # Directory where your CSV files are stored.
-    data_dir = "raw_data"
 
-    # Read records from the PIR and distance CSV files.
-    pir_records = read_pir_files(data_dir)
-    distance_records = read_distance_files(data_dir)
+def read_sensor_file(filepath, prefix, value_index):
+    """
+    Reads one PedSense CSV file (Hrs,minn,sec,... with optional header) in one vectorized pass.
+    The file's date is combined with each row's time; the header, malformed rows, rows with an invalid
+    time and rows without a value (column value_index) are skipped.
+    Returns the local time of each row's second as int64 nanoseconds and the value strings, in file order.
+    """
+    empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=object)
+    date = file_date(filepath, prefix)
+    if date is None:
+        return empty
+    try:
+        rows = pd.read_csv(filepath, header=None, names=range(MAX_FIELDS), dtype=str, na_filter=False)
+    except pd.errors.EmptyDataError:
+        return empty
 
-    # Preserve the original order and assign milliseconds.
-    assign_milliseconds(pir_records)
-    assign_milliseconds(distance_records)
+    hr, minute, sec = (rows[i].str.strip() for i in (0, 1, 2))
+    values = rows[value_index].str.strip()
+    valid = hr.str.fullmatch(r'\d+') & minute.str.fullmatch(r'[+-]?\d+') & sec.str.fullmatch(r'[+-]?\d+') & (values != '')
+    hr, minute, sec = (pd.to_numeric(c[valid]).to_numpy(dtype=np.int64) for c in (hr, minute, sec))
+    in_range = (hr < 24) & (minute >= 0) & (minute < 60) & (sec >= 0) & (sec < 60)
 
-    # Create separate DataFrames.
-    df_pir = create_dataframe(pir_records, 'pir', 'PIRvalue')
-    df_distance = create_dataframe(distance_records, 'distance', 'distance')
+    day_ns = pd.Timestamp(date.date()).value
+    seconds = day_ns + ((hr * 60 + minute) * 60 + sec)[in_range] * 10**9
+    return seconds, values[valid].to_numpy()[in_range]
 
-    # Merge the two DataFrames with an outer join on their timestamp index.
-    df_agg = pd.concat([df_pir, df_distance], axis=1, sort=True)
-    df_agg.sort_index(inplace=True)
 
-    # Write the aggregated data to CSV.
-    output_file = "AggregatedData.csv"
+def parse_partition(filepath, prefix, value_index, partition_path):
+    """
+    Parses one raw file into its catalog partition: an .npz of the seconds and values. Returns the number of rows.
+    """
+    seconds, values = read_sensor_file(filepath, prefix, value_index)
+    tmp_path = partition_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, seconds=seconds, values=values.astype(str))
+    os.replace(tmp_path, partition_path)
+    return len(seconds)
+
+
+def update_catalog(data_dir, catalog_dir, workers=None):
+    """
+    Parses the raw files that are new or changed since the last run into partitions of the catalog in
+    catalog_dir, in a process pool (serially in this process with workers=0). Partitions of removed files
+    are dropped. Returns the catalog and the number of files parsed.
+    """
+    catalog = RawCatalog(catalog_dir, file_digest(__file__))
+    files = {os.path.basename(f): f for prefix in SENSOR_FILES for f in glob.glob(os.path.join(data_dir, f"{prefix}*.csv"))}
+    stale = catalog.stale({name: [path] for name, path in files.items()})
+
+    prefixes = [next(prefix for prefix in SENSOR_FILES if name.startswith(prefix)) for name in stale]
+    partitions = [catalog.partition_path(name, '.npz') for name in stale]
+    args = ([files[name] for name in stale], prefixes, [SENSOR_FILES[prefix][0] for prefix in prefixes], partitions)
+    if workers == 0 or len(stale) < 2:
+        rows = list(map(parse_partition, *args))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            rows = list(pool.map(parse_partition, *args, chunksize=max(len(stale) // (4 * (workers or os.cpu_count())), 1)))
+
+    for name, partition, n in zip(stale, partitions, rows):
+        catalog.record(name, partition, rows=n)
+    catalog.save()
+    return catalog, len(stale)
+
+
+def read_sensor_files(catalog, prefix):
+    """
+    Concatenates the partitions of the catalogued <prefix>*.csv files in sorted filename order.
+    Returns the seconds and values.
+    """
+    seconds, values = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=object)]
+    for name, path, _ in catalog.partitions():
+        if name.startswith(prefix):
+            with np.load(path) as partition:
+                seconds.append(partition['seconds'])
+                values.append(partition['values'].astype(object))
+    return np.concatenate(seconds), np.concatenate(values)
+
+
+def assign_milliseconds(seconds):
+    """
+    Spreads the records of each second evenly over it: within a second with count c, the i-th record
+    (in the original order) gets an offset of int(round(i * (1000/c))) milliseconds.
+    """
+    groups = pd.Series(seconds).groupby(seconds, sort=False)
+    position = groups.cumcount().to_numpy()
+    count = groups.transform('size').to_numpy()
+    return np.round(position * (1000 / count)).astype(np.int64)
+
+
+def create_dataframe(seconds, values, col_name):
+    """
+    DataFrame of one sensor value column indexed by the int64 UTC timestamp (ns) of each record,
+    with the milliseconds assigned.
+    """
+    timestamps = seconds - TIMEDIFF_NS + assign_milliseconds(seconds) * 10**6
+    return pd.DataFrame({col_name: values}, index=pd.Index(timestamps, name='timestamp'))
+
+
+def format_timestamps(timestamps):
+    """
+    Formats int64 nanosecond timestamps as 'YYYY-MM-DD HH:MM:SS.mmm', formatting each distinct second once.
+    """
+    seconds, inverse = np.unique(timestamps // 10**9, return_inverse=True)
+    second_str = pd.to_datetime(seconds * 10**9).strftime('%Y-%m-%d %H:%M:%S').to_numpy(dtype=object)
+    ms = pd.Series(timestamps // 10**6 % 1000).astype(str).str.zfill(3)
+    return (second_str[inverse] + '.' + ms).to_numpy()
+
+
+def aggregate(data_dir, catalog_dir="catalog", workers=None):
+    """
+    Outer join of the PIR and distance records on their timestamps, sorted by time.
+    Only the raw files that are new or changed since the last run are parsed (see update_catalog).
+    """
+    catalog, _ = update_catalog(data_dir, catalog_dir, workers)
+    frames = [create_dataframe(*read_sensor_files(catalog, prefix), column) for prefix, (_, column) in SENSOR_FILES.items()]
+    return pd.concat(frames, axis=1).sort_index()
+
+
+def write_aggregated(df_agg, output_file):
+    df_agg = df_agg.set_axis(format_timestamps(df_agg.index.to_numpy()))
     df_agg.to_csv(output_file, index_label='timestamp')
-    print(f"Aggregated data written to {os.path.abspath(output_file)}")
+
+
+def benchmark(data_dir, workers, repeats=3):
+    """
+    Times a full aggregation of the raw_data tree from an empty catalog, serially and with the process pool,
+    and incremental runs with no new file and with one new file. Prints the best of repeats runs.
+    Generate a large raw_data tree with ../simulate_experiments.py.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        catalog_dir = os.path.join(tmp_dir, "catalog")
+        output_file = os.path.join(tmp_dir, "AggregatedData.csv")
+
+        def timed(n, prepare):
+            best = np.inf
+            for _ in range(repeats):
+                prepare()
+                start = time.perf_counter()
+                write_aggregated(aggregate(data_dir, catalog_dir, n), output_file)
+                best = min(best, time.perf_counter() - start)
+            return best
+
+        def clear_catalog():
+            shutil.rmtree(catalog_dir, ignore_errors=True)
+
+        def drop_one_partition():
+            # The last raw file then looks new to the catalog
+            os.remove(RawCatalog(catalog_dir, file_digest(__file__)).partitions()[-1][1])
+
+        for label, n in (("full, serial", 0), (f"full, {workers} workers", workers)):
+            print(f"{label}: {timed(n, clear_catalog):.2f} s")
+        print(f"incremental, no new file: {timed(workers, lambda: None):.2f} s")
+        print(f"incremental, one new file: {timed(workers, drop_one_partition):.2f} s")
+        partitions = RawCatalog(catalog_dir, file_digest(__file__)).partitions()
+        print(f"{sum(entry['rows'] for _, _, entry in partitions)} rows in {len(partitions)} raw files")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Aggregate the PedSense PIR and distance files into one CSV.')
+    # Directory where your CSV files are stored.
+    parser.add_argument('--data-dir', default="raw_data")
+    parser.add_argument('--catalog-dir', default="catalog", help='parsed raw files, reused while they are unchanged')
+    parser.add_argument('--output', default="AggregatedData.csv")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='processes parsing the files (0: serial)')
+    parser.add_argument('--benchmark', action='store_true', help='time full and incremental aggregation instead')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.data_dir, args.workers)
+        return
+
+    df_agg = aggregate(args.data_dir, args.catalog_dir, args.workers)
+    # Write the aggregated data to CSV.
+    write_aggregated(df_agg, args.output)
+    print(f"Aggregated data written to {os.path.abspath(args.output)}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+
+MANIFEST_FILE = 'manifest.json'
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    Content hash of a file.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class RawCatalog:
+    """
+    Manifest of the raw data behind the output partitions of an aggregation script, kept as manifest.json in
+    catalog_dir next to the partitions. Each source (a raw file, or a recording directory of several files) is
+    recorded with the path, size, mtime and content hash of its files and the name of its partition, so only
+    new or changed sources need parsing. Files whose size and mtime are unchanged are not hashed again.
+    version identifies the parser (e.g. the hash of the script); a different version invalidates every partition.
+
+    Usage: names = catalog.stale(sources), parse those into catalog.partition_path(name, suffix) and
+    catalog.record(name, path) each (or catalog.remove(name) if it cannot be parsed), then catalog.save().
+    """
+
+    def __init__(self, catalog_dir, version):
+        self.catalog_dir = catalog_dir
+        self.version = version
+        self.manifest_path = os.path.join(catalog_dir, MANIFEST_FILE)
+        os.makedirs(catalog_dir, exist_ok=True)
+
+        manifest = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        self.sources = manifest.get('sources', {})
+        self._pending = {}
+        if manifest.get('version') != version:
+            for name in list(self.sources):
+                self.remove(name)
+
+    def partition_path(self, name, suffix):
+        return os.path.join(self.catalog_dir, name + suffix)
+
+    def stale(self, sources):
+        """
+        sources maps each source name to the paths of its raw files. Sources that are gone are removed along
+        with their partitions. Returns the names of the sources that are new or changed, in sorted order.
+        """
+        for name in set(self.sources) - set(sources):
+            self.remove(name)
+
+        stale = []
+        for name in sorted(sources):
+            entry = self.sources.get(name)
+            known = {f['path']: f for f in entry['files']} if entry else {}
+            files = [file_record(path, known.get(path)) for path in sources[name]]
+            if (entry is None or [(f['path'], f['hash']) for f in files] != [(f['path'], f['hash']) for f in entry['files']]
+                    or not os.path.exists(os.path.join(self.catalog_dir, entry['partition']))):
+                self._pending[name] = files
+                stale.append(name)
+            else:
+                # Same content (the file may have been touched): keep the new size and mtime for the next check
+                entry['files'] = files
+        return stale
+
+    def record(self, name, partition, **meta):
+        """
+        Records the partition parsed from the stale source name, with optional metadata kept in the manifest.
+        """
+        self.sources[name] = {'files': self._pending.pop(name), 'partition': os.path.basename(partition), **meta}
+
+    def remove(self, name):
+        entry = self.sources.pop(name, None)
+        self._pending.pop(name, None)
+        if entry is not None:
+            path = os.path.join(self.catalog_dir, entry['partition'])
+            if os.path.exists(path):
+                os.remove(path)
+
+    def partitions(self):
+        """
+        (name, partition path, manifest entry) of every recorded source, in sorted name order.
+        """
+        return [(name, os.path.join(self.catalog_dir, self.sources[name]['partition']), self.sources[name])
+                for name in sorted(self.sources)]
+
+    def save(self):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': self.version, 'sources': self.sources}, f, indent=4)
+        os.replace(tmp_path, self.manifest_path)
+
+
+def file_record(path, known=None):
+    # Path, size, mtime and hash of a raw file; the hash of the known record is reused if size and mtime match
+    stat = os.stat(path)
+    if known is not None and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+        digest = known['hash']
+    else:
+        digest = file_digest(path)
+    return {'path': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': digest}
+
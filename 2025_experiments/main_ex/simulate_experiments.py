@@ -0,0 +1,369 @@
+"""
+Room-scale simulator of the experiment in ex_specification.md.
+
+A Roomba drives bump-and-turn through a 3 m x 5 m room of 15 one-metre grid cells holding obstacles and
+standing humans. Each trial writes the raw files of the real setup, so the usual aggregation scripts and
+analyze.py run on the output unchanged:
+
+    <output>/gyro_sensor_data/raw_data/<session>/{Accelerometer,Gyroscope,Orientation}.csv   (Sensor Logger, 100 Hz)
+    <output>/pir_distance_sensor_data/raw_data/{PIRData,UltrasonicData}_<session>.csv       (PedSense server)
+    <output>/annotation/raw_data/<session>_annotations_<humans>-<obstacles>-<trial>.csv      (collision_annotator.py)
+
+plus <output>/simulation_config.json with the layout, timing and collisions of every trial (the ground truth).
+Run the aggregation scripts from the matching <output> subdirectories.
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Room and grid (cell k has its centre at ((k - 1) % 3 + 0.5, (k - 1) // 3 + 0.5))
+ROOM_WIDTH = 3.0
+ROOM_LENGTH = 5.0
+GRID_COLUMNS = 3
+NUM_CELLS = 15
+
+# Design of the controlled situation: 4 x 4 combinations, repeated
+OBSTACLE_COUNTS = (1, 2, 4, 8)
+HUMAN_COUNTS = (1, 2, 3, 4)
+TRIAL_SECONDS = 300
+
+ROOMBA_RADIUS = 0.17
+ROOMBA_SPEED = 0.3  # m/s
+TURN_RATE = 1.2  # rad/s
+OBSTACLE_RADIUS = 0.2
+HUMAN_RADIUS = 0.2
+
+# Sensors
+IMU_HZ = 100
+BOARD_PERIOD = 0.25  # loop delay of 200 ms plus the HTTP request, per board
+DISTANCE_MAX_CM = 240
+DISTANCE_TOO_FAR_CM = 250  # value the distance board sends when out of range
+PIR_RANGE = 2.0
+PIR_HALF_ANGLE = np.radians(55)
+PIR_HOLD_SECONDS = 2.0
+PIR_FALSE_RATE = 0.05  # spurious triggers per second while driving
+ANNOTATION_DELAY = 0.4  # mean reaction time of the annotator (s)
+
+# The boards stamp rows with NTP local time (UTC+2), which the aggregation converts back
+BOARD_UTC_OFFSET = pd.Timedelta(hours=2)
+SESSION_LEAD_SECONDS = 20
+SESSION_GAP_SECONDS = 120
+DAY_START_HOUR = 9
+DAY_END_HOUR = 21
+
+
+def cell_center(cell):
+    cell = np.asarray(cell) - 1
+    return np.stack([cell % GRID_COLUMNS + 0.5, cell // GRID_COLUMNS + 0.5], axis=-1)
+
+
+def pick_layout(rng, num_obstacles, num_humans):
+    """
+    Distinct random cells for the obstacles, the humans and the Roomba start (as random_grid_pickup.random_pick).
+    """
+    cells = rng.choice(np.arange(1, NUM_CELLS + 1), num_obstacles + num_humans + 1, replace=False)
+    return {
+        'obstacle_cells': sorted(int(c) for c in cells[:num_obstacles]),
+        'human_cells': [int(c) for c in cells[num_obstacles:-1]],
+        'roomba_cell': int(cells[-1]),
+    }
+
+
+def ray_distance(x, y, heading, centers, radii, margin=0.0):
+    """
+    Distance along heading from (x, y) to the first wall or circle, for arrays of rays.
+    Walls and circles are grown by margin (the Roomba radius when casting the Roomba's own path).
+    Returns (distance, index of the circle hit or -1 for a wall).
+    """
+    x, y, heading = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float), np.asarray(heading, dtype=float))
+    dx, dy = np.cos(heading), np.sin(heading)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tx = np.where(dx > 0, (ROOM_WIDTH - margin - x) / dx, np.where(dx < 0, (margin - x) / dx, np.inf))
+        ty = np.where(dy > 0, (ROOM_LENGTH - margin - y) / dy, np.where(dy < 0, (margin - y) / dy, np.inf))
+    distance = np.maximum(np.minimum(tx, ty), 0.0)
+    hit = np.full(distance.shape, -1)
+
+    for k, ((cx, cy), r) in enumerate(zip(centers, radii)):
+        ox, oy = x - cx, y - cy
+        b = dx * ox + dy * oy
+        c = ox * ox + oy * oy - (r + margin) ** 2
+        disc = b * b - c
+        near = -b - np.sqrt(np.maximum(disc, 0.0))
+        # Outside the circle: the nearer root if it lies ahead; touching or inside it: blocked unless moving away
+        s = np.where(c > 1e-12, np.where((disc >= 0) & (near > 0), near, np.inf), np.where(b < 0, 0.0, np.inf))
+        closer = s < distance
+        distance = np.where(closer, s, distance)
+        hit = np.where(closer, k, hit)
+    return distance, hit
+
+
+def simulate_route(layout, rng, duration=TRIAL_SECONDS):
+    """
+    Bump-and-turn route of the Roomba: drive straight until something is hit, then turn in place by a random
+    90-180 degrees. Returns the route segments (start time, position, heading, turn rate, speed) and the
+    collisions with humans as (time, human_id).
+    """
+    obstacles = cell_center(layout['obstacle_cells']).reshape(-1, 2)
+    humans = cell_center(layout['human_cells']).reshape(-1, 2)
+    centers = np.concatenate([obstacles, humans])
+    radii = [OBSTACLE_RADIUS] * len(obstacles) + [HUMAN_RADIUS] * len(humans)
+
+    x, y = cell_center(layout['roomba_cell'])
+    heading = np.arctan2(ROOM_LENGTH / 2 - y, ROOM_WIDTH / 2 - x) if (x, y) != (ROOM_WIDTH / 2, ROOM_LENGTH / 2) else rng.uniform(-np.pi, np.pi)
+    t = 0.0
+    segments, collisions = [], []
+    while t < duration:
+        distance, hit = ray_distance(x, y, heading, centers, radii, margin=ROOMBA_RADIUS)
+        distance, hit = float(distance), int(hit)
+        if distance > 1e-9:
+            segments.append((t, x, y, heading, 0.0, ROOMBA_SPEED))
+            t += distance / ROOMBA_SPEED
+            x, y = x + distance * np.cos(heading), y + distance * np.sin(heading)
+            if t >= duration:
+                break
+            if hit >= len(obstacles):
+                collisions.append((t, hit - len(obstacles) + 1))
+
+        turn = rng.uniform(np.pi / 2, np.pi) * rng.choice([-1, 1])
+        segments.append((t, x, y, heading, np.sign(turn) * TURN_RATE, 0.0))
+        t += abs(turn) / TURN_RATE
+        heading = (heading + turn + np.pi) % (2 * np.pi) - np.pi
+
+    segments = pd.DataFrame(segments, columns=['t', 'x', 'y', 'heading', 'turn_rate', 'speed'])
+    return segments, collisions
+
+
+def roomba_state(segments, t, duration=TRIAL_SECONDS):
+    """
+    Position, heading, turn rate and speed at the trial times t (seconds); stationary outside [0, duration].
+    """
+    inside = (t >= 0) & (t < duration)
+    tc = np.clip(t, 0, duration)
+    i = np.clip(np.searchsorted(segments['t'].to_numpy(), tc, side='right') - 1, 0, len(segments) - 1)
+    seg = {name: segments[name].to_numpy()[i] for name in segments.columns}
+    elapsed = tc - seg['t']
+    heading = seg['heading'] + seg['turn_rate'] * elapsed
+    travelled = seg['speed'] * elapsed
+    return {
+        'x': seg['x'] + travelled * np.cos(seg['heading']),
+        'y': seg['y'] + travelled * np.sin(seg['heading']),
+        'heading': heading,
+        'turn_rate': np.where(inside, seg['turn_rate'], 0.0),
+        'speed': np.where(inside, seg['speed'], 0.0),
+    }
+
+
+def imu_frames(segments, start_ns, rng, lead=SESSION_LEAD_SECONDS):
+    """
+    Sensor Logger files (Gyroscope, Accelerometer, Orientation) for a session starting lead seconds before the trial.
+    """
+    n = int((TRIAL_SECONDS + 2 * lead) * IMU_HZ)
+    elapsed = np.arange(n) / IMU_HZ + rng.uniform(0, 0.001, n)
+    state = roomba_state(segments, elapsed - lead)
+    time_ns = start_ns - int(lead * 1e9) + (elapsed * 1e9).astype(np.int64)
+
+    gyro = pd.DataFrame({
+        'time': time_ns, 'seconds_elapsed': elapsed,
+        'z': state['turn_rate'] + rng.normal(0, 0.01, n),
+        'y': rng.normal(0, 0.01, n) + state['speed'] * rng.normal(0, 0.05, n),
+        'x': rng.normal(0, 0.01, n) + state['speed'] * rng.normal(0, 0.05, n),
+    })
+
+    # User acceleration: vibration while driving and a deceleration spike at every bump
+    forward = state['speed'] * rng.normal(0, 0.5, n)
+    stops = segments['t'][segments['speed'] == 0].to_numpy() + lead
+    bump = np.zeros(n)
+    for stop in stops[stops > lead]:
+        bump += -3.0 * np.exp(-((elapsed - stop) / 0.03) ** 2)
+    accelerometer = pd.DataFrame({
+        'time': time_ns, 'seconds_elapsed': elapsed,
+        'z': rng.normal(0, 0.05, n) + state['speed'] * rng.normal(0, 0.3, n),
+        'y': forward + bump + rng.normal(0, 0.05, n),
+        'x': rng.normal(0, 0.05, n) + state['speed'] * rng.normal(0, 0.3, n),
+    })
+
+    yaw = (state['heading'] - np.pi / 2 + np.pi) % (2 * np.pi) - np.pi
+    orientation = pd.DataFrame({
+        'time': time_ns, 'seconds_elapsed': elapsed,
+        'qz': np.sin(yaw / 2), 'qy': 0.0, 'qx': 0.0, 'qw': np.cos(yaw / 2),
+        'roll': rng.normal(0, 0.002, n), 'pitch': rng.normal(0, 0.002, n), 'yaw': yaw,
+    })
+    return {'Gyroscope.csv': gyro, 'Accelerometer.csv': accelerometer, 'Orientation.csv': orientation}
+
+
+def board_times(rng, duration):
+    # Loop period of a sensor board, with jitter from the HTTP request
+    intervals = BOARD_PERIOD + rng.normal(0, 0.03, int(duration / BOARD_PERIOD * 1.2) + 10)
+    t = np.cumsum(np.maximum(intervals, 0.05))
+    return t[t < duration]
+
+
+def board_clock(start_ns, t):
+    """
+    Hrs, minn, sec columns of the board rows at session times t (NTP local time, whole seconds).
+    """
+    local = pd.to_datetime(start_ns + (t * 1e9).astype(np.int64)) + BOARD_UTC_OFFSET
+    return {'Hrs': local.hour, 'minn': local.minute, 'sec': local.second}
+
+
+def board_frames(segments, layout, start_ns, rng, lead=SESSION_LEAD_SECONDS):
+    """
+    Rows of the PedSense PIR and ultrasonic files for a session starting lead seconds before the trial.
+    """
+    duration = TRIAL_SECONDS + 2 * lead
+    obstacles = cell_center(layout['obstacle_cells']).reshape(-1, 2)
+    humans = cell_center(layout['human_cells']).reshape(-1, 2)
+    centers = np.concatenate([obstacles, humans])
+    radii = [OBSTACLE_RADIUS] * len(obstacles) + [HUMAN_RADIUS] * len(humans)
+    session_start = start_ns - int(lead * 1e9)
+
+    # Ultrasonic sensor at the front of the Roomba, facing forward
+    t = board_times(rng, duration)
+    state = roomba_state(segments, t - lead)
+    sx = state['x'] + ROOMBA_RADIUS * np.cos(state['heading'])
+    sy = state['y'] + ROOMBA_RADIUS * np.sin(state['heading'])
+    distance_cm = ray_distance(sx, sy, state['heading'], centers, radii)[0] * 100 + rng.normal(0, 1.0, len(t))
+    distance_cm = np.where((distance_cm < DISTANCE_MAX_CM) & (distance_cm > 1), distance_cm, DISTANCE_TOO_FAR_CM)
+    ultrasonic = pd.DataFrame({**board_clock(session_start, t), 'mic': rng.integers(1700, 1900, len(t)),
+                               'Dis': np.round(distance_cm, 2)})
+
+    # PIR: a human in range and in the field of view triggers it, and it stays high for the hold time
+    t = board_times(rng, duration)
+    state = roomba_state(segments, t - lead)
+    seen = np.zeros(len(t), dtype=bool)
+    for hx, hy in humans:
+        dx, dy = hx - state['x'], hy - state['y']
+        angle = np.abs((np.arctan2(dy, dx) - state['heading'] + np.pi) % (2 * np.pi) - np.pi)
+        seen |= (np.hypot(dx, dy) < PIR_RANGE) & (angle < PIR_HALF_ANGLE)
+    spurious = rng.random(len(t)) < PIR_FALSE_RATE * BOARD_PERIOD * (state['speed'] > 0)
+    triggers = t[seen | spurious]
+    last = np.searchsorted(triggers, t, side='right') - 1
+    high = (last >= 0) & (t - triggers[np.maximum(last, 0)] <= PIR_HOLD_SECONDS)
+    pir = pd.DataFrame({**board_clock(session_start, t), 'PirVal': high.astype(int)})
+    return pir, ultrasonic
+
+
+def annotation_frame(collisions, start_s, rng):
+    """
+    collision_annotator.py output: experiment start/end and the collisions, noted after a reaction delay.
+    """
+    delays = np.maximum(rng.normal(ANNOTATION_DELAY, 0.1, len(collisions)), 0.1)
+    rows = [{'event': 'experiment_start', 'timestamp': start_s, 'human_id': ''}]
+    rows += [{'event': 'collision', 'timestamp': start_s + t + d, 'human_id': human_id}
+             for (t, human_id), d in zip(collisions, delays)]
+    rows.append({'event': 'experiment_end', 'timestamp': start_s + TRIAL_SECONDS, 'human_id': ''})
+    return pd.DataFrame(rows)
+
+
+def write_board_csv(df, path, header):
+    # The PedSense server writes a 'Timestamp' header column but no timestamp values
+    with open(path, 'w', newline='') as f:
+        f.write(header + '\n')
+        df.to_csv(f, header=False, index=False)
+
+
+def session_name(start_ns, fmt):
+    return (pd.Timestamp(start_ns) + BOARD_UTC_OFFSET).strftime(fmt)
+
+
+def simulate_trial(spec, output_dir):
+    """
+    Simulate one trial and write its raw files. spec holds the design (num_obstacles, num_humans, trial),
+    the start time (ns, UTC) and the random seed. Returns the ground truth record of the trial.
+    """
+    rng = np.random.default_rng(spec['seed'])
+    layout = pick_layout(rng, spec['num_obstacles'], spec['num_humans'])
+    segments, collisions = simulate_route(layout, rng)
+    start_ns = spec['start_ns']
+    session_ns = start_ns - int(SESSION_LEAD_SECONDS * 1e9)
+
+    gyro_dir = os.path.join(output_dir, 'gyro_sensor_data', 'raw_data', session_name(session_ns, '%Y-%m-%d_%H-%M-%S'))
+    os.makedirs(gyro_dir, exist_ok=True)
+    for name, df in imu_frames(segments, start_ns, rng).items():
+        df.to_csv(os.path.join(gyro_dir, name), index=False)
+
+    board_dir = os.path.join(output_dir, 'pir_distance_sensor_data', 'raw_data')
+    os.makedirs(board_dir, exist_ok=True)
+    pir, ultrasonic = board_frames(segments, layout, start_ns, rng)
+    stamp = session_name(session_ns, '%Y_%m_%d_%H_%M_%S')
+    write_board_csv(pir, os.path.join(board_dir, f'PIRData_{stamp}.csv'), 'Timestamp,Hrs,minn,sec,PirVal')
+    write_board_csv(ultrasonic, os.path.join(board_dir, f'UltrasonicData_{stamp}.csv'), 'Timestamp,Hrs,minn,sec,mic,Dis')
+
+    annotation_dir = os.path.join(output_dir, 'annotation', 'raw_data')
+    os.makedirs(annotation_dir, exist_ok=True)
+    start_s = start_ns / 1e9
+    name = f"{session_name(session_ns, '%Y%m%d-%H%M%S')}_annotations_{spec['num_humans']}-{spec['num_obstacles']}-{spec['trial']}.csv"
+    annotation_frame(collisions, start_s, rng).to_csv(os.path.join(annotation_dir, name), index=False)
+
+    return {
+        **{key: spec[key] for key in ('num_obstacles', 'num_humans', 'trial', 'seed')},
+        **layout,
+        'experiment_start': start_s,
+        'experiment_end': start_s + TRIAL_SECONDS,
+        'collisions': [{'time': start_s + t, 'human_id': human_id} for t, human_id in collisions],
+    }
+
+
+def trial_specs(num_trials, start='2025-03-10', seed=0):
+    """
+    Design, start time and seed of each trial. The 16 obstacle/human combinations are cycled, and sessions
+    follow each other during the day (DAY_START_HOUR to DAY_END_HOUR, local time) so no board file
+    crosses midnight.
+    """
+    combinations = list(itertools.product(OBSTACLE_COUNTS, HUMAN_COUNTS))
+    seeds = np.random.SeedSequence(seed).generate_state(num_trials)
+    session = pd.Timedelta(seconds=TRIAL_SECONDS + 2 * SESSION_LEAD_SECONDS + SESSION_GAP_SECONDS)
+    day = pd.Timestamp(start)
+    local = day + pd.Timedelta(hours=DAY_START_HOUR)
+
+    specs = []
+    for i in range(num_trials):
+        if local + session > day + pd.Timedelta(hours=DAY_END_HOUR):
+            day += pd.Timedelta(days=1)
+            local = day + pd.Timedelta(hours=DAY_START_HOUR)
+        num_obstacles, num_humans = combinations[i % len(combinations)]
+        start_ns = (local - BOARD_UTC_OFFSET + pd.Timedelta(seconds=SESSION_LEAD_SECONDS)).value
+        specs.append({'num_obstacles': num_obstacles, 'num_humans': num_humans, 'trial': i // len(combinations) + 1,
+                      'start_ns': start_ns, 'seed': int(seeds[i])})
+        local += session
+    return specs
+
+
+def simulate_experiments(num_trials, output_dir, start='2025-03-10', seed=0, workers=None):
+    """
+    Simulate num_trials trials across a process pool and write their raw files and the ground truth.
+    The output only depends on num_trials, start and seed, not on the number of workers.
+    """
+    specs = trial_specs(num_trials, start, seed)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        records = list(pool.map(simulate_trial, specs, [output_dir] * len(specs), chunksize=max(len(specs) // 64, 1)))
+
+    with open(os.path.join(output_dir, 'simulation_config.json'), 'w') as f:
+        json.dump(records, f, indent=4)
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate room-scale trials and write their raw sensor files.')
+    parser.add_argument('--trials', type=int, default=2 * len(OBSTACLE_COUNTS) * len(HUMAN_COUNTS))
+    parser.add_argument('--output-dir', default='simulated')
+    parser.add_argument('--start', default='2025-03-10', help='first day of the simulated sessions')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    records = simulate_experiments(args.trials, args.output_dir, args.start, args.seed, args.workers)
+    collisions = sum(len(record['collisions']) for record in records)
+    print(f"Simulated {len(records)} trials ({collisions} collisions) into {os.path.abspath(args.output_dir)} "
+          f"in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
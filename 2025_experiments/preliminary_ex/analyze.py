@@ -1,3 +1,4 @@
+import os
 import pandas as pd
 import json
 import numpy as np
@@ -59,11 +60,14 @@ def calculate_turning_activity_stats(merged_df):
         
         assert len(start_times) == len(end_times)
         total_turning_duration = sum((pd.to_datetime(end_times) - pd.to_datetime(start_times)).total_seconds())
+        # Measured experiment span instead of the nominal 300 s
+        experiment_duration = (group['timestamp'].max() - group['timestamp'].min()).total_seconds()
 
         activity_durations.append({
             'num_obstacles': num_obstacles, 
             'trial': trial,
             'total_turning_duration': total_turning_duration,
+            'measurable_time': experiment_duration - total_turning_duration,
         })
     
     activity_df = pd.DataFrame(activity_durations)
@@ -72,35 +76,89 @@ def calculate_turning_activity_stats(merged_df):
     
     return activity_df, stats
 
-def find_turning_threshold(merged_df, time_window='1s'):
+def optimal_threshold(X, y, metric='accuracy'):
+    """
+    Find the exact threshold maximising the accuracy (or F1) of the rule X >= threshold.
+    The window values are sorted once and the confusion counts for every candidate threshold
+    (each distinct value, plus one above the maximum) come from cumulative label counts.
+    NaN windows are never predicted as turning (NaN >= threshold is False) but still count in the scores.
+    Returns (threshold, accuracy, f1).
+    """
+    valid = ~np.isnan(X)
+    if not valid.any():
+        raise ValueError("optimal_threshold needs at least one non-NaN window value")
+    order = np.argsort(X[valid], kind='stable')
+    xs = X[valid][order]
+    ys = y[valid][order].astype(np.int64)
+    n = len(xs)
+    n_pos = ys.sum()
+    nan_pos = int(y[~valid].astype(np.int64).sum())
+    nan_neg = int((~valid).sum()) - nan_pos
+
+    # Predicting X >= xs[i] marks everything from the first occurrence of xs[i] onwards as turning
+    first = np.flatnonzero(np.r_[True, xs[1:] != xs[:-1]])
+    candidates = np.r_[xs[first], np.nextafter(xs[-1], np.inf)]
+    below = np.r_[first, n]
+    pos_below = np.r_[0, np.cumsum(ys)][below]
+
+    tp = n_pos - pos_below
+    fn = pos_below + nan_pos
+    tn = below - pos_below + nan_neg
+    fp = n - below - (n_pos - pos_below)
+    accuracy = (tp + tn) / len(X)
+    f1 = np.divide(2 * tp, 2 * tp + fp + fn, out=np.zeros(len(tp)), where=(2 * tp + fp + fn) > 0)
+
+    best = np.argmax(f1 if metric == 'f1' else accuracy)
+    return candidates[best], accuracy[best], f1[best]
+
+
+def aggregate_windows(merged_df, time_window='1s'):
+    """
+    Average gyroscope_z over fixed windows and mark windows that overlap an annotated turn.
+    """
+    window_start = merged_df['timestamp'].dt.floor(time_window)
+    return merged_df.groupby(window_start.rename('window_start')).agg(
+        window_gyroscope_z=('gyroscope_z', 'mean'),
+        window_is_turning=('is_turning', 'any')
+    )
+
+
+def search_turning_thresholds(merged_df, time_windows=('0.5s', '1s', '2s'), features=('signed', 'abs'), metric='accuracy'):
+    """
+    Exact threshold search for several window sizes and gyro features in one call.
+    'signed' thresholds the window mean of gyroscope_z, 'abs' its absolute value (as the turning detector does).
+    Returns one row per (time_window, feature) with the best threshold, its accuracy and F1.
+    """
+    results = []
+    for time_window in time_windows:
+        agg_df = aggregate_windows(merged_df, time_window)
+        y = agg_df['window_is_turning'].astype(int).values
+        for feature in features:
+            X = agg_df['window_gyroscope_z'].values
+            if feature == 'abs':
+                X = np.abs(X)
+            threshold, accuracy, f1 = optimal_threshold(X, y, metric)
+            results.append({'time_window': time_window, 'feature': feature, 'threshold': threshold,
+                            'accuracy': accuracy, 'f1': f1})
+    return pd.DataFrame(results)
+
+
+def find_turning_threshold(merged_df, time_window='1s', metric='accuracy'):
     """
     This function calculates the average of the gyroscope's z-axis angular velocity for each window,
-    and finds the threshold value that best matches the annotation using a simple search.
+    and finds the threshold value that best matches the annotation with an exact sorted search.
     It outputs the threshold value and its classification accuracy, and returns the threshold value.
     """
 
     merged_df['window_start'] = merged_df['timestamp'].dt.floor(time_window)
-    
-    agg_df = merged_df.groupby('window_start').agg(
-        window_gyroscope_z=('gyroscope_z', 'mean'),
-        window_is_turning=('is_turning', lambda x: x.any())
-    )
+    agg_df = aggregate_windows(merged_df, time_window)
     
     X = agg_df['window_gyroscope_z'].values
     y = agg_df['window_is_turning'].astype(int).values
     
-    thresholds = np.linspace(X.min(), X.max(), num=10000)
-    best_threshold = None
-    best_accuracy = -np.inf
-    
-    for thresh in thresholds:
-        preds = (X >= thresh).astype(int)
-        accuracy = np.mean(preds == y)
-        if accuracy > best_accuracy:
-            best_accuracy = accuracy
-            best_threshold = thresh
+    best_threshold, best_accuracy, best_f1 = optimal_threshold(X, y, metric)
             
-    print("Best threshold found: {:.4f} with accuracy: {:.2f}%".format(best_threshold, best_accuracy * 100))
+    print("Best threshold found: {:.4f} with accuracy: {:.2f}% (F1: {:.3f})".format(best_threshold, best_accuracy * 100, best_f1))
 
     agg_df['window_is_turning_pred'] = agg_df['window_gyroscope_z'] >= best_threshold
     new_df = merged_df.merge(agg_df, left_on='window_start', right_index=True, how='left')
@@ -115,13 +173,16 @@ def main():
     print(merged_df.columns)
     print(merged_df.head())
     
-    # activity_df, activity_stats = calculate_turning_activity_stats(merged_df)
-    # print("Turning Activity Statistics by num_obstacles:")
-    # print(activity_stats)
-    # activity_df.to_csv('activity_duration.csv', index=False)
+    # Turning and measurable time per trial, read by make_plot.py
+    activity_df, activity_stats = calculate_turning_activity_stats(merged_df)
+    print("Turning Activity Statistics by num_obstacles:")
+    print(activity_stats)
+    os.makedirs('log_for_plot', exist_ok=True)
+    activity_df.to_csv('log_for_plot/activity_duration.csv', index=False)
 
     # 1s, thresh = 0.0338 -> acc. 90.55%
     time_window = '1s'
+    print(search_turning_thresholds(merged_df))
     best_threshold, prediction_df = find_turning_threshold(merged_df, time_window)
     print(prediction_df.columns)
     print(prediction_df.head())
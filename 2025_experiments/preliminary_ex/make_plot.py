@@ -4,7 +4,7 @@ import seaborn as sns
 import pandas as pd
 import numpy as np
 
-def plot_turning_activity_distribution(activity_df):
+def plot_turning_activity_distribution(activity_df, output='figures/turning_activity_duration_boxplot.png'):
     box_edge_color = 'black'
     box_line_width = 1.5
     box_palette = ["#f2f3ae","#edd382","#fc9e4f","#f4442e"]
@@ -28,10 +28,9 @@ def plot_turning_activity_distribution(activity_df):
     plt.yticks(fontsize=yticks_fontsize)
 
     plt.ylim(0, 300)
-    plt.savefig('figures/turning_activity_duration_boxplot.png')
-    plt.show()
+    plt.savefig(output)
 
-def plot_opportunistic_measurable_time(activity_df):
+def plot_opportunistic_measurable_time(activity_df, output='figures/obstacles_measurable_time.png'):
 
     measurable_color = "#DB5461"
     turning_color = "#DBF1FA"
@@ -48,8 +47,9 @@ def plot_opportunistic_measurable_time(activity_df):
     yticks_fontsize = 12
     legend_fontsize = 12
     
-    # Compute measurable time
-    activity_df['measurable_time'] = 300 - activity_df['total_turning_duration']
+    # Use the measured time when available; older logs only have the turning duration
+    if 'measurable_time' not in activity_df:
+        activity_df['measurable_time'] = 300 - activity_df['total_turning_duration']
     
     # Group by num_obstacles and compute mean and std
     grouped_df = activity_df.groupby('num_obstacles').agg(
@@ -91,13 +91,9 @@ def plot_opportunistic_measurable_time(activity_df):
     # Add legend
     plt.legend(loc='upper right', fontsize=legend_fontsize)
 
-    plt.savefig('figures/obstacles_measurable_time.png')
-    plt.show()
+    plt.savefig(output)
 
-def plot_overlaid_signal(prediction_df):
-    num_obstacles = 1
-    trial = 2
-    threshold = 0.0338
+def plot_overlaid_signal(prediction_df, num_obstacles=1, trial=2, threshold=0.0338, output='figures/gyronorm_with_pred_overlay_v2.png'):
 
     line_color = '#3F3F3F'
     line_width = 2
@@ -187,8 +183,7 @@ def plot_overlaid_signal(prediction_df):
         if l not in unique:
             unique[l] = h
     ax2.legend(unique.values(), unique.keys(), loc='upper right', fontsize=legend_label_fontsize)
-    plt.savefig('figures/gyronorm_with_pred_overlay_v2.png')
-    plt.show()
+    plt.savefig(output)
 
 def main():
     activity_df = pd.read_csv('log_for_plot/activity_duration.csv')
@@ -196,6 +191,8 @@ def main():
     # plot_turning_activity_distribution(activity_df)
     # plot_opportunistic_measurable_time(activity_df)
     plot_overlaid_signal(prediction_df)
+    # Only when run directly; render_figures.py saves the figures without showing them
+    plt.show()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,51 +1,128 @@
+import argparse
 import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
 
-def aggregate_csv_files(base_dir, output_file):
-    all_data = []
-    
-    for subdir in os.listdir(base_dir):
-        subdir_path = os.path.join(base_dir, subdir)
-        if not os.path.isdir(subdir_path):
-            continue
-        
-        acc_file = os.path.join(subdir_path, 'Accelerometer.csv')
-        gyro_file = os.path.join(subdir_path, 'Gyroscope.csv')
-        orient_file = os.path.join(subdir_path, 'Orientation.csv')
-        
-        if not all(os.path.exists(f) for f in [acc_file, gyro_file, orient_file]):
+# Sensor Logger files of a recording and the names of their value columns in the aggregated data
+SENSOR_COLUMNS = {
+    'Accelerometer.csv': {"z": "accelerometer_z", "y": "accelerometer_y", "x": "accelerometer_x"},
+    'Gyroscope.csv': {"z": "gyroscope_z", "y": "gyroscope_y", "x": "gyroscope_x"},
+    'Orientation.csv': {
+        "qz": "orientation_qz", "qy": "orientation_qy", "qx": "orientation_qx", "qw": "orientation_qw",
+        "roll": "orientation_roll", "pitch": "orientation_pitch", "yaw": "orientation_yaw"
+    },
+}
+
+
+def read_sensor(path, columns):
+    """
+    Reads one sensor CSV with its columns renamed, indexed by sorted 'time'.
+    """
+    df = pd.read_csv(path).drop(columns=['seconds_elapsed'], errors='ignore').rename(columns=columns)
+    df = df.set_index('time')
+    if not df.index.is_monotonic_increasing:
+        df = df.sort_index(kind='stable')
+    return df
+
+
+def align_sensors(frames):
+    """
+    Outer join of the sensor frames on their sorted time index, in time order.
+    Repeated times of a sensor are paired with the other sensors' rows of that time in order of occurrence.
+    """
+    if not all(df.index.is_unique for df in frames):
+        frames = [df.set_index(df.groupby(level=0).cumcount(), append=True) for df in frames]
+    merged = pd.concat(frames, axis=1, join='outer', sort=True)
+    return merged.reset_index(level='time').reset_index(drop=True)
+
+
+def write_columns(df, path):
+    # One array per column in an uncompressed .npz, replaced atomically
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **{name: df[name].to_numpy() for name in df.columns})
+    os.replace(tmp_path, path)
+
+
+def aggregate_subdirectory(base_dir, subdir, output_dir):
+    """
+    Aligns the Accelerometer, Gyroscope and Orientation data of one recording and writes them to
+    <output_dir>/<subdir>.npz. Returns the number of rows, or None if a CSV file is missing.
+    """
+    subdir_path = os.path.join(base_dir, subdir)
+    paths = [os.path.join(subdir_path, name) for name in SENSOR_COLUMNS]
+    if not all(os.path.exists(f) for f in paths):
+        return None
+
+    merged_df = align_sensors([read_sensor(path, columns) for path, columns in zip(paths, SENSOR_COLUMNS.values())])
+    write_columns(merged_df, os.path.join(output_dir, f"{subdir}.npz"))
+    return len(merged_df)
+
+
+def read_aggregated(output_dir, subdirs=None):
+    """
+    Reads the aggregated recordings (all, or the given subdirectories) into one DataFrame
+    with a 'source_directory' column, as the former aggregated CSV.
+    """
+    if subdirs is None:
+        subdirs = sorted(name[:-len('.npz')] for name in os.listdir(output_dir) if name.endswith('.npz'))
+    frames = []
+    for subdir in subdirs:
+        with np.load(os.path.join(output_dir, f"{subdir}.npz")) as columns:
+            df = pd.DataFrame({name: columns[name] for name in columns.files})
+        df['source_directory'] = subdir  # Add directory name for reference
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True)
+
+
+def export_csv(output_dir, csv_file):
+    """
+    Streams the aggregated recordings into one CSV, one recording in memory at a time.
+    """
+    subdirs = sorted(name[:-len('.npz')] for name in os.listdir(output_dir) if name.endswith('.npz'))
+    for i, subdir in enumerate(subdirs):
+        read_aggregated(output_dir, [subdir]).to_csv(csv_file, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+
+
+def aggregate_csv_files(base_dir, output_dir, workers=None):
+    """
+    Aggregates every recording subdirectory of base_dir into its own columnar file in output_dir,
+    reading the subdirectories concurrently in a process pool (serially in this process with workers=0).
+    Returns {subdirectory: rows} of the aggregated recordings.
+    """
+    subdirs = sorted(d for d in os.listdir(base_dir) if os.path.isdir(os.path.join(base_dir, d)))
+    os.makedirs(output_dir, exist_ok=True)
+    args = ([base_dir] * len(subdirs), subdirs, [output_dir] * len(subdirs))
+    if workers == 0:
+        rows = list(map(aggregate_subdirectory, *args))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            rows = list(pool.map(aggregate_subdirectory, *args))
+
+    aggregated = {}
+    for subdir, n in zip(subdirs, rows):
+        if n is None:
             print(f"Skipping {subdir} because one or more CSV files are missing.")
-            continue
-        
-        # Read CSV files
-        acc_df = pd.read_csv(acc_file).drop(columns=['seconds_elapsed'], errors='ignore')
-        gyro_df = pd.read_csv(gyro_file).drop(columns=['seconds_elapsed'], errors='ignore')
-        orient_df = pd.read_csv(orient_file).drop(columns=['seconds_elapsed'], errors='ignore')
-        
-        # Rename columns
-        acc_df = acc_df.rename(columns={"z": "accelerometer_z", "y": "accelerometer_y", "x": "accelerometer_x"})
-        gyro_df = gyro_df.rename(columns={"z": "gyroscope_z", "y": "gyroscope_y", "x": "gyroscope_x"})
-        orient_df = orient_df.rename(columns={
-            "qz": "orientation_qz", "qy": "orientation_qy", "qx": "orientation_qx", "qw": "orientation_qw",
-            "roll": "orientation_roll", "pitch": "orientation_pitch", "yaw": "orientation_yaw"
-        })
-        
-        # Merge dataframes on 'time'
-        merged_df = acc_df.merge(gyro_df, on='time', how='outer').merge(orient_df, on='time', how='outer')
-        merged_df['source_directory'] = subdir  # Add directory name for reference
-        
-        all_data.append(merged_df)
-    
-    # Concatenate all dataframes into a single dataframe
-    final_df = pd.concat(all_data, ignore_index=True)
-    
-    # Save merged CSV
-    final_df.to_csv(output_file, index=False)
-    print(f"Saved aggregated data at {output_file}")
-
-# Set paths
-base_directory = "raw_data"
-output_file = "aggregated_data.csv"
-
-# Run aggregation
-aggregate_csv_files(base_directory, output_file)
+        else:
+            aggregated[subdir] = n
+    return aggregated
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Aggregate the Sensor Logger recordings, one columnar file per recording.')
+    parser.add_argument('--base-dir', default="raw_data")
+    parser.add_argument('--output-dir', default="aggregated")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='processes reading the recordings (0: serial)')
+    parser.add_argument('--csv', help='also stream all recordings into this CSV file, e.g. aggregated_sensor_data.csv')
+    args = parser.parse_args()
+
+    # Run aggregation
+    aggregated = aggregate_csv_files(args.base_dir, args.output_dir, args.workers)
+    print(f"Saved {len(aggregated)} aggregated recordings ({sum(aggregated.values())} rows) in {args.output_dir}")
+    if args.csv:
+        export_csv(args.output_dir, args.csv)
+        print(f"Saved aggregated data at {args.csv}")
+
+if __name__ == "__main__":
+    main()
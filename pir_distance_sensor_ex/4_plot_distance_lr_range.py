@@ -1,9 +1,11 @@
 import pandas as pd
 import matplotlib.pyplot as plt
 from color_config import BLACK_COLOR
+from stages import build_pipeline
 
 
-def plot_window(df, start_time, end_time, output_name):
+def plot_window(df, start_time, end_time, output):
+    start_time, end_time = pd.Timestamp(start_time), pd.Timestamp(end_time)
     window_df = df[(df["timestamp"] >= start_time) & (df["timestamp"] <= end_time)].copy()
     window_df["elapsed_sec"] = (window_df["timestamp"] - start_time).dt.total_seconds()
     distance_df = window_df[window_df["distance"].notna()]
@@ -24,15 +26,29 @@ def plot_window(df, start_time, end_time, output_name):
     ax2.set_xlabel("Time (s)")
 
     fig.tight_layout()
-    fig.savefig(output_name, dpi=150)
+    fig.savefig(output, dpi=150)
     plt.close(fig)
 
 
+def load_phase_data():
+    """
+    The merged data with turning and phase predictions (formerly result_df.csv), from the cached pipeline.
+    The plotted PIR and distance samples are the same for every detector.
+    """
+    return build_pipeline('pir').run('phase')
+
+
+def load_combo_data():
+    """
+    The merged data with the predictions of the PIR-gated distance detector (formerly new_result_df.csv),
+    for the figure on the false positives the PIR gate removes.
+    """
+    return build_pipeline('combo').run('pir_gate')
+
+
 def main():
-    df = pd.read_csv("result_df.csv")
-    df["timestamp"] = pd.to_datetime(df["timestamp"])
-    df_new = pd.read_csv("new_result_df.csv")
-    df_new["timestamp"] = pd.to_datetime(df_new["timestamp"])
+    df = load_phase_data()
+    combo_df = load_combo_data()
 
     ranges = [
         (
@@ -48,15 +64,15 @@ def main():
             "11_approaching.png",
         ),
         (
-            df_new,
+            combo_df,
             pd.to_datetime("2025-03-10 14:11:37"),
             pd.to_datetime("2025-03-10 14:11:47"),
             "12_pir_reduce_false_positive.png",
         ),
     ]
 
-    for data, start_time, end_time, output_name in ranges:
-        plot_window(data, start_time, end_time, output_name)
+    for data, start_time, end_time, output in ranges:
+        plot_window(data, start_time, end_time, output)
 
 
 if __name__ == "__main__":
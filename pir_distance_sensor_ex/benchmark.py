@@ -0,0 +1,225 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from pipeline import copy_output, normalize_output, output_size
+from profiling import traced_peak
+from stages import DETECTORS, build_pipeline, merge_data, typed_frame
+
+# 100 h takes long and several GB of memory; add it with --hours 1,10,100
+DEFAULT_HOURS = (1, 10)
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+
+# Sample rates of the recordings: phone IMU logger at 100 Hz, PIR and distance boards every 200 ms
+GYRO_HZ = 100
+PIR_DISTANCE_HZ = 5
+COLLISIONS_PER_MINUTE = 2
+
+# Robot route: a straight run towards the wall (distance out of range, then decreasing) and a turn, repeated
+CYCLE_SECONDS = 25
+APPROACH_START = 8
+TURN_START = 22
+EXPERIMENT_MINUTES = 10
+EXPERIMENT_GAP_SECONDS = 30
+
+
+def synthetic_raw_data(hours, seed=0, start='2025-03-10 13:00:00'):
+    """
+    Synthetic inputs of merge_data covering hours of recording: the gyro/accelerometer log, the PIR/distance
+    log, the collision annotations and the experiment config.
+    """
+    rng = np.random.default_rng(seed)
+    start_ns = pd.Timestamp(start).value
+    duration = hours * 3600
+
+    # Phone IMU: turning bursts on gyroscope_z at the end of each cycle
+    n = int(duration * GYRO_HZ)
+    t = np.arange(n) / GYRO_HZ + rng.uniform(0, 0.002, n)
+    turning = t % CYCLE_SECONDS >= TURN_START
+    gyro = pd.DataFrame({
+        'timestamp': start_ns + (t * 1e9).astype(np.int64),
+        'gyroscope_x': rng.normal(0, 0.02, n),
+        'gyroscope_y': rng.normal(0, 0.02, n),
+        'gyroscope_z': np.where(turning, 0.6, 0.0) + rng.normal(0, 0.003, n),
+        'accelerometer_x': rng.normal(0, 0.3, n),
+        'accelerometer_y': rng.normal(0, 0.3, n),
+        'accelerometer_z': rng.normal(0, 0.3, n),
+    })
+
+    # Pedestrians cross at random times; annotated as collisions
+    n_collisions = rng.poisson(duration / 60 * COLLISIONS_PER_MINUTE)
+    crossings = np.sort(rng.uniform(0, duration, n_collisions))
+    annotation = pd.DataFrame({
+        'timestamp': start_ns / 1e9 + crossings,
+        'event': 'collision',
+        'human_id': rng.integers(1, 5, n_collisions),
+    })
+
+    # PIR/distance board: out of range (255) far from the wall, a linear approach, dips while a pedestrian crosses
+    m = int(duration * PIR_DISTANCE_HZ)
+    s = np.arange(m) / PIR_DISTANCE_HZ + rng.uniform(0, 0.02, m)
+    cycle = s % CYCLE_SECONDS
+    distance = np.where((cycle >= APPROACH_START) & (cycle < TURN_START),
+                        255 - (cycle - APPROACH_START) * 15, 255) + rng.normal(0, 3, m)
+    since_crossing = s - crossings[np.maximum(np.searchsorted(crossings, s, side='right') - 1, 0)] if n_collisions else np.full(m, np.inf)
+    crossing = (since_crossing >= 0) & (since_crossing < 1)
+    distance = np.where(crossing, np.minimum(distance, rng.uniform(60, 120, m)), distance)
+    pir = crossing | (rng.random(m) < 0.02)
+    pir_distance = pd.DataFrame({
+        'timestamp': pd.to_datetime(start_ns + (s * 1e9).astype(np.int64)).strftime('%Y-%m-%d %H:%M:%S.%f'),
+        'PIRvalue': pir.astype(int),
+        'distance': np.clip(distance, 0, 255).round(1),
+    })
+
+    # Back-to-back experiments of three trials each
+    config = []
+    length = EXPERIMENT_MINUTES * 60
+    for k, experiment_start in enumerate(np.arange(0, duration - length + 1, length + EXPERIMENT_GAP_SECONDS)):
+        config.append({'experiment_id': k // 3 + 1, 'trial': k % 3 + 1,
+                       'experiment_start': start_ns / 1e9 + experiment_start,
+                       'experiment_end': start_ns / 1e9 + experiment_start + length})
+
+    return pir_distance, gyro, annotation, config
+
+
+def measure(func, *args):
+    """
+    Run func(*args) twice: under tracemalloc for the peak memory above the start, then untraced for the
+    wall time, as tracing slows allocation-heavy code down severalfold. DataFrame arguments are copied for
+    each run, since merge_data updates its inputs in place.
+    Returns (result of the timed run, wall time in seconds, peak in MB).
+    """
+    peak = traced_peak(func, fresh_args(args), {})
+    args = fresh_args(args)
+    start = time.perf_counter()
+    result = func(*args)
+    wall = time.perf_counter() - start
+    return result, wall, peak / 2**20
+
+
+def fresh_args(args):
+    return [arg.copy() if isinstance(arg, pd.DataFrame) else arg for arg in args]
+
+
+def run_stage(func, inputs, params):
+    # As Pipeline.run: every stage gets its own copy of the inputs and its output is cast to the storage dtypes
+    with pd.option_context('mode.copy_on_write', True):
+        return normalize_output(func(*[copy_output(df) for df in inputs], **params), typed_frame)
+
+
+def benchmark_size(hours, detector='combo', seed=0):
+    """
+    Time every stage of build_pipeline(detector) on a synthetic dataset of the given length, starting with
+    merge_data on the raw inputs, whose output (cast to the storage dtypes) feeds the later stages.
+    """
+    raw = synthetic_raw_data(hours, seed)
+    results = {}
+    merged, wall, peak = measure(merge_data, *raw)
+    results['merge_data'] = {'wall_s': wall, 'peak_mb': peak, 'rows_in': len(raw[1]), 'rows_out': len(merged),
+                             'rows_per_s': len(raw[1]) / wall if wall > 0 else None}
+    outputs = {'merged': typed_frame(merged)}
+    rows = len(outputs['merged'])
+    del raw, merged
+    pipeline = build_pipeline(detector, verbose=False)
+    names = list(pipeline.stages)
+    last_use = {dep: i for i, name in enumerate(names) for dep in pipeline.stages[name].deps}
+
+    for i, name in enumerate(names[1:], start=1):
+        stage = pipeline.stages[name]
+        inputs = [outputs[dep] for dep in stage.deps]
+        result, wall, peak = measure(run_stage, stage.func, inputs, stage.params)
+        rows_in, rows_out = output_size(inputs[0])[0], output_size(result)[0]
+        results[name] = {'wall_s': wall, 'peak_mb': peak, 'rows_in': rows_in, 'rows_out': rows_out,
+                         'rows_per_s': rows_in / wall if wall > 0 else None}
+        outputs[name] = result
+        del inputs, result
+        # Drop the outputs no later stage reads, so memory follows the pipeline rather than the whole run
+        for dep in stage.deps:
+            if last_use[dep] == i:
+                del outputs[dep]
+
+    return {'hours': hours, 'rows': rows, 'stages': results}
+
+
+def run_benchmark(hours_list=DEFAULT_HOURS, detector='combo', seed=0, verbose=True):
+    report = {
+        'meta': {
+            'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+            'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'detector': detector, 'seed': seed,
+            'gyro_hz': GYRO_HZ, 'pir_distance_hz': PIR_DISTANCE_HZ,
+        },
+        'results': [],
+    }
+    for hours in hours_list:
+        result = benchmark_size(hours, detector, seed)
+        report['results'].append(result)
+        if verbose:
+            print_result(result)
+    return report
+
+
+def print_result(result):
+    print(f"\n{result['hours']:g} h ({result['rows']} merged rows)")
+    print(f"{'stage':<12} {'wall_s':>9} {'peak_mb':>9} {'rows_in':>10} {'rows_out':>10}")
+    for name, stats in result['stages'].items():
+        print(f"{name:<12} {stats['wall_s']:>9.3f} {stats['peak_mb']:>9.1f} {stats['rows_in']:>10} {stats['rows_out']:>10}")
+
+
+def compare_to_baseline(report, baseline, tolerance=0.25, min_seconds=0.05, min_mb=5.0):
+    """
+    Stages of report that are slower or use more memory than in baseline by more than tolerance
+    (a fraction), ignoring differences below min_seconds / min_mb. Returns one line per regression.
+    """
+    previous = {result['hours']: result['stages'] for result in baseline['results']}
+    regressions = []
+    for result in report['results']:
+        for name, stats in result['stages'].items():
+            old = previous.get(result['hours'], {}).get(name)
+            if old is None:
+                continue
+            for metric, floor in (('wall_s', min_seconds), ('peak_mb', min_mb)):
+                if stats[metric] > old[metric] * (1 + tolerance) and stats[metric] - old[metric] > floor:
+                    regressions.append(f"{result['hours']:g} h {name} {metric}: {old[metric]:.3f} -> {stats[metric]:.3f} "
+                                       f"({stats[metric] / old[metric] if old[metric] else float('inf'):.2f}x)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the analysis stages on synthetic datasets.')
+    parser.add_argument('--hours', type=lambda v: [float(h) for h in v.split(',')], default=list(DEFAULT_HOURS),
+                        help='comma-separated dataset lengths in hours, e.g. 1,10,100 to include 100 h')
+    parser.add_argument('--detector', choices=DETECTORS, default='combo')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown/growth as a fraction')
+    args = parser.parse_args()
+
+    report = run_benchmark(args.hours, args.detector, args.seed)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f"\nResults written to {os.path.abspath(args.output)}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=4)
+        print(f"Baseline written to {os.path.abspath(args.baseline)}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"[regression] {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import column_store
+from evaluation import evaluate_by_experiment, print_evaluation, remove_data_out_of_measurable_time, summarize_metrics
+from pipeline import DEFAULT_CACHE_DIR, is_cached
+from stages import (DATA_FILES, DETECTORS, EXPERIMENT_KEYS, add_sensor_max_approach_time_prediction,
+                    add_turning_time_prediction, apply_detector, build_pipeline, typed_frame)
+from time_windows import to_ns
+
+# Merged frames already memory-mapped by this worker process, by cache path
+_merged_frames = {}
+
+
+def experiment_ranges(timestamps, config_file, keys=EXPERIMENT_KEYS['pir_distance_sensor_ex']):
+    """
+    Row ranges [start, stop) of each experiment in ex_duration_config.json on the sorted merged timeline, with
+    the values of its keys fields. Rows inside [experiment_start, experiment_end] belong to the experiment,
+    as in merge_data.
+    """
+    with open(config_file) as f:
+        config_list = json.load(f)
+    timestamps = to_ns(timestamps)
+
+    ranges = []
+    for config in config_list:
+        start = np.searchsorted(timestamps, pd.to_datetime(config['experiment_start'], unit='s').value, side='left')
+        stop = np.searchsorted(timestamps, pd.to_datetime(config['experiment_end'], unit='s').value, side='right')
+        ranges.append((*(config[key] for key in keys), int(start), int(stop)))
+    return ranges
+
+
+def run_experiment(detector, merged_path, start, stop, params):
+    """
+    Run the detection stages on the rows [start, stop) of the merged stage output.
+    Returns the per-experiment metrics table and the measurable time per phase.
+    """
+    if merged_path not in _merged_frames:
+        _merged_frames[merged_path] = column_store.read_frame(merged_path, mmap=True)
+    df = _merged_frames[merged_path].iloc[start:stop].copy()
+
+    # Same stages and dtypes as the cached pipeline, starting with fresh state at the experiment start
+    df = typed_frame(add_turning_time_prediction(df, threshold=params['turning_threshold']))
+    df = typed_frame(add_sensor_max_approach_time_prediction(df, params['sensor_threshold'], params['tolerance']))
+    df = typed_frame(apply_detector(df, detector, params['sensor_threshold'], params['distance_threshold'],
+                                    params['time_threshold'], params['pir_time_window']))
+    df, measurable_time = remove_data_out_of_measurable_time(df, params['transition_window'])
+    return evaluate_by_experiment(df, params['evaluation_window']), measurable_time
+
+
+def run_by_experiment(detector, data_files=None, cache_dir=DEFAULT_CACHE_DIR, workers=None, turning_threshold=0.0338,
+                      sensor_threshold=230, tolerance=2, distance_threshold=40, time_threshold=6, pir_time_window='1s',
+                      transition_window='0.5s', evaluation_window='3s', experiment_set='pir_distance_sensor_ex'):
+    """
+    Split the merged data on the experiment boundaries of the config file and run each experiment in a
+    process pool (serially in this process with workers=0). Experiments are keyed by the config fields of
+    experiment_set (see EXPERIMENT_KEYS), e.g. num_obstacles and trial for main_ex.
+    Each experiment starts from fresh state: the turning rolling window, the phase state machine, the crossing
+    blocks and the transition windows begin at its first row and do not see the neighbouring experiments, so
+    detections near a boundary can differ from the whole-frame run of build_pipeline.
+    Returns the per-experiment metrics and the measurable time per experiment and phase.
+    """
+    data_files = data_files or DATA_FILES
+    keys = list(EXPERIMENT_KEYS[experiment_set])
+    pipeline = build_pipeline(detector, data_files, cache_dir, experiment_set=experiment_set)
+    if not is_cached(pipeline.cache_path('merged')):
+        pipeline.run('merged')
+    merged_path = os.path.join(pipeline.cache_path('merged'), 'part0')
+    timestamps = column_store.read_frame(merged_path, columns=['timestamp'], mmap=True)['timestamp']
+    ranges = experiment_ranges(timestamps, data_files['config_file'], keys)
+
+    params = dict(turning_threshold=turning_threshold, sensor_threshold=sensor_threshold, tolerance=tolerance,
+                  distance_threshold=distance_threshold, time_threshold=time_threshold,
+                  pir_time_window=pir_time_window, transition_window=transition_window,
+                  evaluation_window=evaluation_window)
+    args = [(detector, merged_path, start, stop, params) for _, _, start, stop in ranges]
+    if workers == 0:
+        results = [run_experiment(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(run_experiment, *zip(*args)))
+
+    # The merged frame stores the keys in its experiment_id and trial columns
+    metrics = pd.concat([m for m, _ in results], ignore_index=True).rename(columns=dict(zip(['experiment_id', 'trial'], keys)))
+    measurable_time = pd.DataFrame([mt for _, mt in results],
+                                   index=pd.MultiIndex.from_tuples([r[:2] for r in ranges], names=keys))
+    return metrics, measurable_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the detection pipeline per experiment in a process pool.')
+    parser.add_argument('--detector', choices=DETECTORS, default='combo')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--experiment-set', choices=EXPERIMENT_KEYS, default='pir_distance_sensor_ex',
+                        help='layout of the config file: main_ex keys its experiments by num_obstacles and trial')
+    parser.add_argument('--compare-serial', action='store_true', help='also run serially and report the speedup')
+    args = parser.parse_args()
+
+    # Build the merged stage first so neither timing includes it
+    pipeline = build_pipeline(args.detector, cache_dir=args.cache_dir, experiment_set=args.experiment_set)
+    if not is_cached(pipeline.cache_path('merged')):
+        pipeline.run('merged')
+
+    start = time.perf_counter()
+    metrics, measurable_time = run_by_experiment(args.detector, cache_dir=args.cache_dir, workers=args.workers,
+                                                 experiment_set=args.experiment_set)
+    parallel_time = time.perf_counter() - start
+
+    print("Measurable time by experiment and phase (s):")
+    print(measurable_time)
+    print(metrics.to_string(index=False))
+    print_evaluation(summarize_metrics(metrics, ['phase']).set_index('phase'))
+    print(f"\nParallel run ({args.workers} workers): {parallel_time:.2f} s")
+
+    if args.compare_serial:
+        start = time.perf_counter()
+        serial_metrics, _ = run_by_experiment(args.detector, cache_dir=args.cache_dir, workers=0,
+                                              experiment_set=args.experiment_set)
+        serial_time = time.perf_counter() - start
+        print(f"Serial run: {serial_time:.2f} s, speedup {serial_time / parallel_time:.2f}x")
+        if not serial_metrics.equals(metrics):
+            print("Warning: serial and parallel metrics differ")
+
+
+if __name__ == "__main__":
+    main()
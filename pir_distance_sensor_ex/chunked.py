@@ -0,0 +1,448 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+import column_store
+from evaluation import PHASES, evaluate_performance, print_evaluation, remove_data_out_of_measurable_time, run_starts
+from pipeline import DEFAULT_CACHE_DIR, is_cached
+from stages import (APPROACHING, DETECTORS, PHASE_DTYPE, SENSOR_MAX, add_pir_distance_combo_prediction,
+                    add_pir_only_prediction, add_turning_time_prediction, build_pipeline, run_phase_state_machine,
+                    typed_frame)
+from time_windows import covered_ns, merge_windows, to_ns, window_ns
+
+DEFAULT_CHUNK_ROWS = 100_000
+
+
+def concat(*frames):
+    frames = [df for df in frames if df is not None and len(df)]
+    if not frames:
+        return None
+    return frames[0] if len(frames) == 1 else pd.concat(frames)
+
+
+class TurningStage:
+    """
+    add_turning_time_prediction over chunks. The samples of the last second are kept for the rolling mean.
+    """
+
+    def __init__(self, threshold=0.0338):
+        self.threshold = threshold
+        self.tail = None
+
+    def push(self, chunk):
+        df = concat(self.tail, chunk)
+        if df is None:
+            return chunk
+        out = add_turning_time_prediction(df, threshold=self.threshold).iloc[len(df) - len(chunk):]
+        out.index = chunk.index
+        self.tail = df[df['timestamp'] > df['timestamp'].iloc[-1] - pd.Timedelta('1s')]
+        return out
+
+    def flush(self):
+        return None
+
+
+class PhaseStage:
+    """
+    add_sensor_max_approach_time_prediction over chunks. The state machine resumes from the carried state, but
+    a later sample can switch the below-threshold samples of earlier chunks to approaching_time. Instead of holding
+    rows back until that is decided, which can take a whole turning block or distance sensor dropout, a first pass
+    over the chunks records these late switches (late=None) and the later passes apply them to the rows of their
+    chunk (late: sorted row positions, see late_switches) before forward filling.
+    """
+
+    def __init__(self, sensor_threshold=230, tolerance=2, late=None):
+        self.sensor_threshold = sensor_threshold
+        self.tolerance = tolerance
+        self.late = late
+        self.switched = []
+        self.state = None
+        self.last_phase = -1
+
+    def push(self, chunk):
+        phase = chunk['phase_pred'].astype(PHASE_DTYPE).cat.codes.to_numpy().copy()
+        offset = chunk.index[0]
+        self.state = run_phase_state_machine(phase, chunk['distance'].to_numpy(dtype=float), self.sensor_threshold,
+                                             self.tolerance, self.state, offset,
+                                             self.switched if self.late is None else None)
+        if self.late is not None:
+            rows = self.late[np.searchsorted(self.late, offset):np.searchsorted(self.late, offset + len(chunk))]
+            phase[rows - offset] = APPROACHING
+
+        # Forward fill the phase codes, continuing from the last row of the previous chunk
+        last = np.maximum.accumulate(np.where(phase >= 0, np.arange(len(phase)), -1))
+        filled = np.where(last >= 0, phase[np.maximum(last, 0)], self.last_phase)
+        self.last_phase = filled[-1]
+        chunk['phase_pred'] = pd.Categorical.from_codes(filled, dtype=PHASE_DTYPE)
+        return chunk
+
+    def flush(self):
+        return None
+
+    def late_switches(self):
+        return np.unique(np.asarray(self.switched, dtype=np.int64))
+
+
+class BlockCounter:
+    """
+    Phase block ids as in add_pedestrian_crossed_prediction, continuing from the previous chunk. Missing phases
+    never compare equal, so each of their rows is a block of its own.
+    """
+
+    def __init__(self):
+        self.last_phase = -1
+        self.blocks = 0
+
+    def number(self, phase):
+        change = (phase != np.r_[self.last_phase, phase[:-1]]) | (phase < 0)
+        block = self.blocks + np.cumsum(change)
+        self.last_phase, self.blocks = phase[-1], block[-1]
+        return block
+
+
+def distance_samples(df, counter):
+    """
+    Row positions of the distance samples of a chunk with their block ids, phase codes, timestamps and distances.
+    """
+    phase = df['phase_pred'].cat.codes.to_numpy()
+    block = counter.number(phase)
+    distance = df['distance'].to_numpy()
+    rows = np.flatnonzero(~np.isnan(distance))
+    return rows, block, phase[rows], to_ns(df['timestamp'])[rows], distance[rows]
+
+
+def merge_moments(a, b):
+    """
+    Combine the (count, mean x, mean y, sum of squares of x, co-moment of x and y) of two sample sets.
+    """
+    if a[0] == 0 or b[0] == 0:
+        return a if b[0] == 0 else b
+    n = a[0] + b[0]
+    dx, dy = b[1] - a[1], b[2] - a[2]
+    return (n, a[1] + dx * b[0] / n, a[2] + dy * b[0] / n,
+            a[3] + b[3] + dx * dx * a[0] * b[0] / n, a[4] + b[4] + dx * dy * a[0] * b[0] / n)
+
+
+class BlockFitStage:
+    """
+    The part of add_pedestrian_crossed_prediction that needs a whole phase block, collected over chunks: the
+    regression of an approaching_time block, from the running moments of its decreasing samples, and whether a
+    sensor_max_time block has enough samples to look for waves. Only the open block is carried between chunks,
+    and a few numbers are kept per block that predicts anything. Rows are handed on unchanged.
+    """
+
+    def __init__(self, sensor_threshold=230, time_threshold=6):
+        self.sensor_threshold = sensor_threshold
+        self.time_threshold = time_threshold
+        self.counter = BlockCounter()
+        self.open = None
+        # Regression line of each approaching block. As in add_pedestrian_crossed_prediction, it is fitted with x in
+        # seconds from the first below-threshold sample and applied with x from the first sample (first, in ns)
+        self.fits = {'block': [], 'intercept': [], 'slope': [], 'first': []}
+        self.waves = []  # sensor_max blocks
+
+    def push(self, chunk):
+        rows, block, phase, timestamps, distance = distance_samples(chunk, self.counter)
+        block = block[rows]
+        bounds = np.flatnonzero(np.r_[True, block[1:] != block[:-1], True]) if len(rows) else []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            self._add(block[start], phase[start], timestamps[start:end], distance[start:end])
+        return chunk
+
+    def flush(self):
+        self._close()
+        return None
+
+    def _add(self, block, phase, timestamps, distance):
+        if self.open is None or self.open['block'] != block:
+            self._close()
+            self.open = {'block': block, 'phase': phase, 'first': timestamps[0], 'samples': 0, 'below': 0,
+                         'last_below': np.nan, 'origin': None, 'moments': (0, 0.0, 0.0, 0.0, 0.0)}
+        state = self.open
+        state['samples'] += len(distance)
+        below = distance < self.sensor_threshold
+        if phase != APPROACHING or not below.any():
+            return
+
+        # Regression samples: the first below-threshold sample and those lower than the previous one
+        timestamps, distance = timestamps[below], distance[below]
+        keep = distance < np.r_[state['last_below'], distance[:-1]]
+        if state['origin'] is None:
+            state['origin'] = timestamps[0]
+            keep[0] = True
+        state['below'] += len(distance)
+        state['last_below'] = distance[-1]
+        if keep.any():
+            x = (timestamps[keep] - state['origin']) / 1e9
+            y = distance[keep].astype(np.float64)
+            dx, dy = x - x.mean(), y - y.mean()
+            state['moments'] = merge_moments(state['moments'], (len(x), x.mean(), y.mean(), dx @ dx, dx @ dy))
+
+    def _close(self):
+        state, self.open = self.open, None
+        if state is None:
+            return
+        n, mean_x, mean_y, ss_x, co_xy = state['moments']
+        if state['phase'] == APPROACHING and state['below'] >= 2 and n >= self.time_threshold:
+            slope = co_xy / ss_x if ss_x > 0 else 0.0
+            # If the distance is increasing, skip
+            if slope <= 0:
+                for name, value in zip(self.fits, (state['block'], mean_y - slope * mean_x, slope, state['first'])):
+                    self.fits[name].append(value)
+        elif state['phase'] == SENSOR_MAX and state['samples'] >= self.time_threshold:
+            self.waves.append(state['block'])
+
+
+class CrossingStage:
+    """
+    add_pedestrian_crossed_prediction over chunks, with the block fits collected by a BlockFitStage in an earlier
+    pass over the same rows. Block ids continue from the previous chunks, and the wave state of the open
+    sensor_max block is carried, so rows are handed on as soon as their chunk is seen.
+    """
+
+    def __init__(self, fits, sensor_threshold=230, distance_threshold=40):
+        self.sensor_threshold = sensor_threshold
+        self.distance_threshold = distance_threshold
+        self.fits = {name: np.asarray(values, dtype=np.int64 if name in ('block', 'first') else np.float64)
+                     for name, values in fits.fits.items()}
+        self.wave_blocks = np.asarray(fits.waves, dtype=np.int64)
+        self.counter = BlockCounter()
+        self.last_sample = (0, False)  # block of the last distance sample and whether it was below the threshold
+
+    def push(self, chunk):
+        rows, block, _, timestamps, distance = distance_samples(chunk, self.counter)
+        sample_block = block[rows]
+        distance_pred = np.full(len(chunk), np.nan, dtype=np.float32)
+        pedestrian_pred = np.zeros(len(chunk), dtype=bool)
+
+        # Approaching blocks: the regression line from the first sample of the block
+        fitted = np.isin(sample_block, self.fits['block'])
+        fit = np.searchsorted(self.fits['block'], sample_block[fitted])
+        x = (timestamps[fitted] - self.fits['first'][fit]) / 1e9
+        predicted = x * self.fits['slope'][fit] + self.fits['intercept'][fit]
+        distance_pred[rows[fitted]] = predicted.astype(np.float32)
+        pedestrian_pred[rows[fitted]] = distance[fitted] + self.distance_threshold < predicted
+
+        # Sensor_max blocks: the first sample of each wave below the threshold
+        if len(rows):
+            below = distance < self.sensor_threshold
+            previous_block = np.r_[self.last_sample[0], sample_block[:-1]]
+            previous_below = np.r_[self.last_sample[1], below[:-1]] & (previous_block == sample_block)
+            wave = below & ~previous_below & np.isin(sample_block, self.wave_blocks)
+            pedestrian_pred[rows[wave]] = True
+            self.last_sample = (sample_block[-1], below[-1])
+
+        chunk['distance_diff'] = np.zeros(len(chunk), dtype=np.float32)
+        chunk['distance_pred'] = distance_pred
+        chunk['pedestrian_pred'] = pedestrian_pred
+        chunk['block'] = block.astype(np.int32)
+        return chunk
+
+    def flush(self):
+        return None
+
+
+class PirGateStage:
+    """
+    PIR gate (add_pir_only_prediction or add_pir_distance_combo_prediction) over chunks.
+    The rows of the last time_window are kept, so trailing windows see the PIR hits of the previous chunk.
+    """
+
+    def __init__(self, func, time_window='1s'):
+        self.func = func
+        self.time_window = time_window
+        self.tail = None
+
+    def push(self, chunk):
+        df = concat(self.tail, chunk)
+        if df is None:
+            return chunk
+        out = self.func(df, self.time_window).iloc[len(df) - len(chunk):]
+        out.index = chunk.index
+        self.tail = df[df['timestamp'] > df['timestamp'].iloc[-1] - pd.Timedelta(self.time_window)]
+        return out
+
+    def flush(self):
+        return None
+
+
+class MaskStage:
+    """
+    remove_data_out_of_measurable_time over chunks.
+    A row is handed on once every phase change that can reach it or the gap to the next row has been seen
+    (more than transition_window before the last row). Rows back to the last one more than transition_window
+    before the first pending row are kept as context, so the transitions before it are found as in one pass.
+    Measurable time is accumulated per row gap in integer nanoseconds, skipping the gaps between experiment runs.
+    """
+
+    def __init__(self, transition_window='0.5s'):
+        self.transition_window = transition_window
+        self.w = window_ns(transition_window)
+        self.context = None
+        self.pending = None
+        self.measurable_ns = dict.fromkeys(PHASES, 0)
+
+    def push(self, chunk):
+        df = concat(self.context, self.pending, chunk)
+        if df is None:
+            return chunk
+        n_context = 0 if self.context is None else len(self.context)
+        timestamps = to_ns(df['timestamp'])
+
+        # Row i is final when the next row plus the transition window lies before the last row
+        n_final = np.searchsorted(timestamps, timestamps[-1] - self.w, side='left') - 1
+        if n_final <= n_context:
+            self.pending = df.iloc[n_context:]
+            return df.iloc[:0]
+
+        out = self._mask(df, timestamps, n_context, n_final)
+        first_pending = n_final
+        start = max(np.searchsorted(timestamps, timestamps[first_pending] - self.w, side='left') - 1, 0)
+        self.context = df.iloc[start:first_pending]
+        self.pending = df.iloc[first_pending:]
+        return out
+
+    def flush(self):
+        df = concat(self.context, self.pending)
+        n_context = 0 if self.context is None else len(self.context)
+        self.context = self.pending = None
+        if df is None or len(df) == n_context:
+            return None
+        return self._mask(df, to_ns(df['timestamp']), n_context, len(df))
+
+    def measurable_time(self):
+        total = pd.Series(self.measurable_ns, dtype='float64')
+        return (total.reindex(PHASES, fill_value=0.0) / 1e9).rename('measurable_time')
+
+    def _mask(self, df, timestamps, first, last):
+        masked, _ = remove_data_out_of_measurable_time(df, self.transition_window)
+
+        # Gap from each handed-on row to the next one, minus the removed transition windows (the last row has none,
+        # nor has the last row of an experiment run)
+        phase_changes = (df['phase_pred'] != df['phase_pred'].shift()).to_numpy()
+        starts, ends = merge_windows(timestamps[phase_changes], self.w, self.w)
+        rows = np.arange(first, min(last, len(df) - 1))
+        gap = timestamps[rows + 1] - timestamps[rows] - covered_ns(starts, ends, timestamps[rows], timestamps[rows + 1])
+        gap[run_starts(df)[rows + 1]] = 0
+        phase = df['phase_pred'].to_numpy()[rows]
+        for name in PHASES:
+            self.measurable_ns[name] += int(gap[phase == name].sum())
+
+        return masked.iloc[first:last]
+
+
+def chunk_passes(detector, turning_threshold=0.0338, sensor_threshold=230, tolerance=2, distance_threshold=40,
+                 time_threshold=6, pir_time_window='1s', transition_window='0.5s'):
+    """
+    The chunked counterparts of the stages of build_pipeline, up to the masked stage, as the stage lists of the
+    passes over the chunks (see run_chunked). Each list is built from what the previous pass collected, so it
+    must be streamed before the next one is taken; the last one ends with the MaskStage.
+    """
+    phase = PhaseStage(sensor_threshold, tolerance)
+    yield [TurningStage(turning_threshold), phase]
+    late = phase.late_switches()
+
+    stages = [TurningStage(turning_threshold), PhaseStage(sensor_threshold, tolerance, late)]
+    if detector in ('distance', 'combo'):
+        fits = BlockFitStage(sensor_threshold, time_threshold)
+        yield stages + [fits]
+        stages = [TurningStage(turning_threshold), PhaseStage(sensor_threshold, tolerance, late),
+                  CrossingStage(fits, sensor_threshold, distance_threshold)]
+    if detector == 'combo':
+        stages.append(PirGateStage(add_pir_distance_combo_prediction, pir_time_window))
+    elif detector == 'pir':
+        stages.append(PirGateStage(add_pir_only_prediction, pir_time_window))
+    stages.append(MaskStage(transition_window))
+    yield stages
+
+
+def stream(merged_path, chunk_rows, stages, collect=None):
+    """
+    Push the chunks of a column store through stages, then flush them in order, passing what the last stage
+    hands on to collect.
+    """
+    def run_from(i, df):
+        for stage in stages[i:]:
+            if df is None:
+                return None
+            df = typed_frame(stage.push(df))
+        return df
+
+    # The stage functions update slices of the carried rows in place, as they do in Pipeline.run
+    with pd.option_context('mode.copy_on_write', True):
+        for chunk in column_store.iter_frames(merged_path, chunk_rows):
+            df = run_from(0, chunk.copy())
+            if collect is not None:
+                collect(df)
+        for i, stage in enumerate(stages):
+            df = stage.flush()
+            df = run_from(i + 1, None if df is None else typed_frame(df))
+            if collect is not None:
+                collect(df)
+
+
+def run_chunked(detector, merged_path, chunk_rows=DEFAULT_CHUNK_ROWS, evaluation_window='3s', output_dir=None, **params):
+    """
+    Stream the merged stage output (a column store written by the pipeline) through the detection stages in
+    time-ordered chunks of chunk_rows rows. The phase of a row and the predictions of a phase block can depend
+    on rows of later chunks (a late switch to approaching_time, the regression over a whole block), so instead of
+    holding rows back the chunks are streamed up to three times (see chunk_passes): to record the late switches,
+    to fit the blocks (distance and combo detectors) and to predict. Memory use is bounded by the chunk size plus
+    the fixed time windows kept by the other stages, and a few numbers per late switch and predicting block.
+    Returns the evaluation metrics and the measurable time, as the evaluation and masked stages do in memory.
+    The masked rows are written to output_dir as one column store per chunk if it is given.
+    """
+    events = []
+    n_written = 0
+
+    def collect(df):
+        nonlocal n_written
+        if df is None or df.empty:
+            return
+        # Only annotated and predicted events are needed for the evaluation
+        is_event = (df['event'] == 'collision').to_numpy() | (df['pedestrian_pred'] == True).to_numpy(dtype=bool, na_value=False)
+        events.append(df.loc[is_event, ['timestamp', 'phase_pred', 'event', 'pedestrian_pred']])
+        if output_dir is not None:
+            column_store.write_frame(df, os.path.join(output_dir, f'chunk{n_written:05d}'))
+            n_written += 1
+
+    for stages in chunk_passes(detector, **params):
+        stream(merged_path, chunk_rows, stages, collect if isinstance(stages[-1], MaskStage) else None)
+
+    events = concat(*events)
+    if events is None:
+        events = pd.DataFrame(columns=['timestamp', 'phase_pred', 'event', 'pedestrian_pred'])
+    return evaluate_performance(events, evaluation_window, verbose=False), stages[-1].measurable_time()
+
+
+def read_chunked_output(output_dir):
+    """
+    Concatenate the masked chunks written by run_chunked.
+    """
+    names = sorted(name for name in os.listdir(output_dir) if name.startswith('chunk'))
+    return pd.concat([column_store.read_frame(os.path.join(output_dir, name)) for name in names])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the detection stages over the merged data in chunks.')
+    parser.add_argument('--detector', choices=DETECTORS, default='combo')
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--output-dir', default=None, help='write the masked rows here, one column store per chunk')
+    args = parser.parse_args()
+
+    # The merged stage is the only one computed in memory; everything after it is streamed from its cache
+    pipeline = build_pipeline(args.detector, cache_dir=args.cache_dir)
+    if not is_cached(pipeline.cache_path('merged')):
+        pipeline.run('merged')
+    metrics, measurable_time = run_chunked(args.detector, os.path.join(pipeline.cache_path('merged'), 'part0'),
+                                           args.chunk_rows, output_dir=args.output_dir)
+    print("Measurable time by phase (s):")
+    print(measurable_time)
+    print_evaluation(metrics)
+
+
+if __name__ == "__main__":
+    main()
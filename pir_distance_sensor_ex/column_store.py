@@ -0,0 +1,153 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+SCHEMA_FILE = 'schema.json'
+
+
+def write_frame(df, path):
+    """
+    Write a DataFrame as a directory of .npy files, one per column, plus a schema.json.
+    Datetimes are stored as int64 nanoseconds and object/categorical columns as integer codes,
+    so reading back needs no parsing and numeric columns can be memory-mapped.
+    """
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    # Anything but a default RangeIndex is kept, e.g. the row labels left by sort_values
+    index_names = list(df.index.names)
+    index_columns = []
+    if not df.index.equals(pd.RangeIndex(len(df))) or index_names != [None]:
+        index_columns = [f'__index_level_{i}__' for i in range(df.index.nlevels)]
+        df = df.reset_index(names=index_columns)
+
+    columns = []
+    for i, name in enumerate(df.columns):
+        column = {'name': name, 'file': f'{i}.npy'}
+        columns.append(column)
+        _write_column(df[name], column, os.path.join(tmp_path, column['file']))
+
+    with open(os.path.join(tmp_path, SCHEMA_FILE), 'w') as f:
+        json.dump({'columns': columns, 'index': index_columns, 'index_names': index_names, 'length': len(df)}, f, indent=4)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+
+
+def read_frame(path, columns=None, mmap=False):
+    """
+    Read a DataFrame written by write_frame. With mmap=True numeric columns are memory-mapped.
+    """
+    schema = read_schema(path)
+    data = {}
+    for column in schema['columns']:
+        if columns is not None and column['name'] not in columns and column['name'] not in schema['index']:
+            continue
+        data[column['name']] = _read_column(column, os.path.join(path, column['file']), mmap)
+
+    df = pd.DataFrame(data, copy=False)
+    if schema['index']:
+        df = df.set_index(schema['index'])
+        df.index.names = schema['index_names']
+    return df
+
+
+def iter_frames(path, chunk_rows, columns=None):
+    """
+    Read a frame written by write_frame in consecutive chunks of chunk_rows rows. Columns are memory-mapped
+    and only the rows of the current chunk are decoded. Without a stored index, chunks keep their row positions
+    as index.
+    """
+    schema = read_schema(path)
+    selected = [c for c in schema['columns']
+                if columns is None or c['name'] in columns or c['name'] in schema['index']]
+    arrays = [(column, _load(column, os.path.join(path, column['file']), mmap=True)) for column in selected]
+
+    for start in range(0, schema['length'], chunk_rows):
+        rows = slice(start, min(start + chunk_rows, schema['length']))
+        df = pd.DataFrame({column['name']: _decode(column, values, rows) for column, values in arrays}, copy=False)
+        if schema['index']:
+            df = df.set_index(schema['index'])
+            df.index.names = schema['index_names']
+        else:
+            df.index = pd.RangeIndex(rows.start, rows.stop)
+        yield df
+
+
+def read_schema(path):
+    with open(os.path.join(path, SCHEMA_FILE)) as f:
+        return json.load(f)
+
+
+def _write_column(series, column, file_path):
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype) or dtype == object:
+        categorical = series.astype('category')
+        column['kind'] = 'category' if isinstance(dtype, pd.CategoricalDtype) else 'object'
+        column['categories'] = [_to_json_value(v) for v in categorical.cat.categories]
+        column['ordered'] = bool(categorical.cat.ordered)
+        missing = series[series.isna()]
+        column['null'] = 'none' if missing.empty or missing.iloc[0] is None else 'nan'
+        np.save(file_path, categorical.cat.codes.to_numpy())
+    elif isinstance(dtype, pd.api.extensions.ExtensionDtype) and hasattr(dtype, 'numpy_dtype'):
+        # Nullable boolean/integer/float: values plus a separate missing-value mask
+        column['kind'] = 'nullable'
+        column['dtype'] = str(dtype)
+        mask = series.isna().to_numpy()
+        np.save(file_path, series.to_numpy(dtype=dtype.numpy_dtype, na_value=dtype.numpy_dtype.type(0)))
+        np.save(_mask_file(file_path), mask)
+    elif pd.api.types.is_datetime64_dtype(dtype):
+        column['kind'] = 'datetime'
+        column['dtype'] = str(dtype)
+        np.save(file_path, series.to_numpy().view(np.int64))
+    else:
+        column['kind'] = 'numpy'
+        np.save(file_path, series.to_numpy())
+
+
+def _read_column(column, file_path, mmap):
+    return _decode(column, _load(column, file_path, mmap), slice(None))
+
+
+def _load(column, file_path, mmap):
+    mmap_mode = 'r' if mmap else None
+    values = np.load(file_path, mmap_mode=mmap_mode)
+    if column['kind'] == 'nullable':
+        return values, np.load(_mask_file(file_path), mmap_mode=mmap_mode)
+    return values
+
+
+def _decode(column, values, rows):
+    kind = column['kind']
+    if kind == 'numpy':
+        return values[rows]
+    if kind == 'datetime':
+        return values[rows].view(column['dtype'])
+    if kind == 'nullable':
+        values, mask = values
+        array_type = pd.api.types.pandas_dtype(column['dtype']).construct_array_type()
+        return array_type(np.asarray(values[rows]), np.asarray(mask[rows]))
+
+    codes = np.asarray(values[rows])
+    if kind == 'category':
+        return pd.Categorical.from_codes(codes, categories=column['categories'], ordered=column['ordered'])
+    # Plain object columns keep their missing-value marker (code -1 picks the trailing entry)
+    null = None if column['null'] == 'none' else np.nan
+    categories = np.array(column['categories'] + [null], dtype=object)
+    return categories[codes]
+
+
+def _mask_file(file_path):
+    return file_path[:-len('.npy')] + '.mask.npy'
+
+
+def _to_json_value(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
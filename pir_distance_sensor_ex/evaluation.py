@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+
+from time_windows import count_events_in_window, covered_ns, in_intervals, merge_windows, to_ns, window_ns
+
+PHASES = ['approaching_time', 'sensor_max_time']
+# Columns identifying the experiment run a row belongs to
+RUN_KEYS = ('experiment_id', 'trial')
+
+
+def match_events(gt_ns, pred_ns, time_window='3s'):
+    """
+    Match ground-truth and predicted event timestamps within ±time_window.
+    A ground truth is a true positive if any prediction lies in its window, otherwise a false negative.
+    A prediction without any ground truth in its window is a false positive.
+    Returns (tp, fp, fn).
+    """
+    w = window_ns(time_window)
+    gt_ns = np.sort(np.asarray(gt_ns, dtype=np.int64))
+    pred_ns = np.sort(np.asarray(pred_ns, dtype=np.int64))
+
+    tp = int((count_events_in_window(pred_ns, gt_ns, w, w) > 0).sum())
+    fn = len(gt_ns) - tp
+    fp = int((count_events_in_window(gt_ns, pred_ns, w, w) == 0).sum())
+    return tp, fp, fn
+
+
+def compute_scores(tp, fp, fn):
+    precision = tp / (tp + fp) if (tp + fp) > 0 else 0.0
+    recall = tp / (tp + fn) if (tp + fn) > 0 else 0.0
+    f1_score = 2 * precision * recall / (precision + recall) if (precision + recall) > 0 else 0.0
+    return precision, recall, f1_score
+
+
+def evaluate_performance(df, time_window='3s', verbose=True):
+    """
+    Evaluate the detection performance by comparing the predicted collisions to the ground truth,
+    separated by different phases (approaching_time, sensor_max_time).
+    Returns a DataFrame indexed by phase with tp, fp, fn, precision, recall and f1 columns.
+    """
+    timestamps = to_ns(df['timestamp'])
+    phase_pred = df['phase_pred'].to_numpy()
+    is_gt = (df['event'] == 'collision').to_numpy()
+    is_pred = (df['pedestrian_pred'] == True).to_numpy(dtype=bool, na_value=False)
+
+    rows = []
+    for phase in PHASES:
+        in_phase = phase_pred == phase
+        tp, fp, fn = match_events(timestamps[in_phase & is_gt], timestamps[in_phase & is_pred], time_window)
+        precision, recall, f1_score = compute_scores(tp, fp, fn)
+        rows.append({'phase': phase, 'tp': tp, 'fp': fp, 'fn': fn,
+                     'precision': precision, 'recall': recall, 'f1': f1_score})
+
+    metrics = pd.DataFrame(rows).set_index('phase')
+    if verbose:
+        print_evaluation(metrics)
+    return metrics
+
+
+def evaluate_by_experiment(df, time_window='3s', by=('experiment_id', 'trial')):
+    """
+    evaluate_performance for each experiment. Returns a long table with the experiment keys,
+    the phase and the metric columns. Rows outside any experiment are ignored.
+    """
+    by = list(by)
+    tables = []
+    for key, group in df.groupby(by, sort=True):
+        metrics = evaluate_performance(group, time_window, verbose=False).reset_index()
+        for column, value in zip(by, key):
+            metrics[column] = value
+        tables.append(metrics)
+
+    if not tables:
+        return pd.DataFrame(columns=by + ['phase', 'tp', 'fp', 'fn', 'precision', 'recall', 'f1'])
+    return pd.concat(tables, ignore_index=True)[by + ['phase', 'tp', 'fp', 'fn', 'precision', 'recall', 'f1']]
+
+
+def summarize_metrics(metrics, by):
+    """
+    Sum tp/fp/fn over the rows of each group (e.g. over experiments) and recompute the scores.
+    """
+    totals = metrics.groupby(by, sort=False)[['tp', 'fp', 'fn']].sum().reset_index()
+    scores = [compute_scores(tp, fp, fn) for tp, fp, fn in totals[['tp', 'fp', 'fn']].itertuples(index=False)]
+    totals[['precision', 'recall', 'f1']] = pd.DataFrame(scores, index=totals.index)
+    return totals
+
+
+def print_evaluation(metrics):
+    print("\nEvaluation Metrics by Phase:")
+    print("-" * 30)
+
+    for phase, row in metrics.iterrows():
+        print(f"\n{phase.upper()}:")
+        print(f"True Positive: {int(row['tp'])}")
+        print(f"False Positive: {int(row['fp'])}")
+        print(f"False Negative: {int(row['fn'])}")
+        print(f"Precision: {row['precision']:.3f}")
+        print(f"Recall: {row['recall']:.3f}")
+        print(f"F1 Score: {row['f1']:.3f}")
+
+
+def remove_data_out_of_measurable_time(df, transition_window='3s'):
+    """
+    Remove data points that are within ±transition_window of phase transitions and in 'turning_time'.
+    The transition windows are merged into one sorted interval union and applied in a single pass.
+    Returns the masked DataFrame and the measurable time (seconds) left in each phase.
+    """
+    df = df.sort_values('timestamp', kind='stable')
+    timestamps = to_ns(df['timestamp'])
+
+    # Identify phase transitions (where phase_pred changes)
+    phase_changes = (df['phase_pred'] != df['phase_pred'].shift()).to_numpy()
+    w = window_ns(transition_window)
+    starts, ends = merge_windows(timestamps[phase_changes], w, w)
+    remove_mask = in_intervals(timestamps, starts, ends)
+
+    df.loc[remove_mask, 'event'] = None
+    df.loc[remove_mask, 'pedestrian_pred'] = False
+
+    df.loc[df['phase_pred'] == 'turning_time', 'event'] = None
+    df.loc[df['phase_pred'] == 'turning_time', 'pedestrian_pred'] = False
+
+    return df, measurable_time(timestamps, df['phase_pred'].to_numpy(), phase_changes, starts, ends, run_starts(df))
+
+
+def run_starts(df, by=RUN_KEYS):
+    """
+    Whether each row of a time-sorted frame starts an experiment run: its by columns (those df has) differ
+    from the previous row's, missing values comparing equal. The first row always starts one.
+    """
+    by = [column for column in by if column in df]
+    if not by or df.empty:
+        return np.arange(len(df)) == 0
+    run = df.groupby(by, dropna=False, sort=False).ngroup().to_numpy()
+    return np.r_[True, run[1:] != run[:-1]]
+
+
+def measurable_time(timestamps, phase_pred, phase_changes, starts, ends, run_starts=None):
+    """
+    Total duration of each phase outside the removed transition windows, in seconds.
+    Each phase segment runs from its transition to the next one, or to the last sample of its experiment run
+    when the next run starts first (run_starts marks their first rows), so the time between the experiments
+    of a concatenated frame is not counted.
+    """
+    if len(timestamps) == 0:
+        return pd.Series(0.0, index=PHASES, name='measurable_time')
+    if run_starts is None:
+        run_starts = np.arange(len(timestamps)) == 0
+
+    first = np.flatnonzero(phase_changes | run_starts)
+    next_first = np.append(first[1:], len(timestamps))
+    last = np.where(np.append(run_starts[first[1:]], True), next_first - 1, next_first)
+    segment_start, segment_end = timestamps[first], timestamps[last]
+    length = segment_end - segment_start - covered_ns(starts, ends, segment_start, segment_end)
+
+    total = pd.Series(length, dtype='float64').groupby(phase_pred[first]).sum()
+    return (total.reindex(PHASES, fill_value=0.0) / 1e9).rename('measurable_time')
@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+
+from time_windows import to_ns, window_ns
+
+FEATURE_CHANNELS = ['gyroscope_x', 'gyroscope_y', 'gyroscope_z', 'accelerometer_x', 'accelerometer_y', 'accelerometer_z',
+                    'distance', 'PIRvalue']
+FEATURE_WINDOWS = ('0.5s', '1s', '2s')
+FEATURE_STATS = ('mean', 'abs_mean', 'std', 'min', 'max', 'slope')
+
+# The prefix sums restart every SEGMENT of recording time, with times and values relative to the segment,
+# so the differences taken for a window stay accurate however long the recording is
+SEGMENT = '60s'
+
+
+def feature_name(channel, stat, window):
+    return f'{channel}_{stat}_{window}'
+
+
+def window_starts(timestamps, window):
+    """
+    Position of the first row of the trailing window (t - window, t] of each row, as in pandas' rolling(window).
+    timestamps must be sorted int64 nanoseconds.
+    """
+    return np.searchsorted(timestamps, timestamps - window_ns(window), side='right')
+
+
+def prefix_sum(values):
+    return np.concatenate([[0.0], np.cumsum(values)])
+
+
+def range_reduce(values, starts, ends, func):
+    """
+    func (np.fmin or np.fmax) over values[starts[i]:ends[i]] for every i, with a sparse table of the
+    reductions over power-of-two blocks: two overlapping blocks cover each range.
+    NaNs are skipped; empty or all-NaN ranges give NaN.
+    """
+    lengths = ends - starts
+    out = np.full(len(starts), np.nan)
+    if len(values) == 0 or lengths.max(initial=0) == 0:
+        return out
+
+    level = np.zeros(len(lengths), dtype=np.int64)
+    nonempty = lengths > 0
+    level[nonempty] = np.floor(np.log2(lengths[nonempty])).astype(np.int64)
+    table = values
+    for k in range(int(level.max()) + 1):
+        if k > 0:
+            half = 1 << (k - 1)
+            table = func(table[:-half], table[half:])
+        rows = np.flatnonzero(nonempty & (level == k))
+        out[rows] = func(table[starts[rows]], table[ends[rows] - (1 << k)])
+    return out
+
+
+def segment_features(t, x, ranges, stats):
+    """
+    Window statistics of the values x at times t (seconds) from prefix sums, which are built once and shared
+    by all windows. ranges maps each window to the row ranges (starts, ends) of its rows.
+    Returns {window: {stat: values}}.
+    """
+    valid = ~np.isnan(x)
+    # Centring on the segment mean keeps the sums of squares small
+    ref = x[valid].mean() if valid.any() else 0.0
+    xc = np.where(valid, x - ref, 0.0)
+    tv = np.where(valid, t, 0.0)
+    masked = np.where(valid, x, np.nan)
+
+    prefix = {'n': prefix_sum(valid), 's1': prefix_sum(xc)}
+    if 'abs_mean' in stats:
+        prefix['abs'] = prefix_sum(np.abs(np.where(valid, x, 0.0)))
+    if 'std' in stats:
+        prefix['s2'] = prefix_sum(xc * xc)
+    if 'slope' in stats:
+        prefix['t1'] = prefix_sum(tv)
+        prefix['t2'] = prefix_sum(tv * tv)
+        prefix['tx'] = prefix_sum(tv * xc)
+
+    features = {}
+    for window, (starts, ends) in ranges.items():
+        sums = {name: values[ends] - values[starts] for name, values in prefix.items()}
+        n, s1 = sums['n'], sums['s1']
+        out = features[window] = {}
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if 'mean' in stats:
+                out['mean'] = np.where(n > 0, ref + s1 / n, np.nan)
+            if 'abs_mean' in stats:
+                out['abs_mean'] = np.where(n > 0, sums['abs'] / n, np.nan)
+            if 'std' in stats:
+                var = (sums['s2'] - s1 * s1 / n) / (n - 1)
+                out['std'] = np.where(n > 1, np.sqrt(np.maximum(var, 0.0)), np.nan)
+            if 'min' in stats:
+                out['min'] = range_reduce(masked, starts, ends, np.fmin)
+            if 'max' in stats:
+                out['max'] = range_reduce(masked, starts, ends, np.fmax)
+            if 'slope' in stats:
+                # Least-squares slope per second: cov(t, x) / var(t), undefined for windows shorter than a microsecond
+                var_t = sums['t2'] - sums['t1'] ** 2 / n
+                cov = sums['tx'] - sums['t1'] * s1 / n
+                out['slope'] = np.where((n > 1) & (var_t > n * 1e-12), cov / var_t, np.nan)
+    return features
+
+
+def rolling_features(df, channels=None, windows=FEATURE_WINDOWS, stats=FEATURE_STATS):
+    """
+    Trailing time-window statistics (mean, abs_mean, std, min, max, slope) of the sensor channels for every
+    window, in one vectorized pass over the rows. Windows are (t - window, t] as in pandas' rolling(window),
+    missing values are skipped. Returns a float32 frame with a timestamp column and one column per
+    channel, stat and window (see feature_name), in timestamp order with a fresh RangeIndex.
+    channels defaults to the FEATURE_CHANNELS present in df.
+    """
+    if not df['timestamp'].is_monotonic_increasing:
+        df = df.sort_values('timestamp')
+    df = df.reset_index(drop=True)
+    channels = [c for c in (channels or FEATURE_CHANNELS) if c in df.columns]
+    timestamps = to_ns(df['timestamp'])
+    starts = {window: window_starts(timestamps, window) for window in windows}
+
+    columns = {feature_name(c, s, w): np.full(len(df), np.nan, dtype=np.float32)
+               for c in channels for w in windows for s in stats}
+    segment_ns = window_ns(SEGMENT)
+    segment = timestamps // segment_ns
+    bounds = np.flatnonzero(np.r_[True, segment[1:] != segment[:-1], True]) if len(df) else []
+
+    values = {channel: df[channel].to_numpy(dtype=np.float64, na_value=np.nan) for channel in channels}
+
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        # Rows from the earliest window start of the segment onwards, with times relative to the first of them
+        first = min(starts[window][lo] for window in windows)
+        t = (timestamps[first:hi] - timestamps[first]) / 1e9
+        ranges = {window: (starts[window][lo:hi] - first, np.arange(lo, hi) + 1 - first) for window in windows}
+        for channel in channels:
+            for window, stat_values in segment_features(t, values[channel][first:hi], ranges, stats).items():
+                for stat, column in stat_values.items():
+                    columns[feature_name(channel, stat, window)][lo:hi] = column
+
+    return pd.DataFrame({'timestamp': df['timestamp'], **columns})
@@ -0,0 +1,214 @@
+import hashlib
+import inspect
+import json
+import os
+import types
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+import column_store
+from profiling import profiler_from_env
+
+DEFAULT_CACHE_DIR = '.pipeline_cache'
+META_FILE = 'output.json'
+
+_digests = {}
+
+
+@dataclass
+class Stage:
+    name: str
+    func: types.FunctionType
+    deps: tuple = ()
+    files: dict = field(default_factory=dict)
+    params: dict = field(default_factory=dict)
+
+
+class Pipeline:
+    """
+    Small DAG executor for the analysis stages.
+    Each stage is called as func(*upstream_outputs, **files, **params). Its output (a DataFrame, a Series
+    or a tuple of them) is cached in column_store format under a key hashed from the input file contents,
+    the parameters, the upstream keys and the code of the stage, so a run only recomputes the stages whose
+    key changed and everything downstream of them.
+    normalize, if given, is applied to every DataFrame a stage returns (e.g. to cast it to the storage dtypes),
+    so computed and cached outputs look the same.
+    profiler (a profiling.StageProfiler) measures every computed stage; by default it is taken from the
+    PIPELINE_PROFILE environment variable and profiling is off when that is unset.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, verbose=True, normalize=None, profiler=None):
+        self.cache_dir = cache_dir
+        self.verbose = verbose
+        self.normalize = normalize
+        self.profiler = profiler or profiler_from_env()
+        self.stages = {}
+        self._keys = {}
+        self._results = {}
+        self._report = {}
+
+    def add(self, name, func, deps=(), files=None, **params):
+        self.stages[name] = Stage(name, func, tuple(deps), dict(files or {}), params)
+        return self
+
+    def key(self, name):
+        if name not in self._keys:
+            stage = self.stages[name]
+            h = hashlib.sha256()
+            h.update(name.encode())
+            h.update(code_version(stage.func).encode())
+            if self.normalize is not None:
+                h.update(code_version(self.normalize).encode())
+            h.update(json.dumps(stage.params, sort_keys=True, default=str).encode())
+            for dep in stage.deps:
+                h.update(self.key(dep).encode())
+            for arg, path in sorted(stage.files.items()):
+                h.update(arg.encode())
+                h.update(file_digest(path).encode())
+            self._keys[name] = h.hexdigest()[:16]
+        return self._keys[name]
+
+    def cache_path(self, name):
+        return os.path.join(self.cache_dir, f'{name}-{self.key(name)}')
+
+    def run(self, name):
+        """
+        Return the output of a stage, computing upstream stages only when they are not cached.
+        A computed output may share column buffers with the outputs of upstream stages kept by this
+        pipeline, so copy it before modifying it in place.
+        """
+        if name in self._results:
+            return self._results[name]
+
+        stage = self.stages[name]
+        path = self.cache_path(name)
+        if is_cached(path):
+            result = load_output(path)
+            status = 'cached'
+        else:
+            # Stages update their input frames in place. Within the stage computation copy-on-write is on,
+            # so the copies handed to them are shallow and only the columns a stage modifies get duplicated;
+            # the option is scoped here rather than set globally for the importing code.
+            with pd.option_context('mode.copy_on_write', True):
+                inputs = [copy_output(self.run(dep)) for dep in stage.deps]
+                if self.profiler is None:
+                    result = stage.func(*inputs, **stage.files, **stage.params)
+                else:
+                    result = self.profiler.call(name, stage.func, inputs, {**stage.files, **stage.params})
+                if self.normalize is not None:
+                    result = normalize_output(result, self.normalize)
+            save_output(result, path)
+            status = 'computed'
+
+        self._results[name] = result
+        self._log(name, status)
+        return result
+
+    def memory_report(self):
+        """
+        Rows and in-memory size (MB) of the output of each stage run so far.
+        """
+        return pd.DataFrame.from_dict(self._report, orient='index', columns=['status', 'rows', 'memory_mb'])
+
+    def _log(self, name, status):
+        rows, memory = output_size(self._results[name])
+        self._report[name] = (status, rows, memory / 2**20)
+        if self.verbose:
+            print(f"[pipeline] {name}: {status} ({self.key(name)}, {rows} rows, {memory / 2**20:.1f} MB)")
+
+
+def code_version(func):
+    """
+    Hash of the source of a stage function and of the module-level functions it calls, recursively.
+    """
+    h = hashlib.sha256()
+    seen = set()
+    stack = [func]
+    while stack:
+        f = stack.pop()
+        if f in seen:
+            continue
+        seen.add(f)
+        try:
+            h.update(inspect.getsource(f).encode())
+        except (OSError, TypeError):
+            h.update(f.__qualname__.encode())
+        for name in f.__code__.co_names:
+            ref = f.__globals__.get(name)
+            if isinstance(ref, types.FunctionType):
+                stack.append(ref)
+    return h.hexdigest()
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    Content hash of an input file, remembered per (path, size, mtime) within the process.
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _digests:
+        h = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                h.update(chunk)
+        _digests[memo_key] = h.hexdigest()
+    return _digests[memo_key]
+
+
+def is_cached(path):
+    return os.path.exists(os.path.join(path, META_FILE))
+
+
+def save_output(result, path):
+    parts = result if isinstance(result, tuple) else (result,)
+    kinds = []
+    for i, part in enumerate(parts):
+        if isinstance(part, pd.Series):
+            kinds.append({'type': 'series', 'name': part.name})
+            part = part.to_frame(name='value')
+        else:
+            kinds.append({'type': 'frame'})
+        column_store.write_frame(part, os.path.join(path, f'part{i}'))
+
+    # Written last, so an interrupted save is never treated as a cache hit
+    with open(os.path.join(path, META_FILE), 'w') as f:
+        json.dump({'tuple': isinstance(result, tuple), 'parts': kinds}, f, indent=4)
+
+
+def load_output(path, columns=None, mmap=False):
+    with open(os.path.join(path, META_FILE)) as f:
+        meta = json.load(f)
+
+    parts = []
+    for i, kind in enumerate(meta['parts']):
+        part_columns = columns if kind['type'] == 'frame' else None
+        part = column_store.read_frame(os.path.join(path, f'part{i}'), columns=part_columns, mmap=mmap)
+        if kind['type'] == 'series':
+            part = part['value'].rename(kind['name'])
+        parts.append(part)
+    return tuple(parts) if meta['tuple'] else parts[0]
+
+
+def normalize_output(result, normalize):
+    if isinstance(result, tuple):
+        return tuple(normalize_output(part, normalize) for part in result)
+    return normalize(result) if isinstance(result, pd.DataFrame) else result
+
+
+def copy_output(result):
+    if isinstance(result, tuple):
+        return tuple(part.copy(deep=False) for part in result)
+    return result.copy(deep=False)
+
+
+def output_size(result):
+    """
+    Number of rows (of the first part for tuples) and total memory usage in bytes of a stage output.
+    """
+    parts = result if isinstance(result, tuple) else (result,)
+    memory = 0
+    for part in parts:
+        usage = part.memory_usage(index=True, deep=True)
+        memory += usage.sum() if isinstance(part, pd.DataFrame) else usage
+    return len(parts[0]), int(memory)
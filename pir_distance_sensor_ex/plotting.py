@@ -0,0 +1,229 @@
+import webbrowser
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+try:
+    import dash
+except ImportError:  # optional, see show_figures
+    dash = None
+
+from time_windows import to_ns
+
+PHASE_COLORS = {
+    'sensor_max_time': 'lightcoral',
+    'approaching_time': 'lightblue',
+    'turning_time': 'white'
+}
+# Points per data trace sent to the browser, whatever the length of the recording
+MAX_POINTS = 4000
+
+
+def phase_segments(timestamps, phases):
+    """
+    Run-length encode the phase labels into segments with start, end and phase columns.
+    A segment ends where the next one starts; the last one ends at the last sample.
+    """
+    timestamps = np.asarray(timestamps)
+    phases = np.asarray(phases, dtype=object)
+    if len(phases) == 0:
+        return pd.DataFrame({'start': timestamps, 'end': timestamps, 'phase': phases})
+
+    # Consecutive missing labels belong to the same segment
+    missing = pd.isna(phases)
+    changed = (phases[1:] != phases[:-1]) & ~(missing[1:] & missing[:-1])
+    starts = np.flatnonzero(np.r_[True, changed])
+    ends = np.append(starts[1:], len(phases) - 1)
+    return pd.DataFrame({'start': timestamps[starts], 'end': timestamps[ends], 'phase': phases[starts]})
+
+
+def phase_band_traces(segments, phase_colors=PHASE_COLORS, opacity=0.3):
+    """
+    One filled trace per phase covering all its segments, drawn on a hidden [0, 1] y axis ('y2')
+    so the bands span the full plot height whatever the data range. Segments without a phase get no band.
+    """
+    phases = list(phase_colors) + [p for p in pd.unique(segments['phase'].dropna()) if p not in phase_colors]
+    traces = []
+    for phase in phases:
+        rows = segments[segments['phase'] == phase]
+        # Rectangles as closed polygons separated by None, so a whole phase is one path
+        x = np.full((len(rows), 5), None, dtype=object)
+        x[:, 0] = x[:, 1] = rows['start'].to_numpy()
+        x[:, 2] = x[:, 3] = rows['end'].to_numpy()
+        y = np.tile(np.array([0, 1, 1, 0, None], dtype=object), len(rows))
+        traces.append(go.Scatter(
+            x=x.ravel(), y=y, yaxis='y2', mode='none', fill='toself',
+            fillcolor=phase_colors.get(phase, 'gray'), opacity=opacity,
+            name=str(phase), hoverinfo='skip'
+        ))
+    return traces
+
+
+def minmax_indices(x, y, max_points=MAX_POINTS):
+    """
+    Indices of the samples to draw so that the visible shape is kept: the minimum and maximum
+    of y in each of max_points // 2 equal-width x buckets, plus the first NaN of every gap
+    so lines still break where the data does. x must be sorted (int64). max_points=None keeps every sample.
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if max_points is None or n <= max_points:
+        return np.arange(n)
+
+    valid = ~np.isnan(y)
+    gap_starts = np.flatnonzero(~valid & np.r_[True, valid[:-1]])
+    idx = np.flatnonzero(valid)
+    if len(idx) == 0:
+        return gap_starts
+
+    n_buckets = max(max_points // 2, 1)
+    edges = np.linspace(x[idx[0]], x[idx[-1]], n_buckets + 1)
+    bucket = np.clip(np.searchsorted(edges, x[idx], side='right') - 1, 0, n_buckets - 1)
+
+    # Sorted by (bucket, y): the first row of a bucket is its minimum, the last its maximum
+    sort = np.lexsort((y[idx], bucket))
+    order, bucket = idx[sort], bucket[sort]
+    first = np.r_[True, bucket[1:] != bucket[:-1]]
+    last = np.r_[bucket[1:] != bucket[:-1], True]
+    return np.unique(np.concatenate([order[first], order[last], gap_starts]))
+
+
+def decimated_trace(timestamps, values, max_points=MAX_POINTS, **kwargs):
+    """
+    WebGL scatter of a min/max-decimated series (every sample with max_points=None).
+    """
+    timestamps = np.asarray(timestamps)
+    values = np.asarray(values, dtype=float)
+    keep = minmax_indices(timestamps.astype('datetime64[ns]').astype(np.int64), values, max_points)
+    return go.Scattergl(x=timestamps[keep], y=values[keep], **kwargs)
+
+
+def phase_figure(df, y, title, markers=(), lines=(), phase_colors=PHASE_COLORS, max_points=MAX_POINTS):
+    """
+    Time series of df[y] with phase_pred bands, event markers and extra line traces, as a PhaseFigure.
+    markers is a list of (points_df, y_value, name), lines a list of (column, name).
+    Data traces are WebGL and min/max-decimated to max_points, so the figure stays responsive whatever the
+    length of the recording; show it with show_figures (or PhaseFigure.widget in a notebook) to have them
+    re-decimated to the visible range after each zoom. max_points=None draws every sample instead.
+    """
+    timestamps = df['timestamp'].to_numpy()
+    sources = [(timestamps, df[y].to_numpy(dtype=float), dict(mode='markers', name=y, showlegend=False))]
+    sources += [(timestamps, df[column].to_numpy(dtype=float), dict(mode='lines', name=name)) for column, name in lines]
+
+    fig = go.Figure(phase_band_traces(phase_segments(timestamps, df['phase_pred'].to_numpy()), phase_colors))
+    first_trace = len(fig.data)
+    for x, values, kwargs in sources:
+        fig.add_trace(decimated_trace(x, values, max_points, **kwargs))
+    for points, y_value, name in markers:
+        fig.add_trace(go.Scattergl(x=points['timestamp'], y=[y_value] * len(points), mode='markers', name=name))
+
+    fig.update_layout(
+        title=title,
+        xaxis=dict(title='timestamp', rangeslider_visible=True),  # Add a range slider for scrolling
+        yaxis=dict(title=y),
+        yaxis2=dict(range=[0, 1], overlaying='y', visible=False, fixedrange=True),
+        uirevision=title  # keep the zoom when the traces are re-decimated
+    )
+    return PhaseFigure(fig, sources, first_trace, max_points)
+
+
+class PhaseFigure:
+    """
+    A plotly figure (.figure) with the full-resolution sources of its data traces
+    (.figure.data[first_trace:], in sources order), from which they are re-decimated to a visible x range.
+    """
+
+    def __init__(self, figure, sources, first_trace, max_points=MAX_POINTS):
+        self.figure = figure
+        self.sources = sources
+        self.first_trace = first_trace
+        self.max_points = max_points
+        self._x_ns = [x.astype('datetime64[ns]').astype(np.int64) for x, _, _ in sources]
+
+    def visible_points(self, x_range=None):
+        """
+        (x, y) of each data trace decimated to the samples within x_range (the whole series for None),
+        plus one sample on either side so lines run to the plot edges.
+        """
+        points = []
+        for (x, values, _), x_ns in zip(self.sources, self._x_ns):
+            lo, hi = 0, len(x_ns)
+            if x_range is not None:
+                lo, hi = np.searchsorted(x_ns, to_ns(list(x_range)))
+                lo, hi = max(lo - 1, 0), min(hi + 1, len(x_ns))
+            keep = lo + minmax_indices(x_ns[lo:hi], values[lo:hi], self.max_points)
+            points.append((x[keep], values[keep]))
+        return points
+
+    def redraw(self, figure, x_range=None):
+        # Replace the data traces of figure (this figure or a copy of it) with the points visible in x_range
+        for offset, (x, y) in enumerate(self.visible_points(x_range)):
+            trace = figure.data[self.first_trace + offset]
+            trace.x, trace.y = x, y
+        return figure
+
+    def widget(self):
+        """
+        The figure as a FigureWidget re-decimated after each zoom, for notebooks.
+        """
+        widget = go.FigureWidget(self.figure)
+
+        def on_range(layout, x_range):
+            with widget.batch_update():
+                self.redraw(widget, x_range)
+
+        widget.layout.xaxis.on_change(on_range, 'range')
+        return widget
+
+
+def relayout_range(relayout):
+    """
+    The x range a Dash Graph's relayoutData zooms to: (start, end), None for the full range (autorange),
+    or False if the event did not change the x range (e.g. a legend click).
+    """
+    relayout = relayout or {}
+    if 'xaxis.range[0]' in relayout and 'xaxis.range[1]' in relayout:
+        return relayout['xaxis.range[0]'], relayout['xaxis.range[1]']
+    if 'xaxis.range' in relayout:
+        return tuple(relayout['xaxis.range'])
+    if relayout.get('xaxis.autorange'):
+        return None
+    return False
+
+
+def show_figures(*figures, port=8050):
+    """
+    Show PhaseFigures (or plain plotly figures) from a script. With Dash installed they are served on
+    localhost:port on one page, and the data traces of each PhaseFigure are re-decimated to the visible range
+    after every zoom or range slider move; this blocks until interrupted (Ctrl+C). Without Dash each figure
+    is opened with fig.show(), with the traces decimated to the whole recording.
+    """
+    if dash is None:
+        for figure in figures:
+            (figure.figure if isinstance(figure, PhaseFigure) else figure).show()
+        return
+
+    app = dash.Dash(__name__)
+    graphs = []
+    for i, figure in enumerate(figures):
+        graph_id = f'figure-{i}'
+        base = figure.figure if isinstance(figure, PhaseFigure) else figure
+        graphs.append(dash.dcc.Graph(id=graph_id, figure=base, style={'height': '80vh'}))
+        if isinstance(figure, PhaseFigure):
+            app.callback(dash.Output(graph_id, 'figure'), dash.Input(graph_id, 'relayoutData'),
+                         prevent_initial_call=True)(redecimate_callback(figure))
+    app.layout = dash.html.Div(graphs)
+
+    print(f"Serving {len(figures)} figure(s) on http://127.0.0.1:{port} (Ctrl+C to stop)")
+    webbrowser.open(f'http://127.0.0.1:{port}')
+    app.run(port=port, debug=False)
+
+
+def redecimate_callback(figure):
+    def redecimate(relayout):
+        x_range = relayout_range(relayout)
+        if x_range is False:
+            return dash.no_update
+        return figure.redraw(go.Figure(figure.figure), x_range)
+    return redecimate
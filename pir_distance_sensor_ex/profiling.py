@@ -0,0 +1,145 @@
+import argparse
+import cProfile
+import json
+import os
+import runpy
+import sys
+import time
+import tracemalloc
+
+# Set to an output directory to profile every computed pipeline stage; PIPELINE_PROFILE_CPROFILE=1
+# additionally dumps a cProfile file per stage, PIPELINE_PROFILE_MEMORY=0 skips the memory pass
+PROFILE_ENV = 'PIPELINE_PROFILE'
+CPROFILE_ENV = 'PIPELINE_PROFILE_CPROFILE'
+MEMORY_ENV = 'PIPELINE_PROFILE_MEMORY'
+DEFAULT_PROFILE_DIR = 'profiles'
+
+# Pipelines of the same process share one profiler, and so one report
+_env_profiler = None
+
+
+class StageProfiler:
+    """
+    Measures each stage a Pipeline computes: wall and CPU time, tracemalloc peak above the memory in use
+    when the stage started, input and output rows and rows per second. The records are rewritten to a
+    JSON report in output_dir after every stage, so the report is complete whenever the run stops.
+    tracemalloc slows allocation-heavy code down severalfold, so with memory=True each stage is run twice:
+    traced on shallow copies of its inputs for the peak, then untraced for the times (both passes are timed
+    traced if the caller already runs tracemalloc). memory=False skips the first pass and records no peak.
+    With cprofile=True the timed pass is run under cProfile, which also adds to its times, and dumped to
+    <output_dir>/<run>-<stage>.prof.
+    Cached stages are not computed, so use a fresh cache dir to profile all of them.
+    """
+
+    def __init__(self, output_dir=DEFAULT_PROFILE_DIR, cprofile=False, memory=True):
+        self.output_dir = output_dir
+        self.cprofile = cprofile
+        self.memory = memory
+        self.run_id = f"{time.strftime('%Y%m%d_%H%M%S')}-{os.getpid()}"
+        self.report_path = os.path.join(output_dir, f'{self.run_id}.json')
+        self.records = []
+
+    def call(self, name, func, inputs, kwargs):
+        """
+        Call func(*inputs, **kwargs) for stage name and record its measurements.
+        """
+        peak = traced_peak(func, [shallow_copy(part) for part in inputs], kwargs) if self.memory else None
+        profile = cProfile.Profile() if self.cprofile else None
+
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        if profile is not None:
+            result = profile.runcall(func, *inputs, **kwargs)
+        else:
+            result = func(*inputs, **kwargs)
+        wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+        rows_in = rows(inputs[0]) if inputs else None
+        rows_out = rows(result)
+        record = {
+            'stage': name, 'func': func.__name__, 'wall_s': wall, 'cpu_s': cpu,
+            'peak_mb': None if peak is None else peak / 2**20,
+            'rows_in': rows_in, 'rows_out': rows_out,
+            'rows_per_s': (rows_in if rows_in is not None else rows_out) / wall if wall > 0 else None,
+        }
+        os.makedirs(self.output_dir, exist_ok=True)
+        if profile is not None:
+            record['cprofile'] = os.path.join(self.output_dir, f'{self.run_id}-{name}.prof')
+            profile.dump_stats(record['cprofile'])
+        self.records.append(record)
+        self.write_report()
+        return result
+
+    def write_report(self):
+        with open(self.report_path, 'w') as f:
+            json.dump({'run': self.run_id, 'argv': sys.argv, 'stages': self.records}, f, indent=4)
+
+
+def traced_peak(func, inputs, kwargs):
+    """
+    Peak memory in bytes that func(*inputs, **kwargs) allocates above what is in use when it starts.
+    tracemalloc is stopped again afterwards unless it was already tracing.
+    """
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        func(*inputs, **kwargs)
+        return tracemalloc.get_traced_memory()[1] - before
+    finally:
+        if started:
+            tracemalloc.stop()
+
+
+def shallow_copy(result):
+    # Stages update their inputs in place, so each pass gets its own (copy-on-write) copies
+    if isinstance(result, tuple):
+        return tuple(part.copy(deep=False) for part in result)
+    return result.copy(deep=False)
+
+
+def rows(result):
+    # Rows of a stage output (of its first part for tuples)
+    return len(result[0] if isinstance(result, tuple) else result)
+
+
+def profiler_from_env():
+    """
+    The StageProfiler requested through PIPELINE_PROFILE (a directory, or 1 for DEFAULT_PROFILE_DIR),
+    or None (the default) when profiling is off.
+    """
+    global _env_profiler
+    output_dir = os.environ.get(PROFILE_ENV)
+    if not output_dir:
+        return None
+    if output_dir == '1':
+        output_dir = DEFAULT_PROFILE_DIR
+    if _env_profiler is None or _env_profiler.output_dir != output_dir:
+        _env_profiler = StageProfiler(output_dir, cprofile=os.environ.get(CPROFILE_ENV) == '1',
+                                      memory=os.environ.get(MEMORY_ENV) != '0')
+    return _env_profiler
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run an analysis script with per-stage pipeline profiling, e.g. '
+                    'python profiling.py --cprofile 3_analyze_pir_distance_combo.py')
+    parser.add_argument('--output-dir', default=DEFAULT_PROFILE_DIR)
+    parser.add_argument('--cprofile', action='store_true', help='also dump a cProfile file per stage')
+    parser.add_argument('--no-memory', action='store_true', help='skip the traced pass measuring peak memory')
+    parser.add_argument('script')
+    parser.add_argument('args', nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    # Pipelines created by the script pick the profiler up from the environment, as do worker processes
+    os.environ[PROFILE_ENV] = os.path.abspath(args.output_dir)
+    os.environ[CPROFILE_ENV] = '1' if args.cprofile else '0'
+    os.environ[MEMORY_ENV] = '0' if args.no_memory else '1'
+    sys.argv = [args.script] + args.args
+    sys.path.insert(0, os.path.dirname(os.path.abspath(args.script)))
+    runpy.run_path(args.script, run_name='__main__')
+
+
+if __name__ == "__main__":
+    main()
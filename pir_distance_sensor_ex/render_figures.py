@@ -0,0 +1,174 @@
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import pandas as pd
+
+import column_store
+from pipeline import DEFAULT_CACHE_DIR, META_FILE, code_version, file_digest, is_cached
+from stages import DATA_FILES, build_pipeline
+
+CACHE_DIR = '.figure_cache'
+MANIFEST_FILE = 'figures.json'
+
+# Datasets already memory-mapped by this worker process, by column store path
+_datasets = {}
+
+
+def load_config(config_file):
+    with open(config_file) as f:
+        return json.load(f)
+
+
+def prepare_dataset(name, dataset, base_dir, cache_dir):
+    """
+    Column store of a dataset and a digest of its contents. A dataset is either a pipeline stage
+    ({"stage": ..., "detector": ..., "params": {...}}, see stages.build_pipeline), whose cached output is used
+    in place, or a CSV file ({"path": ..., "parse_dates": [...]}) parsed once into a column store keyed by
+    the file contents. Either way every worker reads it back memory-mapped.
+    Returns (column store path, data digest).
+    """
+    if 'stage' in dataset:
+        return prepare_stage(dataset, base_dir)
+
+    path = os.path.join(base_dir, dataset['path'])
+    digest = file_digest(path)
+    store_path = os.path.join(cache_dir, f'{name}-{digest[:16]}')
+    if not os.path.exists(os.path.join(store_path, column_store.SCHEMA_FILE)):
+        df = pd.read_csv(path, parse_dates=dataset.get('parse_dates', False))
+        column_store.write_frame(df, store_path)
+    return store_path, digest
+
+
+def prepare_stage(dataset, base_dir):
+    # The data files and the pipeline cache are relative to the config file, as when running the analysis scripts there
+    data_files = {arg: os.path.join(base_dir, path) for arg, path in DATA_FILES.items()}
+    pipeline = build_pipeline(dataset.get('detector', 'combo'), data_files=data_files,
+                              cache_dir=os.path.join(base_dir, DEFAULT_CACHE_DIR), **dataset.get('params', {}))
+    stage = dataset['stage']
+    path = pipeline.cache_path(stage)
+    if not is_cached(path):
+        pipeline.run(stage)
+    # The first part of a tuple output (e.g. the frame of 'masked')
+    with open(os.path.join(path, META_FILE)) as f:
+        if json.load(f)['parts'][0]['type'] != 'frame':
+            raise ValueError(f"pipeline stage {stage} does not output a DataFrame")
+    return os.path.join(path, 'part0'), pipeline.key(stage)
+
+
+def resolve_figure(name):
+    """
+    Import a figure function given as 'module.function'; modules are looked up next to the config file.
+    """
+    module_name, func_name = name.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+def figure_key(spec, digest):
+    h = hashlib.sha256()
+    h.update(json.dumps(spec, sort_keys=True).encode())
+    h.update(digest.encode())
+    h.update(code_version(resolve_figure(spec['figure'])).encode())
+    return h.hexdigest()[:16]
+
+
+def init_worker(base_dir):
+    sys.path.insert(0, base_dir)
+
+
+def render_figure(spec, store_path, output):
+    """
+    Call the figure function of a spec on the shared dataset, writing to output.
+    """
+    if store_path not in _datasets:
+        _datasets[store_path] = column_store.read_frame(store_path, mmap=True)
+
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    func = resolve_figure(spec['figure'])
+    # Shallow copy: figure functions may add columns but the memory-mapped values stay shared
+    func(_datasets[store_path].copy(deep=False), output=output, **spec.get('args', {}))
+    plt.close('all')
+    return output
+
+
+def render_pending(pending, workers, base_dir):
+    """
+    Render (spec, store_path, output, key) items in a process pool (serially in this process with workers=0),
+    yielding (spec, key, exception or None) in order.
+    """
+    if workers == 0:
+        for spec, store_path, output, key in pending:
+            try:
+                render_figure(spec, store_path, output)
+            except Exception as e:
+                yield spec, key, e
+            else:
+                yield spec, key, None
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(base_dir,)) as pool:
+        futures = [(spec, key, pool.submit(render_figure, spec, store_path, output)) for spec, store_path, output, key in pending]
+        for spec, key, future in futures:
+            yield spec, key, future.exception()
+
+
+def render_figures(config_file, workers=None, force=False):
+    """
+    Render every figure of a config file in a process pool, skipping the ones whose spec,
+    data and figure code are unchanged since the last run.
+    """
+    config = load_config(config_file)
+    base_dir = os.path.dirname(os.path.abspath(config_file))
+    cache_dir = os.path.join(base_dir, CACHE_DIR)
+    init_worker(base_dir)
+
+    stores = {name: prepare_dataset(name, dataset, base_dir, cache_dir) for name, dataset in config['datasets'].items()}
+
+    manifest_file = os.path.join(cache_dir, MANIFEST_FILE)
+    manifest = {}
+    if os.path.exists(manifest_file) and not force:
+        manifest = load_config(manifest_file)
+
+    pending = []
+    for spec in config['figures']:
+        store_path, digest = stores[spec['dataset']]
+        output = os.path.join(base_dir, spec['output'])
+        key = figure_key(spec, digest)
+        if manifest.get(spec['output']) == key and os.path.exists(output):
+            print(f"[figures] {spec['output']}: unchanged")
+            continue
+        pending.append((spec, store_path, output, key))
+
+    # Figures on the same dataset go to the pool together so workers reuse their mapped copy
+    pending.sort(key=lambda item: item[1])
+    for spec, key, error in render_pending(pending, workers, base_dir):
+        if error is not None:
+            print(f"[figures] {spec['output']}: failed ({error!r})")
+            manifest.pop(spec['output'], None)
+            continue
+        manifest[spec['output']] = key
+        print(f"[figures] {spec['output']}: rendered")
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(manifest_file, 'w') as f:
+        json.dump(manifest, f, indent=4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render the static figures listed in a config file.')
+    parser.add_argument('config', nargs='?', default='figures.json')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='render processes (0: serial)')
+    parser.add_argument('--force', action='store_true', help='re-render figures even if unchanged')
+    args = parser.parse_args()
+    render_figures(args.config, args.workers, args.force)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from evaluation import print_evaluation
+from pipeline import DEFAULT_CACHE_DIR
+from stages import DETECTORS, build_pipeline, typed_frame
+from time_windows import asof_rows, window_ns
+
+# Files of a sensors_setup/server.py run directory, by load_run argument
+RUN_FILES = {
+    'main_imu_file': 'main_imu.csv',
+    'main_pir_file': 'main_pir.csv',
+    'distance_file': 'distance.csv',
+    'annotation_file': 'annotation.csv',
+}
+
+# Header written by make_csv_sinks for each stream: column -> (merged column, scale).
+# The gyroscope is converted from deg/s to rad/s, the unit the turning threshold was tuned in.
+RUN_COLUMNS = {
+    'main_imu': {
+        'gyro_x_dps': ('gyroscope_x', np.pi / 180), 'gyro_y_dps': ('gyroscope_y', np.pi / 180),
+        'gyro_z_dps': ('gyroscope_z', np.pi / 180), 'accel_x_mps2': ('accelerometer_x', 1.0),
+        'accel_y_mps2': ('accelerometer_y', 1.0), 'accel_z_mps2': ('accelerometer_z', 1.0),
+    },
+    'main_pir': {'motion': ('PIRvalue', 1.0), 'presence': ('presence', 1.0), 'ambient': ('ambient', 1.0)},
+    'distance': {'distance_cm': ('distance', 1.0)},
+}
+MASTER_CLOCKS = tuple(RUN_COLUMNS)
+
+
+def run_files(run_dir):
+    """
+    Paths of the run files by load_run argument; runs recorded without the annotation writer have no annotation file.
+    """
+    files = {arg: os.path.join(run_dir, name) for arg, name in RUN_FILES.items()}
+    if not os.path.exists(files['annotation_file']):
+        del files['annotation_file']
+    return files
+
+
+def read_run_csv(path, columns):
+    """
+    Read a server CSV with the expected header (timestamp, then columns) as float64 columns in one pass.
+    Returns the sorted int64 nanosecond timestamps and the frame of values in the same order.
+    """
+    df = pd.read_csv(path, dtype=np.float64)
+    if list(df.columns) != ['timestamp'] + list(columns):
+        raise ValueError(f"{path}: unexpected header {list(df.columns)}, expected {['timestamp'] + list(columns)}")
+    # The server writes seconds with 6 decimals, so rounding to microseconds recovers them exactly
+    timestamps = np.round(df['timestamp'].to_numpy() * 1e6).astype(np.int64) * 1000
+    order = np.argsort(timestamps, kind='stable')
+    return timestamps[order], df.drop(columns='timestamp').iloc[order].reset_index(drop=True)
+
+
+def place(rows, values, length):
+    """
+    Scatter values onto the master rows they align to (NaN elsewhere); when several samples align to one
+    row the last one wins, as in merge_data. rows must be non-decreasing where >= 0.
+    """
+    out = np.full(length, np.nan)
+    keep = rows >= 0
+    rows, values = rows[keep], values[keep]
+    last = np.r_[rows[1:] != rows[:-1], True] if len(rows) else np.zeros(0, dtype=bool)
+    out[rows[last]] = values[last]
+    return out
+
+
+def load_run(main_imu_file, main_pir_file, distance_file, annotation_file=None, master='main_imu', direction='nearest',
+             tolerance=None, experiment_id=1, trial=1):
+    """
+    Read a server.py run into the merged frame of load_merged_data: one row per sample of the master stream
+    (main_imu, main_pir or distance), with the samples of the other streams and the annotations (as
+    'collision' events) on the master row they align to by as-of search (see time_windows.asof_rows),
+    optionally within tolerance (e.g. '50ms'). Columns that are not the master's stay sparse, as the
+    distance samples of merge_data. The whole run is one experiment (experiment_id, trial).
+    """
+    paths = {'main_imu': main_imu_file, 'main_pir': main_pir_file, 'distance': distance_file}
+    if master not in paths:
+        raise ValueError(f"unknown master clock: {master}")
+    streams = {name: read_run_csv(path, RUN_COLUMNS[name]) for name, path in paths.items()}
+    timeline = streams[master][0]
+    tolerance_ns = window_ns(tolerance) if tolerance is not None else None
+
+    df = pd.DataFrame({'timestamp': pd.to_datetime(timeline, unit='ns')})
+    events = pd.DataFrame({'event': None, 'human_id': np.nan}, index=df.index)
+    for name, (timestamps, values) in streams.items():
+        rows = np.arange(len(timeline)) if name == master else asof_rows(timeline, timestamps, direction, tolerance_ns)
+        for column, (merged_column, scale) in RUN_COLUMNS[name].items():
+            df[merged_column] = place(rows, values[column].to_numpy() * scale, len(df))
+
+    if annotation_file is not None:
+        annotation = pd.read_csv(annotation_file)
+        annotation = annotation[annotation['annotation'].astype(str) == 'True']
+        annotation_ns = np.round(annotation['timestamp'].to_numpy(dtype=np.float64) * 1e6).astype(np.int64) * 1000
+        rows = asof_rows(timeline, np.sort(annotation_ns), direction, tolerance_ns)
+        events.loc[rows[rows >= 0], 'event'] = 'collision'
+
+    df = pd.concat([df, events], axis=1)
+    df['experiment_id'] = experiment_id
+    df['trial'] = trial
+    df['event'] = df['event'].astype('category')
+    return df
+
+
+def read_run(run_dir, **kwargs):
+    """
+    The merged frame of a run directory with the pipeline's storage dtypes.
+    """
+    return typed_frame(load_run(**run_files(run_dir), **kwargs))
+
+
+def build_run_pipeline(run_dir, detector, master='main_imu', direction='nearest', tolerance=None,
+                       cache_dir=DEFAULT_CACHE_DIR, **params):
+    """
+    build_pipeline(detector, **params) with the 'merged' stage loading a server.py run directory directly,
+    so no aggregated CSV files are needed. The stage is cached on the content of the run files.
+    """
+    pipeline = build_pipeline(detector, cache_dir=cache_dir, **params)
+    pipeline.add('merged', load_run, files=run_files(run_dir), master=master, direction=direction, tolerance=tolerance)
+    return pipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the detection pipeline on a sensors_setup/server.py run directory.')
+    parser.add_argument('run_dir')
+    parser.add_argument('--detector', choices=DETECTORS, default='combo')
+    parser.add_argument('--master', choices=MASTER_CLOCKS, default='main_imu', help='stream whose samples are the rows')
+    parser.add_argument('--direction', choices=('nearest', 'backward', 'forward'), default='nearest')
+    parser.add_argument('--tolerance', help="largest gap to the master row, e.g. '50ms' (default: none)")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    args = parser.parse_args()
+
+    pipeline = build_run_pipeline(args.run_dir, args.detector, args.master, args.direction, args.tolerance, args.cache_dir)
+    _, measurable_time = pipeline.run('masked')
+    print("Measurable time by phase (s):")
+    print(measurable_time)
+    print_evaluation(pipeline.run('evaluation'))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+import json
+
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LinearRegression
+
+from evaluation import evaluate_performance, remove_data_out_of_measurable_time
+from features import FEATURE_CHANNELS, FEATURE_STATS, FEATURE_WINDOWS, feature_name, rolling_features
+from pipeline import DEFAULT_CACHE_DIR, Pipeline
+from time_windows import asof_rows, to_ns, trailing_hits, window_ns
+
+DATA_FILES = {
+    'pir_distance_sensor_file': 'pir_distance_sensor_data/AggregatedData.csv',
+    'gyro_sensor_file': 'gyro_sensor_data/aggregated_sensor_data.csv',
+    'annotation_file': 'annotation/aggregated_annotation.csv',
+    'config_file': 'annotation/ex_duration_config.json',
+}
+
+DETECTORS = ('pir', 'distance', 'combo')
+
+# Config fields naming an experiment, stored in the experiment_id and trial columns, by experiment set:
+# main_ex numbers its experiments by obstacle count
+EXPERIMENT_KEYS = {
+    'pir_distance_sensor_ex': ('experiment_id', 'trial'),
+    'main_ex': ('num_obstacles', 'trial'),
+}
+
+# Storage dtypes of the stage outputs: labels as categoricals, IDs as small nullable integers,
+# prediction flags as nullable booleans and the remaining float columns (sensor channels) as float32
+PHASE_DTYPE = pd.CategoricalDtype(['turning_time', 'sensor_max_time', 'approaching_time'])
+TURNING, SENSOR_MAX, APPROACHING = range(3)  # codes of the phases in PHASE_DTYPE
+LABEL_COLUMNS = ['event']
+ID_COLUMNS = ['experiment_id', 'trial', 'human_id']
+FLAG_COLUMNS = ['pedestrian_pred', 'pir_window_hit']
+
+
+def load_merged_data(pir_distance_sensor_file, gyro_sensor_file, annotation_file, config_file,
+                     experiment_keys=EXPERIMENT_KEYS['pir_distance_sensor_ex']):
+    """
+    Read the aggregated sensor, annotation and experiment config files and merge them onto the gyro timeline.
+    """
+    pir_distance_sensor_data = pd.read_csv(pir_distance_sensor_file)
+    gyro_sensor_data = pd.read_csv(gyro_sensor_file)
+    gyro_sensor_data = gyro_sensor_data.rename(columns={'time': 'timestamp'})
+    annotation_data = pd.read_csv(annotation_file)
+    with open(config_file) as f:
+        config_data = json.load(f)
+
+    return merge_data(pir_distance_sensor_data, gyro_sensor_data, annotation_data, config_data, experiment_keys)
+
+
+def merge_data(pir_distance_sensor_df, gyro_sensor_df, annotation_df, config_list,
+               experiment_keys=EXPERIMENT_KEYS['pir_distance_sensor_ex']):
+    # Convert timestamps to datetime objects
+    pir_distance_sensor_df['timestamp'] = pd.to_datetime(pir_distance_sensor_df['timestamp'])
+    gyro_sensor_df['timestamp'] = pd.to_datetime(gyro_sensor_df['timestamp'], unit='ns')
+    annotation_df['timestamp'] = pd.to_datetime(annotation_df['timestamp'], unit='s')
+
+    # Create new columns for event and turning flags
+    gyro_sensor_df['event'] = None
+
+    # Merge annotation events and sensor samples into gyro data (assign nearest timestamp)
+    assign_nearest(gyro_sensor_df, annotation_df, ['event', 'human_id'])
+    assign_nearest(gyro_sensor_df, pir_distance_sensor_df, ['PIRvalue', 'distance'])
+
+    # Add experiment configuration details based on timestamp; experiment_keys are the config fields to store
+    experiment_id, trial = experiment_keys
+    gyro_sensor_df['experiment_id'] = pd.Series(pd.NA, index=gyro_sensor_df.index, dtype='Int16')
+    gyro_sensor_df['trial'] = pd.Series(pd.NA, index=gyro_sensor_df.index, dtype='Int16')
+    for config in config_list:
+        start_time = pd.to_datetime(config['experiment_start'], unit='s')
+        end_time = pd.to_datetime(config['experiment_end'], unit='s')
+        mask = (gyro_sensor_df['timestamp'] >= start_time) & (gyro_sensor_df['timestamp'] <= end_time)
+        gyro_sensor_df.loc[mask, 'experiment_id'] = config[experiment_id]
+        gyro_sensor_df.loc[mask, 'trial'] = config[trial]
+
+    gyro_sensor_df.sort_values('timestamp', inplace=True)
+    gyro_sensor_df['event'] = gyro_sensor_df['event'].astype('category')
+
+    return gyro_sensor_df
+
+
+def assign_nearest(df, source_df, columns):
+    """
+    Set columns of df on the row nearest in time to each row of source_df, by binary search on the sorted
+    timestamps instead of a scan of df per source row. Of equally near rows the first one in df is taken,
+    as with idxmin; when several source rows share a nearest row the last one wins.
+    Other rows keep their value (NaN in new columns).
+    """
+    timestamps = to_ns(df['timestamp'])
+    order = np.argsort(timestamps, kind='stable')
+    timeline, query = timestamps[order], to_ns(source_df['timestamp'])
+    rows = asof_rows(timeline, query, 'nearest')
+    # asof_rows breaks ties between an earlier and a later row towards the earlier; idxmin towards the first in df
+    after = np.maximum(asof_rows(timeline, query, 'forward'), 0)
+    tie = (timeline[after] - query == query - timeline[rows]) & (order[after] < order[rows])
+    nearest = order[np.where(tie, after, rows)]
+    # Last source row for each df row it is nearest to
+    last = len(nearest) - 1 - np.unique(nearest[::-1], return_index=True)[1]
+    for column in columns:
+        values = df[column].to_numpy(copy=True) if column in df else np.full(len(df), np.nan)
+        values[nearest[last]] = source_df[column].to_numpy()[last]
+        df[column] = values
+
+
+def sort_by_time(df):
+    """
+    Sort by timestamp with a fresh RangeIndex, skipping the sort when the frame is already in order.
+    """
+    if not df['timestamp'].is_monotonic_increasing:
+        df = df.sort_values('timestamp')
+    return df.reset_index(drop=True)
+
+
+def add_turning_time_prediction(df, features=None, threshold=0.0338):
+    """
+    Compute the turning prediction based on a 1-second rolling average of gyroscope_z.
+    Change the 'phase_pred' to 'turning_time'
+    features is the rolling_features table of df (e.g. the cached 'features' stage); without it only the
+    needed statistic is computed.
+    """
+    df = sort_by_time(df)
+
+    # 1-second rolling average of gyroscope_z
+    name = feature_name('gyroscope_z', 'mean', '1s')
+    if features is None:
+        features = rolling_features(df, ['gyroscope_z'], ['1s'], ['mean'])
+    rolling = features[name].to_numpy()
+    df['rolling_gyroscope_z'] = rolling
+
+    # Mark turning events where the absolute rolling average exceeds the threshold; other rows have no phase yet
+    df['phase_pred'] = pd.Categorical.from_codes(np.where(np.abs(rolling) > threshold, TURNING, -1), dtype=PHASE_DTYPE)
+
+    return df
+
+
+def add_sensor_max_approach_time_prediction(df, sensor_threshold=230, tolerance=2):
+    """
+    sensor_max_time -> the time that the distance sensor values are the maximum(255).
+    To predict this time, calculate the rolling distance. When it's the maximum, change 'phase_pred' to 'sensor_max_time'.
+    approaching_time -> the time that the distance sensor values are decreasing.
+    Compute the expected linearly decreasing distance and change 'distance_pred'.
+
+    Hint: 'approaching_time' -> 'sensor_max_time' is not available.
+    """
+
+    df = sort_by_time(df)
+
+    # The state machine walks the distance samples on the phase codes array instead of the frame
+    phase = df['phase_pred'].astype(PHASE_DTYPE).cat.codes.to_numpy().copy()
+    run_phase_state_machine(phase, df['distance'].to_numpy(dtype=float), sensor_threshold, tolerance)
+
+    # Rows without a distance sample keep the last predicted phase
+    df['phase_pred'] = pd.Categorical.from_codes(phase, dtype=PHASE_DTYPE)
+    df['phase_pred'] = df['phase_pred'].ffill()
+
+    return df
+
+
+def run_phase_state_machine(phase, distance, sensor_threshold=230, tolerance=2, state=None, offset=0, late=None):
+    """
+    Update the phase codes in place from the distance samples (see add_sensor_max_approach_time_prediction).
+    state holds has_approached and below_indices, as row positions counted from offset (the position of phase[0]),
+    so a later call on the following rows can resume where this one stopped. Returns the updated state.
+    The positions before offset that a switch marks approaching are appended to late if it is given.
+    """
+    state = state or {'has_approached': False, 'below_indices': []}
+    has_approached = state['has_approached']
+    below_indices = state['below_indices']
+
+    for i in np.flatnonzero(~np.isnan(distance)):
+        if phase[i] == TURNING:
+            has_approached = False
+            continue
+
+        rd = distance[i]
+
+        if has_approached:
+            phase[i] = APPROACHING
+            continue
+
+        # Before we've seen a clear decrease, allow sensor_max_time if the value is high.
+        if rd >= sensor_threshold:
+            below_indices = []
+            phase[i] = SENSOR_MAX
+        else:
+            below_indices.append(i + offset)
+
+            if len(below_indices) > tolerance:
+                # Rows before offset are not in phase; the caller applies those switches (late)
+                below = np.asarray(below_indices) - offset
+                phase[below[below >= 0]] = APPROACHING
+                if late is not None:
+                    late.extend(below[below < 0] + offset)
+                has_approached = True
+            else:
+                phase[i] = SENSOR_MAX
+
+    return {'has_approached': has_approached, 'below_indices': below_indices}
+
+
+def add_pedestrian_crossed_prediction(df, sensor_threshold=210, distance_threshold=40, time_threshold=6):
+    df['distance_diff'] = np.zeros(len(df), dtype=np.float32)
+    df['distance_pred'] = np.full(len(df), np.nan, dtype=np.float32)
+    df['pedestrian_pred'] = False
+    df['block'] = (df['phase_pred'] != df['phase_pred'].shift(1)).cumsum().astype(np.int32)
+
+    for block_id, group in df[df['distance'].notna()].groupby('block'):
+        phase = group['phase_pred'].iloc[0]
+        if phase == 'turning_time':
+            pass
+        elif phase == 'approaching_time':
+            filtered_group = group[group['distance'] < sensor_threshold]
+            if len(filtered_group) < 2:
+                continue
+            filtered_group.loc[:, "distance_diff"] = filtered_group["distance"].diff()
+            # Keep rows where either distance_diff is NaN (first point) or negative
+            filtered_group = filtered_group[(filtered_group["distance_diff"].isna()) | (filtered_group["distance_diff"] < 0)]
+            if len(filtered_group) < time_threshold:
+                continue
+
+            # Prepare data for linear regression
+            X = (group['timestamp'] - group['timestamp'].min()).dt.total_seconds().values.reshape(-1, 1)
+            filtered_X = (filtered_group['timestamp'] - filtered_group['timestamp'].min()).dt.total_seconds().values.reshape(-1, 1)
+            filtered_y = filtered_group['distance'].values
+
+            reg = LinearRegression().fit(filtered_X, filtered_y)
+            # If the distance is increasing, skip
+            if reg.coef_ > 0:
+                continue
+
+            distance_pred = reg.predict(X)
+            df.loc[group.index, 'distance_pred'] = distance_pred.astype(np.float32)
+            group['distance_pred'] = distance_pred
+
+            # If the distance is lower than the expected distance, mark as pedestrian crossed
+            df.loc[group[group['distance'] + distance_threshold < group['distance_pred']].index, 'pedestrian_pred'] = True
+
+        elif phase == 'sensor_max_time':
+            if len(group) < time_threshold:
+                continue
+
+            wave_active = False
+            for idx, row in group.iterrows():
+                if row['distance'] < sensor_threshold:
+                    if not wave_active:
+                        df.loc[idx, 'pedestrian_pred'] = True
+                        wave_active = True
+                else:
+                    wave_active = False
+
+    return df
+
+
+def add_pir_only_prediction(df, time_window='1s'):
+    """
+    PIR-only pedestrian detection.
+    If PIRvalue == 1 within the time window, mark pedestrian_pred True.
+    """
+    df = sort_by_time(df)
+
+    # Any PIR hit in the trailing window (t - time_window, t]
+    df['pir_window_hit'] = trailing_hits(to_ns(df['timestamp']), (df['PIRvalue'] == 1).to_numpy(), window_ns(time_window))
+
+    df['pedestrian_pred'] = df['pir_window_hit']
+    df.loc[df['phase_pred'] == 'turning_time', 'pedestrian_pred'] = False
+
+    return df
+
+
+def add_pir_distance_combo_prediction(df, time_window='1s'):
+    """
+    Distance-based predictions gated by PIR hits within a rolling time window.
+    """
+    df = sort_by_time(df)
+
+    # Any PIR hit in the trailing window (t - time_window, t]
+    df['pir_window_hit'] = trailing_hits(to_ns(df['timestamp']), (df['PIRvalue'] == 1).to_numpy(), window_ns(time_window))
+
+    df['pedestrian_pred'] = df['pedestrian_pred'] & df['pir_window_hit']
+    df.loc[df['phase_pred'] == 'turning_time', 'pedestrian_pred'] = False
+
+    return df
+
+
+def typed_frame(df):
+    """
+    Cast a stage output to the storage dtypes. The 'None' phase placeholder becomes a missing value.
+    Frames without a timestamp column (e.g. the metrics table) are returned unchanged.
+    """
+    if 'timestamp' not in df.columns:
+        return df
+    df = df.copy(deep=False)
+    for column in df.columns:
+        if column == 'phase_pred':
+            df[column] = df[column].astype(PHASE_DTYPE)
+        elif column in LABEL_COLUMNS:
+            df[column] = df[column].astype('category')
+        elif column in ID_COLUMNS:
+            df[column] = pd.to_numeric(df[column]).astype('Int16')
+        elif column in FLAG_COLUMNS:
+            df[column] = df[column].astype('boolean')
+        elif df[column].dtype == np.float64:
+            df[column] = df[column].astype(np.float32)
+    return df
+
+
+def evaluate_masked(masked, time_window='3s'):
+    """
+    Evaluation stage on the output of remove_data_out_of_measurable_time.
+    """
+    result_df, _ = masked
+    return evaluate_performance(result_df, time_window, verbose=False)
+
+
+def apply_detector(df, detector, sensor_threshold=230, distance_threshold=40, time_threshold=6, pir_time_window='1s'):
+    """
+    Run the crossing and PIR gate stages of a detector on the output of the phase stage, without caching.
+    """
+    if detector in ('distance', 'combo'):
+        df = add_pedestrian_crossed_prediction(df, sensor_threshold, distance_threshold, time_threshold)
+    if detector == 'combo':
+        df = add_pir_distance_combo_prediction(df, pir_time_window)
+    elif detector == 'pir':
+        df = add_pir_only_prediction(df, pir_time_window)
+    return df
+
+
+def build_pipeline(detector, data_files=None, cache_dir=DEFAULT_CACHE_DIR, turning_threshold=0.0338,
+                   sensor_threshold=230, tolerance=2, distance_threshold=40, time_threshold=6,
+                   pir_time_window='1s', transition_window='0.5s', evaluation_window='3s', verbose=True,
+                   experiment_set='pir_distance_sensor_ex'):
+    """
+    Wire the detection stages into a cached Pipeline.
+    detector: 'pir' (PIR only), 'distance' (distance only) or 'combo' (distance gated by PIR).
+    experiment_set: the layout of the config file (see EXPERIMENT_KEYS).
+    Stages: merged -> features -> turning -> phase -> [crossing] -> [pir_gate] -> masked -> evaluation.
+    The 'features' table of rolling statistics is shared by the detectors and the plots.
+    """
+    if detector not in DETECTORS:
+        raise ValueError(f"unknown detector: {detector}")
+
+    pipeline = Pipeline(cache_dir, verbose, normalize=typed_frame)
+    pipeline.add('merged', load_merged_data, files=data_files or DATA_FILES,
+                 experiment_keys=list(EXPERIMENT_KEYS[experiment_set]))
+    pipeline.add('features', rolling_features, deps=['merged'], channels=FEATURE_CHANNELS,
+                 windows=FEATURE_WINDOWS, stats=FEATURE_STATS)
+    pipeline.add('turning', add_turning_time_prediction, deps=['merged', 'features'], threshold=turning_threshold)
+    pipeline.add('phase', add_sensor_max_approach_time_prediction, deps=['turning'],
+                 sensor_threshold=sensor_threshold, tolerance=tolerance)
+
+    last = 'phase'
+    if detector in ('distance', 'combo'):
+        pipeline.add('crossing', add_pedestrian_crossed_prediction, deps=[last], sensor_threshold=sensor_threshold,
+                     distance_threshold=distance_threshold, time_threshold=time_threshold)
+        last = 'crossing'
+    if detector == 'combo':
+        pipeline.add('pir_gate', add_pir_distance_combo_prediction, deps=[last], time_window=pir_time_window)
+        last = 'pir_gate'
+    elif detector == 'pir':
+        pipeline.add('pir_gate', add_pir_only_prediction, deps=[last], time_window=pir_time_window)
+        last = 'pir_gate'
+
+    pipeline.add('masked', remove_data_out_of_measurable_time, deps=[last], transition_window=transition_window)
+    pipeline.add('evaluation', evaluate_masked, deps=['masked'], time_window=evaluation_window)
+    return pipeline
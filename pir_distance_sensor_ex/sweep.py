@@ -0,0 +1,117 @@
+import argparse
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from evaluation import evaluate_by_experiment, remove_data_out_of_measurable_time, summarize_metrics
+from pipeline import DEFAULT_CACHE_DIR, load_output
+from stages import DETECTORS, apply_detector, build_pipeline
+
+# Columns the detector, masking and evaluation stages read from the phase output
+SWEEP_COLUMNS = ['timestamp', 'distance', 'PIRvalue', 'phase_pred', 'event', 'experiment_id', 'trial']
+PHASE_PARAMS = ['turning_threshold', 'sensor_threshold', 'tolerance']
+DETECTOR_PARAMS = ['distance_threshold', 'time_threshold', 'pir_time_window']
+
+# Phase outputs already memory-mapped by this worker process, by cache path
+_phase_frames = {}
+
+
+def float_list(value):
+    return [float(v) for v in value.split(',')]
+
+
+def int_list(value):
+    return [int(v) for v in value.split(',')]
+
+
+def str_list(value):
+    return value.split(',')
+
+
+def run_phase_stage(detector, cache_dir, phase_params):
+    """
+    Compute (or reuse) the cached phase stage for one turning/sensor/tolerance combination.
+    """
+    pipeline = build_pipeline(detector, cache_dir=cache_dir, verbose=False, **phase_params)
+    pipeline.run('phase')
+    return pipeline.cache_path('phase')
+
+
+def evaluate_combination(detector, phase_path, params, transition_window, evaluation_window):
+    """
+    Run the detector, masking and evaluation stages for one parameter combination.
+    The phase output is read through memory-mapped column files instead of being pickled to the worker.
+    """
+    if phase_path not in _phase_frames:
+        _phase_frames[phase_path] = load_output(phase_path, columns=SWEEP_COLUMNS, mmap=True)
+
+    result_df = apply_detector(_phase_frames[phase_path].copy(), detector, params['sensor_threshold'],
+                               params['distance_threshold'], params['time_threshold'], params['pir_time_window'])
+    result_df, _ = remove_data_out_of_measurable_time(result_df, transition_window)
+    metrics = evaluate_by_experiment(result_df, evaluation_window)
+    for name, value in params.items():
+        metrics[name] = value
+    return metrics
+
+
+def sweep(detector, grid, cache_dir=DEFAULT_CACHE_DIR, transition_window='0.5s', evaluation_window='3s', workers=None):
+    """
+    Evaluate every combination of the parameter grid across a process pool.
+    Merged and turning stages come from the pipeline cache; each distinct phase stage is computed once.
+    Returns the per-experiment, per-phase metrics table.
+    """
+    # Merged and turning stages are shared by many combinations, so build them once up front
+    for turning_threshold in grid['turning_threshold']:
+        build_pipeline(detector, cache_dir=cache_dir, turning_threshold=turning_threshold).run('turning')
+
+    phase_combinations = [dict(zip(PHASE_PARAMS, values)) for values in itertools.product(*(grid[p] for p in PHASE_PARAMS))]
+    detector_combinations = [dict(zip(DETECTOR_PARAMS, values)) for values in itertools.product(*(grid[p] for p in DETECTOR_PARAMS))]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        phase_paths = list(pool.map(run_phase_stage, itertools.repeat(detector), itertools.repeat(cache_dir), phase_combinations))
+
+        futures = []
+        for phase_params, phase_path in zip(phase_combinations, phase_paths):
+            for detector_params in detector_combinations:
+                params = {**phase_params, **detector_params}
+                futures.append(pool.submit(evaluate_combination, detector, phase_path, params,
+                                           transition_window, evaluation_window))
+        tables = [future.result() for future in futures]
+
+    metrics = pd.concat(tables, ignore_index=True)
+    param_columns = PHASE_PARAMS + DETECTOR_PARAMS
+    return metrics[param_columns + [c for c in metrics.columns if c not in param_columns]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parameter sweep over the pedestrian detection thresholds.')
+    parser.add_argument('--detector', choices=DETECTORS, default='combo')
+    parser.add_argument('--turning-threshold', type=float_list, default=[0.0338])
+    parser.add_argument('--sensor-threshold', type=int_list, default=[230])
+    parser.add_argument('--tolerance', type=int_list, default=[2])
+    parser.add_argument('--distance-threshold', type=int_list, default=[40])
+    parser.add_argument('--time-threshold', type=int_list, default=[6])
+    parser.add_argument('--pir-time-window', type=str_list, default=['1s'])
+    parser.add_argument('--transition-window', default='0.5s')
+    parser.add_argument('--evaluation-window', default='3s')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output', default='sweep_results.csv')
+    args = parser.parse_args()
+
+    grid = {name: getattr(args, name) for name in PHASE_PARAMS + DETECTOR_PARAMS}
+    metrics = sweep(args.detector, grid, args.cache_dir, args.transition_window, args.evaluation_window, args.workers)
+    metrics.to_csv(args.output, index=False)
+    print(f"Sweep results written to {os.path.abspath(args.output)}")
+
+    # Best combinations per phase over all experiments
+    summary = summarize_metrics(metrics, PHASE_PARAMS + DETECTOR_PARAMS + ['phase'])
+    for phase, group in summary.groupby('phase'):
+        print(f"\n{phase.upper()} (top 5 by F1):")
+        print(group.sort_values('f1', ascending=False).head(5).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+
+
+def to_ns(timestamps):
+    """
+    Convert a datetime Series/array to int64 nanoseconds.
+    """
+    return np.asarray(pd.to_datetime(timestamps), dtype='datetime64[ns]').astype(np.int64)
+
+
+def window_ns(time_window):
+    """
+    Convert a window such as '3s' or pd.Timedelta to int64 nanoseconds.
+    """
+    return pd.Timedelta(time_window).value
+
+
+def count_events_in_window(event_ns, query_ns, before_ns, after_ns, closed='both'):
+    """
+    For each query timestamp q, count the events e with q - before_ns <= e <= q + after_ns.
+    With closed='right' the left edge is open (q - before_ns < e), matching pandas' time-based rolling.
+    event_ns must be sorted. The search position in event_ns is the cumulative event count up to a
+    timestamp, so two binary searches per query replace a full-length window mask.
+    """
+    event_ns = np.asarray(event_ns, dtype=np.int64)
+    query_ns = np.asarray(query_ns, dtype=np.int64)
+    lo = np.searchsorted(event_ns, query_ns - before_ns, side='left' if closed == 'both' else 'right')
+    hi = np.searchsorted(event_ns, query_ns + after_ns, side='right')
+    return hi - lo
+
+
+def trailing_hits(timestamps_ns, hit, before_ns):
+    """
+    For each row of a frame sorted by time, whether any hit row up to and including it lies in the
+    trailing window (t - before_ns, t], as hit.rolling(window).max() on a time index. Unlike
+    count_events_in_window(..., closed='right'), hits in later rows with the same timestamp do not count.
+    """
+    timestamps_ns = np.asarray(timestamps_ns, dtype=np.int64)
+    hit = np.asarray(hit, dtype=bool)
+    hits_so_far = np.cumsum(hit)
+    lo = np.searchsorted(timestamps_ns[hit], timestamps_ns - before_ns, side='right')
+    return hits_so_far > lo
+
+
+def merge_windows(center_ns, before_ns, after_ns):
+    """
+    Merge the closed windows [c - before_ns, c + after_ns] around sorted centers into a sorted,
+    non-overlapping interval union. Returns (starts, ends).
+    """
+    center_ns = np.asarray(center_ns, dtype=np.int64)
+    if len(center_ns) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    starts = center_ns - before_ns
+    ends = center_ns + after_ns
+
+    # All windows have the same width, so a new interval begins whenever a start passes the previous end.
+    new_interval = np.empty(len(starts), dtype=bool)
+    new_interval[0] = True
+    new_interval[1:] = starts[1:] > ends[:-1]
+    last_of_interval = np.append(new_interval[1:], True)
+    return starts[new_interval], ends[last_of_interval]
+
+
+def in_intervals(ts_ns, starts, ends):
+    """
+    Return a boolean array telling whether each timestamp falls in the closed interval union.
+    """
+    ts_ns = np.asarray(ts_ns, dtype=np.int64)
+    idx = np.searchsorted(starts, ts_ns, side='right') - 1
+    inside = idx >= 0
+    inside[inside] = ts_ns[inside] <= ends[idx[inside]]
+    return inside
+
+
+def covered_ns(starts, ends, a_ns, b_ns):
+    """
+    Length of the overlap between the interval union and each span [a, b), in nanoseconds.
+    """
+    cum_length = np.concatenate([[0], np.cumsum(ends - starts)])
+
+    def covered_until(x):
+        # Intervals starting at or before x count fully, minus the part of the last one beyond x.
+        x = np.asarray(x, dtype=np.int64)
+        idx = np.searchsorted(starts, x, side='right')
+        covered = cum_length[idx]
+        has_prev = idx > 0
+        prev = idx[has_prev] - 1
+        covered[has_prev] -= np.maximum(ends[prev] - x[has_prev], 0)
+        return covered
+
+    return covered_until(b_ns) - covered_until(a_ns)
+
+
+def asof_rows(timeline, timestamps, direction='nearest', tolerance_ns=None):
+    """
+    Position of the timeline entry each timestamp aligns to, as in pd.merge_asof: the last entry at or before
+    it ('backward'), the first at or after it ('forward') or the nearest one ('nearest', ties going to the
+    earlier entry as with idxmin). -1 where there is none or it is further away than tolerance_ns.
+    timeline must be sorted.
+    """
+    timeline = np.asarray(timeline, dtype=np.int64)
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    if len(timeline) == 0:
+        return np.full(len(timestamps), -1)
+
+    if direction == 'backward':
+        rows = np.searchsorted(timeline, timestamps, side='right') - 1
+    elif direction == 'forward':
+        rows = np.searchsorted(timeline, timestamps, side='left')
+        rows[rows == len(timeline)] = -1
+    elif direction == 'nearest':
+        right = np.searchsorted(timeline, timestamps, side='left')
+        left = right - 1
+        has_right = right < len(timeline)
+        closer_left = (left >= 0) & (~has_right | (timestamps - timeline[np.maximum(left, 0)]
+                                                  <= timeline[np.minimum(right, len(timeline) - 1)] - timestamps))
+        # First of repeated timeline entries, as idxmin
+        left = np.searchsorted(timeline, timeline[np.maximum(left, 0)], side='left')
+        rows = np.where(closer_left, left, np.where(has_right, right, -1))
+    else:
+        raise ValueError(f"unknown direction: {direction}")
+
+    if tolerance_ns is not None:
+        rows[np.abs(timeline[np.maximum(rows, 0)] - timestamps) > tolerance_ns] = -1
+    return rows
@@ -0,0 +1,351 @@
+import argparse
+import asyncio
+import csv
+import os
+import shutil
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterator
+
+import numpy as np
+
+from server import (
+    BASE_OUT_DIR,
+    DISTANCE_PACKET,
+    FRAME_HEIGHT,
+    FRAME_WIDTH,
+    HDR,
+    MAIN_META,
+    N_PIXELS,
+    PORTS,
+    THERMAL_ONLY_NAMES,
+    TIMERCAM_NAMES,
+    CsvSink,
+    dispatch,
+    make_csv_sinks,
+)
+
+# Messages handed to the handlers between yields to the event loop when replaying as fast as possible
+MAX_SPEED_BATCH = 64
+
+
+def read_rows(path: str) -> Iterator[list[str]]:
+    with open(path, newline="") as fh:
+        reader = csv.reader(fh)
+        next(reader, None)
+        for row in reader:
+            if row:
+                yield row
+
+
+def thermal_payload(values: list[str]) -> bytes:
+    return np.asarray(values, dtype="<f4").tobytes()
+
+
+def main_messages(run_dir: str) -> Iterator[tuple[float, bytes]]:
+    """
+    Rebuild the main controller packets from main_imu.csv, main_pir.csv and main.csv.
+    The server writes one row to each file per packet, so the files are read in lockstep.
+    A run without main.csv is replayed with NaN thermal frames.
+    """
+    imu = read_rows(os.path.join(run_dir, "main_imu.csv"))
+    pir = read_rows(os.path.join(run_dir, "main_pir.csv"))
+    thermal_path = os.path.join(run_dir, "main.csv")
+    nan_frame = np.full(N_PIXELS, np.nan, dtype="<f4").tobytes()
+    thermal = read_rows(thermal_path) if os.path.exists(thermal_path) else None
+
+    header = HDR.pack(FRAME_WIDTH, FRAME_HEIGHT)
+    for imu_row, pir_row in zip(imu, pir):
+        frame = nan_frame
+        if thermal is not None:
+            thermal_row = next(thermal, None)
+            if thermal_row is None:
+                return
+            frame = thermal_payload(thermal_row[1:])
+        gyro_accel = [float(v) for v in imu_row[1:7]]
+        meta = MAIN_META.pack(int(pir_row[1]), int(pir_row[2]), float(pir_row[3]), *gyro_accel)
+        yield float(imu_row[0]), header + meta + frame
+
+
+def distance_messages(run_dir: str) -> Iterator[tuple[float, bytes]]:
+    for row in read_rows(os.path.join(run_dir, "distance.csv")):
+        yield float(row[0]), DISTANCE_PACKET.pack(float(row[1]))
+
+
+def thermal_messages(run_dir: str, name: str) -> Iterator[tuple[float, bytes]]:
+    header = HDR.pack(FRAME_WIDTH, FRAME_HEIGHT)
+    for row in read_rows(os.path.join(run_dir, f"{name}.csv")):
+        yield float(row[0]), header + thermal_payload(row[1:])
+
+
+def timercam_messages(run_dir: str, name: str) -> Iterator[tuple[float, bytes]]:
+    """
+    JPEG payloads from the timercam index; images missing from the run are replaced by zero bytes of the recorded size.
+    """
+    for row in read_rows(os.path.join(run_dir, f"{name}.csv")):
+        image_path = os.path.join(run_dir, name, row[1])
+        if os.path.exists(image_path):
+            with open(image_path, "rb") as fh:
+                payload = fh.read()
+        else:
+            payload = bytes(int(row[2]))
+        yield float(row[0]), payload
+
+
+def device_messages(run_dir: str, name: str) -> Iterator[tuple[float, bytes]] | None:
+    """
+    Recorded (timestamp, payload) messages of a device, or None if the run has no data for it.
+    """
+    if name == "main":
+        paths = ["main_imu.csv", "main_pir.csv"]
+        messages = main_messages(run_dir)
+    elif name == "distance":
+        paths = ["distance.csv"]
+        messages = distance_messages(run_dir)
+    elif name in THERMAL_ONLY_NAMES:
+        paths = [f"{name}.csv"]
+        messages = thermal_messages(run_dir, name)
+    elif name in TIMERCAM_NAMES:
+        paths = [f"{name}.csv"]
+        messages = timercam_messages(run_dir, name)
+    else:
+        return None
+
+    for path in paths:
+        full_path = os.path.join(run_dir, path)
+        if not os.path.exists(full_path) or next(read_rows(full_path), None) is None:
+            return None
+    return messages
+
+
+@dataclass
+class ReplayStats:
+    # Per device and stage, the latency of every message in seconds
+    latencies: Dict[str, Dict[str, list[float]]] = field(default_factory=dict)
+    first_ts: float | None = None
+    last_ts: float | None = None
+    wall_seconds: float = 0.0
+
+    def record(self, name: str, stage: str, seconds: float) -> None:
+        self.latencies.setdefault(name, {}).setdefault(stage, []).append(seconds)
+
+    def messages(self, name: str) -> int:
+        return len(self.latencies.get(name, {}).get("handle", []))
+
+    def report(self) -> str:
+        total = sum(self.messages(name) for name in self.latencies)
+        span = (self.last_ts - self.first_ts) if self.first_ts is not None else 0.0
+        wall = self.wall_seconds
+        lines = [
+            f"replayed {total} messages covering {span:.1f}s of recording in {wall:.2f}s "
+            f"({total / wall if wall > 0 else 0.0:.0f} msg/s, {span / wall if wall > 0 else 0.0:.1f}x real time)",
+            f"{'device':<10} {'stage':<7} {'count':>8} {'mean_us':>9} {'p50_us':>9} {'p95_us':>9} {'max_us':>9}",
+        ]
+        for name, stages in self.latencies.items():
+            for stage, values in stages.items():
+                us = np.asarray(values) * 1e6
+                lines.append(
+                    f"{name:<10} {stage:<7} {len(us):>8} {us.mean():>9.1f} {np.percentile(us, 50):>9.1f} "
+                    f"{np.percentile(us, 95):>9.1f} {us.max():>9.1f}"
+                )
+        return "\n".join(lines)
+
+
+class ReplaySocket:
+    """
+    Stands in for the device websocket: yields the recorded payloads, paced by their timestamps.
+    Latencies recorded per message:
+      source: reading and encoding the payload from the run files
+      lag:    how late the payload was delivered against the paced schedule (speed > 0 only)
+      handle: the server handler, from delivering the payload until it asks for the next one
+    """
+
+    def __init__(
+        self,
+        name: str,
+        messages: Iterator[tuple[float, bytes]],
+        stats: ReplayStats,
+        speed: float,
+        rec_start: float,
+        wall_start: float,
+    ):
+        self.name = name
+        self.remote_address = ("replay", PORTS[name])
+        self.ts = rec_start
+        self._messages = messages
+        self._stats = stats
+        self._speed = speed
+        self._rec_start = rec_start
+        self._wall_start = wall_start
+        self._delivered_at: float | None = None
+        self._count = 0
+
+    def clock(self) -> float:
+        return self.ts
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        now = time.perf_counter()
+        if self._delivered_at is not None:
+            self._stats.record(self.name, "handle", now - self._delivered_at)
+
+        message = next(self._messages, None)
+        started = time.perf_counter()
+        if message is None:
+            raise StopAsyncIteration
+        ts, payload = message
+        self._stats.record(self.name, "source", started - now)
+
+        if self._speed > 0:
+            due = self._wall_start + (ts - self._rec_start) / self._speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._stats.record(self.name, "lag", max(time.perf_counter() - due, 0.0))
+        else:
+            self._count += 1
+            if self._count % MAX_SPEED_BATCH == 0:
+                await asyncio.sleep(0)
+
+        self.ts = ts
+        self._delivered_at = time.perf_counter()
+        return payload
+
+
+class TimedSink:
+    """
+    CsvSink wrapper recording the write latency of a device ('write' stage, part of 'handle').
+    """
+
+    def __init__(self, sink: CsvSink, name: str, stats: ReplayStats):
+        self.path = sink.path
+        self._sink = sink
+        self._name = name
+        self._stats = stats
+
+    def write(self, row: list) -> None:
+        started = time.perf_counter()
+        self._sink.write(row)
+        self._stats.record(self._name, "write", time.perf_counter() - started)
+
+    def close(self) -> None:
+        self._sink.close()
+
+
+def first_timestamp(run_dir: str, name: str) -> float | None:
+    messages = device_messages(run_dir, name)
+    if messages is None:
+        return None
+    first = next(messages, None)
+    return None if first is None else first[0]
+
+
+async def replay(run_dir: str, out_dir: str, speed: float = 0.0, devices: list[str] | None = None) -> ReplayStats:
+    """
+    Feed the recorded messages of run_dir through the server's dispatch/handler path into out_dir.
+    speed is the multiple of real time to replay at; 0 replays as fast as possible.
+    """
+    devices = devices or list(PORTS)
+    starts = {name: first_timestamp(run_dir, name) for name in devices}
+    devices = [name for name in devices if starts[name] is not None]
+    if not devices:
+        raise ValueError(f"no recorded device data in {run_dir}")
+
+    stats = ReplayStats()
+    rec_start = min(starts[name] for name in devices)
+    wall_start = time.perf_counter()
+
+    sinks = make_csv_sinks(out_dir)
+    # Devices write to their own sinks except main, which fills three
+    owners = {"main_imu": "main", "main_pir": "main"}
+    timed_sinks = {key: TimedSink(sink, owners.get(key, key), stats) for key, sink in sinks.items()}
+
+    sockets = [
+        ReplaySocket(name, device_messages(run_dir, name), stats, speed, rec_start, wall_start)
+        for name in devices
+    ]
+    try:
+        await asyncio.gather(*(
+            dispatch(socket, name=socket.name, sinks=timed_sinks, out_dir=out_dir, clock=socket.clock)
+            for socket in sockets
+        ))
+    finally:
+        for sink in sinks.values():
+            sink.close()
+
+    stats.wall_seconds = time.perf_counter() - wall_start
+    stats.first_ts = rec_start
+    stats.last_ts = max(socket.ts for socket in sockets)
+    return stats
+
+
+def compare_runs(run_dir: str, out_dir: str, devices: list[str]) -> list[str]:
+    """
+    Compare the replayed CSVs against the recorded ones, row by row.
+    Timercam image names are derived from the timestamp and may differ in the last microsecond, so only
+    the timestamp and byte count columns of the timercam indexes are compared.
+    Returns one line per file that differs.
+    """
+    files = {
+        "main": ["main.csv", "main_imu.csv", "main_pir.csv"],
+        "distance": ["distance.csv"],
+    }
+    differences = []
+    for name in devices:
+        for filename in files.get(name, [f"{name}.csv"]):
+            recorded_path = os.path.join(run_dir, filename)
+            if not os.path.exists(recorded_path):
+                continue
+            recorded = list(read_rows(recorded_path))
+            replayed = list(read_rows(os.path.join(out_dir, filename)))
+            if name in TIMERCAM_NAMES:
+                recorded = [[row[0], row[2]] for row in recorded]
+                replayed = [[row[0], row[2]] for row in replayed]
+            mismatched = sum(a != b for a, b in zip(recorded, replayed))
+            if mismatched or len(recorded) != len(replayed):
+                differences.append(
+                    f"{filename}: {len(recorded)} recorded rows, {len(replayed)} replayed, {mismatched} differ"
+                )
+    return differences
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay a recorded server run through the live handlers.")
+    parser.add_argument("run_dir", help="recorded run, e.g. out/20250101_1200 or just the run id")
+    parser.add_argument("--speed", type=float, default=0.0, help="multiple of real time; 0 = as fast as possible")
+    parser.add_argument("--out-dir", default=None, help="replay output dir (default: <run_dir>_replay)")
+    parser.add_argument("--devices", default=None, help="comma-separated device names (default: all in the run)")
+    parser.add_argument("--overwrite", action="store_true", help="remove an existing output dir first")
+    parser.add_argument("--compare", action="store_true", help="check the replayed CSVs against the recorded ones")
+    args = parser.parse_args()
+
+    run_dir = args.run_dir
+    if not os.path.isdir(run_dir):
+        run_dir = os.path.join(BASE_OUT_DIR, run_dir)
+    run_dir = os.path.abspath(run_dir)
+    out_dir = args.out_dir or f"{run_dir.rstrip(os.sep)}_replay"
+    devices = args.devices.split(",") if args.devices else None
+
+    # CsvSink appends, so a previous replay would be duplicated
+    if os.path.exists(out_dir) and os.listdir(out_dir):
+        if not args.overwrite:
+            raise SystemExit(f"output dir {out_dir} is not empty (use --overwrite)")
+        shutil.rmtree(out_dir)
+
+    mode = "as fast as possible" if args.speed <= 0 else f"at {args.speed:g}x"
+    print(f"Replaying {run_dir} {mode} into {out_dir}")
+    stats = asyncio.run(replay(run_dir, out_dir, args.speed, devices))
+    print(stats.report())
+
+    if args.compare:
+        differences = compare_runs(run_dir, out_dir, list(stats.latencies))
+        for line in differences:
+            print(f"[compare] {line}")
+        if not differences:
+            print("[compare] replayed CSVs match the recording")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@ import os
 import struct
 import time
 from dataclasses import dataclass
-from typing import Dict
+from typing import Callable, Dict
 import socket
 
 import numpy as np
@@ -242,7 +242,7 @@ def maybe_log_status(
     return 0, now
 
 
-async def handle_main(websocket, sinks: Dict[str, CsvSink]) -> None:
+async def handle_main(websocket, sinks: Dict[str, CsvSink], clock: Callable[[], float] = now_ts) -> None:
     count = 0
     window_count = 0
     window_started_at = time.monotonic()
@@ -255,7 +255,7 @@ async def handle_main(websocket, sinks: Dict[str, CsvSink]) -> None:
             print("[main] ignoring text payload")
             continue
 
-        ts = now_ts()
+        ts = clock()
         try:
             pkt = decode_main_packet(payload)
         except Exception as exc:
@@ -295,7 +295,7 @@ async def handle_main(websocket, sinks: Dict[str, CsvSink]) -> None:
         )
 
 
-async def handle_distance(websocket, sink: CsvSink) -> None:
+async def handle_distance(websocket, sink: CsvSink, clock: Callable[[], float] = now_ts) -> None:
     count = 0
     window_count = 0
     window_started_at = time.monotonic()
@@ -310,7 +310,7 @@ async def handle_distance(websocket, sink: CsvSink) -> None:
             print(f"[distance] bad packet size: {len(payload)}")
             continue
 
-        ts = now_ts()
+        ts = clock()
         (distance_cm,) = DISTANCE_PACKET.unpack(payload)
         sink.write([f"{ts:.6f}", f"{float(distance_cm):.6f}"])
 
@@ -325,7 +325,7 @@ async def handle_distance(websocket, sink: CsvSink) -> None:
         )
 
 
-async def handle_thermal(websocket, name: str, sink: CsvSink) -> None:
+async def handle_thermal(websocket, name: str, sink: CsvSink, clock: Callable[[], float] = now_ts) -> None:
     count = 0
     window_count = 0
     window_started_at = time.monotonic()
@@ -338,7 +338,7 @@ async def handle_thermal(websocket, name: str, sink: CsvSink) -> None:
             print(f"[{name}] ignoring text payload")
             continue
 
-        ts = now_ts()
+        ts = clock()
         try:
             frame = decode_thermal_packet(payload)
         except Exception as exc:
@@ -359,7 +359,9 @@ async def handle_thermal(websocket, name: str, sink: CsvSink) -> None:
         )
 
 
-async def handle_timercam(websocket, name: str, csv_sink: CsvSink, image_dir: str) -> None:
+async def handle_timercam(
+    websocket, name: str, csv_sink: CsvSink, image_dir: str, clock: Callable[[], float] = now_ts
+) -> None:
     count = 0
     window_count = 0
     window_started_at = time.monotonic()
@@ -371,7 +373,7 @@ async def handle_timercam(websocket, name: str, csv_sink: CsvSink, image_dir: st
             print(f"[{name}] ignoring text payload")
             continue
 
-        ts = now_ts()
+        ts = clock()
         filename = f"{name}_{int(ts * 1000000)}.jpg"
         image_path = os.path.join(image_dir, filename)
         with open(image_path, "wb") as fh:
@@ -414,21 +416,29 @@ def make_csv_sinks(out_dir: str) -> Dict[str, CsvSink]:
     return sinks
 
 
-async def dispatch(websocket, *, name: str, sinks: Dict[str, CsvSink], out_dir: str) -> None:
+async def dispatch(
+    websocket,
+    *,
+    name: str,
+    sinks: Dict[str, CsvSink],
+    out_dir: str,
+    clock: Callable[[], float] = now_ts,
+) -> None:
+    # clock stamps each received message; replay.py passes the recorded time instead of the wall clock
     try:
         if name == "main":
-            await handle_main(websocket, sinks)
+            await handle_main(websocket, sinks, clock)
             return
         if name == "distance":
-            await handle_distance(websocket, sinks["distance"])
+            await handle_distance(websocket, sinks["distance"], clock)
             return
         if name in THERMAL_ONLY_NAMES:
-            await handle_thermal(websocket, name, sinks[name])
+            await handle_thermal(websocket, name, sinks[name], clock)
             return
         if name in TIMERCAM_NAMES:
             image_dir = os.path.join(out_dir, name)
             os.makedirs(image_dir, exist_ok=True)
-            await handle_timercam(websocket, name, sinks[name], image_dir)
+            await handle_timercam(websocket, name, sinks[name], image_dir, clock)
             return
         print(f"[{name}] no handler")
     except websockets.ConnectionClosed as exc:
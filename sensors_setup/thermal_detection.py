@@ -0,0 +1,298 @@
+import argparse
+import csv
+import os
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from server import BASE_OUT_DIR, FRAME_HEIGHT, FRAME_WIDTH, N_PIXELS
+from thermal_store import THERMAL_CAMERAS, open_recording
+from thermal_surround import match_frames
+
+CANDIDATE_COLUMNS = ["camera", "frame", "timestamp", "x", "y", "area", "max_temp", "mean_temp", "ambient"]
+
+# Neighbour offsets of 8-connected blobs
+NEIGHBOURS = [(dy, dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1) if (dy, dx) != (0, 0)]
+
+
+@dataclass
+class DetectorConfig:
+    background: str = "ema"  # "ema" or "median"
+    alpha: float = 0.02  # EMA weight of a new frame
+    median_frames: int = 64  # history of the median background
+    median_step: int = 8  # frames between median background updates
+    min_above_background: float = 1.5  # degC a warm pixel must exceed the background by
+    min_above_ambient: float = 2.0  # ... and the ambient temperature by
+    min_area: int = 3  # pixels of a person candidate
+    max_area: int = 300
+    batch_frames: int = 512  # frames per camera labelled in one pass
+
+
+@dataclass
+class ThermalFrames:
+    name: str
+    timestamps: np.ndarray  # (T,) seconds
+    frames: np.ndarray  # (T, FRAME_HEIGHT, FRAME_WIDTH) degC
+    ambient: np.ndarray | None = None  # (T,) degC, if the camera reports it
+
+
+def read_numeric_csv(path: str, columns: int) -> np.ndarray:
+    """
+    Rows of a numeric server CSV as a (rows, columns) float64 array, parsed in one call.
+    A partly written last row is dropped.
+    """
+    with open(path) as fh:
+        fh.readline()
+        body = fh.read()
+    values = np.fromstring(body.replace("\n", ","), dtype=np.float64, sep=",")
+    rows = len(values) // columns
+    return values[: rows * columns].reshape(rows, columns)
+
+
+def load_thermal_frames(run_dir: str, name: str) -> ThermalFrames:
+    """
+    Frames of one camera as a (T, 24, 32) float32 array mapped from the thermal store (converting the CSV
+    if needed, see thermal_store.py). The main camera's frames get the ambient temperature recorded with
+    them in main_pir.csv.
+    """
+    recording = open_recording(run_dir, name)
+    timestamps, frames = recording.timestamps, recording.frames
+
+    ambient = None
+    pir_path = os.path.join(run_dir, "main_pir.csv")
+    if name == "main" and os.path.exists(pir_path):
+        pir = read_numeric_csv(pir_path, 4)
+        if len(pir):
+            # Same messages, so the timestamps match; take the nearest one in case a row is missing
+            pir = pir[np.argsort(pir[:, 0], kind="stable")]
+            ambient = pir[match_frames(pir[:, 0], timestamps, "nearest"), 3].astype(np.float32)
+    return ThermalFrames(name, timestamps, frames, ambient)
+
+
+def ema_backgrounds(frames: np.ndarray, initial: np.ndarray, alpha: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Exponential moving average background b[k+1] = (1 - alpha) b[k] + alpha x[k] for a batch at once:
+    the background each frame is compared to (from the frames before it, b[0] = initial) and the
+    background after the last frame. The recurrence is unrolled into one lower-triangular matrix product.
+    """
+    t = len(frames)
+    k = np.arange(t)
+    decay = (1 - alpha) ** np.arange(t + 1, dtype=np.float64)
+    lag = np.subtract.outer(k, k) - 1
+    weights = np.where(lag >= 0, alpha * decay[np.maximum(lag, 0)], 0.0).astype(np.float32)
+    flat = frames.reshape(t, -1)
+    bg = decay[:t, None].astype(np.float32) * initial.reshape(1, -1) + weights @ flat
+    last = decay[t] * initial.reshape(-1) + (alpha * decay[t - 1 - k]).astype(np.float32) @ flat
+    return bg.reshape(frames.shape), last.reshape(initial.shape).astype(np.float32)
+
+
+def median_backgrounds(frames: np.ndarray, history: np.ndarray, n: int, step: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Per-pixel median of the last n frames before each block of step frames (of the history at the start),
+    and the history after the batch.
+    """
+    stack = np.concatenate([history, frames])
+    offset = len(history)
+    bg = np.empty_like(frames)
+    for start in range(0, len(frames), step):
+        bg[start: start + step] = np.median(stack[max(offset + start - n, 0): offset + start], axis=0)
+    return bg, stack[-n:]
+
+
+class BackgroundModel:
+    """
+    Per-pixel background of one camera, updated a batch of frames at a time; each frame is compared to the
+    background of the frames before it (the first frame of a run starts the background).
+    Warm pixels do not update the background, so people standing still are not absorbed into it: a first
+    pass finds them against the background of the raw frames, and the update uses that background in their place.
+    """
+
+    def __init__(self, config: DetectorConfig):
+        if config.background not in ("ema", "median"):
+            raise ValueError(f"unknown background model: {config.background}")
+        self.config = config
+        self.state: np.ndarray | None = None  # ema: background after the last frame; median: the last frames
+
+    def _backgrounds(self, frames: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        config = self.config
+        if config.background == "ema":
+            initial = frames[0] if self.state is None else self.state
+            return ema_backgrounds(frames, initial, config.alpha)
+        history = frames[:1] if self.state is None else self.state
+        return median_backgrounds(frames, history, config.median_frames, config.median_step)
+
+    def update(self, frames: np.ndarray, ambient: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Warm pixel mask and background of each frame of the batch; advances the model past the batch.
+        """
+        first, _ = self._backgrounds(frames)
+        background, self.state = self._backgrounds(np.where(warm_pixels(frames, first, ambient, self.config), first, frames))
+        return warm_pixels(frames, background, ambient, self.config), background
+
+
+def frame_ambient(frames: np.ndarray, ambient: np.ndarray | None) -> np.ndarray:
+    # Cameras that do not report the ambient temperature use the median pixel of each frame
+    return np.median(frames.reshape(len(frames), -1), axis=1) if ambient is None else ambient
+
+
+def warm_pixels(frames: np.ndarray, background: np.ndarray, ambient: np.ndarray, config: DetectorConfig) -> np.ndarray:
+    return ((frames - background >= config.min_above_background)
+            & (frames >= ambient[:, None, None] + config.min_above_ambient))
+
+
+def label_blobs(mask: np.ndarray) -> tuple[np.ndarray, int]:
+    """
+    8-connected components of a (T, H, W) mask within each frame, for all frames at once: every pixel takes
+    the smallest flat index of its neighbours until nothing changes, with pointer jumping (each pixel then
+    takes the label of the pixel its label points to) so long blobs converge in few rounds.
+    Returns the component of each pixel (-1 outside the mask), numbered in frame order, and their count.
+    """
+    t, h, w = mask.shape
+    size = mask.size
+    labels = np.where(mask, np.arange(size, dtype=np.int64).reshape(mask.shape), size)
+    padded = np.full((t, h + 2, w + 2), size, dtype=np.int64)
+    while True:
+        padded[:, 1:-1, 1:-1] = labels
+        new = labels.copy()
+        for dy, dx in NEIGHBOURS:
+            np.minimum(new, padded[:, 1 + dy: h + 1 + dy, 1 + dx: w + 1 + dx], out=new)
+        new[~mask] = size
+        new = np.append(new.ravel(), size)[new]
+        if np.array_equal(new, labels):
+            break
+        labels = new
+
+    components = np.full(mask.shape, -1, dtype=np.int64)
+    roots, components[mask] = np.unique(labels[mask], return_inverse=True)
+    return components, len(roots)
+
+
+@dataclass
+class Candidates:
+    # One entry per person candidate (a warm blob of min_area..max_area pixels); x, y are the pixel centroid
+    camera: list[str] = field(default_factory=list)
+    columns: dict[str, list[np.ndarray]] = field(default_factory=dict)
+
+    def add(self, camera: str, values: dict[str, np.ndarray]) -> None:
+        self.camera.extend([camera] * len(values["frame"]))
+        for name, column in values.items():
+            self.columns.setdefault(name, []).append(column)
+
+    def __len__(self) -> int:
+        return len(self.camera)
+
+    def column(self, name: str) -> np.ndarray:
+        return np.concatenate(self.columns[name]) if name in self.columns else np.empty(0)
+
+    def write_csv(self, path: str) -> None:
+        columns = [self.column(name) for name in CANDIDATE_COLUMNS[1:]]
+        with open(path, "w", newline="") as fh:
+            writer = csv.writer(fh)
+            writer.writerow(CANDIDATE_COLUMNS)
+            for camera, frame, ts, x, y, area, max_temp, mean_temp, ambient in zip(self.camera, *columns):
+                writer.writerow([camera, int(frame), f"{ts:.6f}", f"{x:.2f}", f"{y:.2f}", int(area),
+                                 f"{max_temp:.2f}", f"{mean_temp:.2f}", f"{ambient:.2f}"])
+
+
+def blob_stats(frames: np.ndarray, mask: np.ndarray, config: DetectorConfig) -> dict[str, np.ndarray]:
+    """
+    Frame, centroid, area and temperatures of the person candidates among the warm blobs of a (T, H, W) batch.
+    """
+    components, count = label_blobs(mask)
+    pixels = np.flatnonzero(mask)
+    comp = components.ravel()[pixels]
+    temps = frames.ravel()[pixels].astype(np.float64)
+    area = np.bincount(comp, minlength=count)
+    frame = np.zeros(count, dtype=np.int64)
+    frame[comp] = pixels // N_PIXELS
+    order = np.argsort(comp, kind="stable")
+    starts = np.flatnonzero(np.r_[True, np.diff(comp[order]) != 0]) if count else np.zeros(0, dtype=np.int64)
+
+    stats = {
+        "frame": frame,
+        "x": np.bincount(comp, pixels % FRAME_WIDTH, count) / np.maximum(area, 1),
+        "y": np.bincount(comp, pixels // FRAME_WIDTH % FRAME_HEIGHT, count) / np.maximum(area, 1),
+        "area": area,
+        "max_temp": np.maximum.reduceat(temps[order], starts) if count else np.zeros(0),
+        "mean_temp": np.bincount(comp, temps, count) / np.maximum(area, 1),
+    }
+    keep = (area >= config.min_area) & (area <= config.max_area)
+    return {name: values[keep] for name, values in stats.items()}
+
+
+def detect(cameras: list[ThermalFrames], config: DetectorConfig) -> Candidates:
+    """
+    Person candidates of every frame of the cameras. The cameras are processed together in batches of
+    batch_frames frames each: every camera updates its own background model, and the warm masks of all
+    cameras are labelled in one pass.
+    """
+    models = {camera.name: BackgroundModel(config) for camera in cameras}
+    ambients = {camera.name: frame_ambient(camera.frames, camera.ambient) for camera in cameras}
+    candidates = Candidates()
+    longest = max((len(camera.frames) for camera in cameras), default=0)
+    for start in range(0, longest, config.batch_frames):
+        batch = [(camera, slice(start, min(start + config.batch_frames, len(camera.frames))))
+                 for camera in cameras if start < len(camera.frames)]
+        masks = [models[camera.name].update(camera.frames[rows], ambients[camera.name][rows])[0] for camera, rows in batch]
+        frames = np.concatenate([camera.frames[rows] for camera, rows in batch])
+        mask = np.concatenate(masks)
+
+        # Only frames with warm pixels are labelled
+        warm_frames = np.flatnonzero(mask.any(axis=(1, 2)))
+        stats = blob_stats(frames[warm_frames], mask[warm_frames], config)
+        batch_frame = warm_frames[stats["frame"]]
+        offsets = np.cumsum([0] + [rows.stop - rows.start for _, rows in batch])
+        for i, (camera, rows) in enumerate(batch):
+            own = (batch_frame >= offsets[i]) & (batch_frame < offsets[i + 1])
+            frame = rows.start + batch_frame[own] - offsets[i]
+            values = {name: stats[name][own] for name in ("x", "y", "area", "max_temp", "mean_temp")}
+            candidates.add(camera.name, {"frame": frame, "timestamp": camera.timestamps[frame], **values,
+                                         "ambient": ambients[camera.name][frame]})
+    return candidates
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Detect person candidates in the thermal camera streams of a run.")
+    parser.add_argument("run_dir", help="recorded run, e.g. out/20250101_1200 or just the run id")
+    parser.add_argument("--cameras", default=",".join(THERMAL_CAMERAS), help="comma-separated thermal streams")
+    parser.add_argument("--background", choices=("ema", "median"), default=DetectorConfig.background)
+    parser.add_argument("--alpha", type=float, default=DetectorConfig.alpha)
+    parser.add_argument("--median-frames", type=int, default=DetectorConfig.median_frames)
+    parser.add_argument("--min-above-background", type=float, default=DetectorConfig.min_above_background)
+    parser.add_argument("--min-above-ambient", type=float, default=DetectorConfig.min_above_ambient)
+    parser.add_argument("--min-area", type=int, default=DetectorConfig.min_area)
+    parser.add_argument("--batch-frames", type=int, default=DetectorConfig.batch_frames)
+    parser.add_argument("--output", default=None, help="candidates CSV (default: <run_dir>/thermal_candidates.csv)")
+    args = parser.parse_args()
+
+    run_dir = args.run_dir
+    if not os.path.isdir(run_dir):
+        run_dir = os.path.join(BASE_OUT_DIR, run_dir)
+    config = DetectorConfig(
+        background=args.background,
+        alpha=args.alpha,
+        median_frames=args.median_frames,
+        min_above_background=args.min_above_background,
+        min_above_ambient=args.min_above_ambient,
+        min_area=args.min_area,
+        batch_frames=args.batch_frames,
+    )
+
+    started = time.perf_counter()
+    cameras = [load_thermal_frames(run_dir, name) for name in args.cameras.split(",")
+               if os.path.exists(os.path.join(run_dir, f"{name}.csv"))]
+    loaded = time.perf_counter()
+    candidates = detect(cameras, config)
+    detected = time.perf_counter()
+
+    output = args.output or os.path.join(run_dir, "thermal_candidates.csv")
+    candidates.write_csv(output)
+    frames = sum(len(camera.frames) for camera in cameras)
+    print(f"{frames} frames from {len(cameras)} cameras: loaded in {loaded - started:.2f}s, "
+          f"detected in {detected - loaded:.2f}s ({frames / max(detected - loaded, 1e-9):.0f} frames/s)")
+    print(f"{len(candidates)} person candidates written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import islice
+
+import numpy as np
+
+from server import BASE_OUT_DIR, FRAME_HEIGHT, FRAME_WIDTH, N_PIXELS
+
+# Converted thermal streams of a run live in <run_dir>/STORE_DIR as <name>_frames.npy (T, 24, 32) float32,
+# <name>_timestamps.npy (T,) float64 seconds in sorted order, and <name>.json describing the source CSV
+STORE_DIR = "thermal_frames"
+# MLX90640 streams of a run, in camera order: front, back, right, left
+THERMAL_CAMERAS = ("main", "thermal2", "thermal3", "thermal4")
+CHUNK_ROWS = 4096  # CSV rows parsed at a time, ~15 MB of text
+
+
+@dataclass
+class ThermalRecording:
+    name: str
+    timestamps: np.ndarray  # (T,) seconds, sorted
+    frames: np.ndarray  # (T, FRAME_HEIGHT, FRAME_WIDTH) degC, memory-mapped read-only
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def rows_between(self, t0: float, t1: float) -> slice:
+        """
+        Rows with t0 <= timestamp < t1, found by binary search.
+        """
+        return slice(int(np.searchsorted(self.timestamps, t0, "left")), int(np.searchsorted(self.timestamps, t1, "left")))
+
+    def frames_between(self, t0: float, t1: float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Timestamps and frames with t0 <= timestamp < t1; the frames are a view of the mapped file,
+        so only the pages of the requested rows are read.
+        """
+        rows = self.rows_between(t0, t1)
+        return self.timestamps[rows], self.frames[rows]
+
+
+def store_paths(run_dir: str, name: str) -> tuple[str, str, str]:
+    store = os.path.join(run_dir, STORE_DIR)
+    return (os.path.join(store, f"{name}_frames.npy"), os.path.join(store, f"{name}_timestamps.npy"),
+            os.path.join(store, f"{name}.json"))
+
+
+def source_record(csv_path: str) -> dict:
+    stat = os.stat(csv_path)
+    return {"source": os.path.basename(csv_path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def is_converted(run_dir: str, name: str) -> bool:
+    """
+    Whether the store of a stream exists and was converted from the current content of its CSV (same size and mtime).
+    """
+    frames_path, timestamps_path, meta_path = store_paths(run_dir, name)
+    if not all(os.path.exists(path) for path in (frames_path, timestamps_path, meta_path)):
+        return False
+    with open(meta_path) as fh:
+        meta = json.load(fh)
+    return {key: meta.get(key) for key in ("source", "size", "mtime_ns")} == source_record(
+        os.path.join(run_dir, f"{name}.csv"))
+
+
+def count_rows(csv_path: str, block_size: int = 1 << 24) -> int:
+    # Complete data rows: every newline after the header's; a last row without its newline is still being written
+    lines = 0
+    with open(csv_path, "rb") as fh:
+        for block in iter(lambda: fh.read(block_size), b""):
+            lines += block.count(b"\n")
+    return max(lines - 1, 0)
+
+
+def convert_stream(run_dir: str, name: str) -> int:
+    """
+    Converts <run_dir>/<name>.csv into the mappable store, parsing CHUNK_ROWS rows at a time so memory stays
+    bounded by one chunk; rows received out of order are sorted by timestamp. Returns the number of frames.
+    """
+    frames_path, timestamps_path, meta_path = store_paths(run_dir, name)
+    csv_path = os.path.join(run_dir, f"{name}.csv")
+    os.makedirs(os.path.dirname(frames_path), exist_ok=True)
+    record = source_record(csv_path)
+    rows = count_rows(csv_path)
+
+    tmp_frames, tmp_timestamps = frames_path + ".tmp", timestamps_path + ".tmp"
+    frames = np.lib.format.open_memmap(tmp_frames, mode="w+", dtype=np.float32, shape=(rows, FRAME_HEIGHT, FRAME_WIDTH))
+    timestamps = np.empty(rows, dtype=np.float64)
+    with open(csv_path) as fh:
+        fh.readline()
+        start = 0
+        while start < rows:
+            lines = list(islice(fh, min(CHUNK_ROWS, rows - start)))
+            values = np.fromstring("".join(lines).replace("\n", ","), dtype=np.float64, sep=",")
+            if len(values) != len(lines) * (1 + N_PIXELS):
+                raise ValueError(f"{csv_path}: malformed row between data rows {start} and {start + len(lines)}")
+            values = values.reshape(len(lines), 1 + N_PIXELS)
+            timestamps[start: start + len(lines)] = values[:, 0]
+            frames[start: start + len(lines)] = values[:, 1:].reshape(-1, FRAME_HEIGHT, FRAME_WIDTH)
+            start += len(lines)
+
+    if np.any(np.diff(timestamps) < 0):
+        order = np.argsort(timestamps, kind="stable")
+        timestamps = timestamps[order]
+        sorted_frames = np.lib.format.open_memmap(tmp_frames + ".sorted", mode="w+", dtype=np.float32, shape=frames.shape)
+        for i in range(0, rows, CHUNK_ROWS):
+            sorted_frames[i: i + CHUNK_ROWS] = frames[order[i: i + CHUNK_ROWS]]
+        sorted_frames.flush()
+        del frames, sorted_frames
+        os.replace(tmp_frames + ".sorted", tmp_frames)
+    else:
+        frames.flush()
+        del frames
+
+    with open(tmp_timestamps, "wb") as fh:
+        np.save(fh, timestamps)
+    os.replace(tmp_frames, frames_path)
+    os.replace(tmp_timestamps, timestamps_path)
+    # Written last, so an interrupted conversion is redone
+    with open(meta_path, "w") as fh:
+        json.dump({**record, "frames": rows}, fh, indent=4)
+    return rows
+
+
+def convert_runs(run_dirs: list[str], names=THERMAL_CAMERAS, workers: int | None = None, force: bool = False) -> dict:
+    """
+    Converts the thermal CSVs of the runs that have no current store, one stream per process
+    (serially in this process with workers=0). Returns {(run_dir, name): frames} of the converted streams.
+    """
+    jobs = [(run_dir, name) for run_dir in run_dirs for name in names
+            if os.path.exists(os.path.join(run_dir, f"{name}.csv")) and (force or not is_converted(run_dir, name))]
+    args = ([run_dir for run_dir, _ in jobs], [name for _, name in jobs])
+    if workers == 0 or len(jobs) < 2:
+        counts = list(map(convert_stream, *args))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            counts = list(pool.map(convert_stream, *args))
+    return dict(zip(jobs, counts))
+
+
+def open_recording(run_dir: str, name: str, convert: bool = True) -> ThermalRecording:
+    """
+    The stream name of a run, memory-mapped from its store; with convert the CSV is converted first
+    if the store is missing or older than the CSV.
+    """
+    if not is_converted(run_dir, name):
+        if not convert:
+            raise FileNotFoundError(f"{name} of {run_dir} is not converted; run thermal_store.py {run_dir}")
+        convert_stream(run_dir, name)
+    frames_path, timestamps_path, _ = store_paths(run_dir, name)
+    return ThermalRecording(name, np.load(timestamps_path), np.load(frames_path, mmap_mode="r"))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Convert the thermal CSVs of runs into memory-mappable frame arrays.")
+    parser.add_argument("run_dirs", nargs="+", help="recorded runs, e.g. out/20250101_1200 or just the run ids")
+    parser.add_argument("--streams", default=",".join(THERMAL_CAMERAS), help="comma-separated thermal streams")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes converting streams (0: serial)")
+    parser.add_argument("--force", action="store_true", help="convert even if the store is up to date")
+    args = parser.parse_args()
+
+    run_dirs = [run_dir if os.path.isdir(run_dir) else os.path.join(BASE_OUT_DIR, run_dir) for run_dir in args.run_dirs]
+    started = time.perf_counter()
+    converted = convert_runs(run_dirs, args.streams.split(","), args.workers, args.force)
+    elapsed = time.perf_counter() - started
+    for (run_dir, name), frames in converted.items():
+        print(f"{os.path.join(run_dir, name)}.csv: {frames} frames")
+    print(f"Converted {len(converted)} streams ({sum(converted.values())} frames) in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
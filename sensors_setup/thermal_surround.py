@@ -0,0 +1,211 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from server import BASE_OUT_DIR, FRAME_HEIGHT, FRAME_WIDTH
+from thermal_store import CHUNK_ROWS, STORE_DIR, THERMAL_CAMERAS, convert_runs, open_recording, store_paths
+
+
+@dataclass
+class CameraPose:
+    heading: float  # degrees clockwise from the robot's front, of the optical axis
+    fov: float = 110.0  # horizontal field of view (MLX90640BAA; 55 for the BAB variant)
+    mirrored: bool = False  # image columns run counter-clockwise
+    upside_down: bool = False  # mounted rotated by 180 degrees
+
+
+# Mounting of the cameras per README.md: front, back, right, left
+CAMERA_POSES = {
+    "main": CameraPose(0.0),
+    "thermal2": CameraPose(180.0),
+    "thermal3": CameraPose(90.0),
+    "thermal4": CameraPose(270.0),
+}
+STRIP_COLUMNS = 128  # columns of the 360 degree strip, 2.8 degrees each
+
+
+@dataclass
+class SurroundView:
+    ticks: np.ndarray  # (T,) seconds
+    frames: np.ndarray  # (T, 4, FRAME_HEIGHT, FRAME_WIDTH) degC in THERMAL_CAMERAS order, NaN where unmatched
+    rows: np.ndarray  # (T, 4) frame of each camera's recording at each tick, -1 where unmatched
+
+    def __len__(self) -> int:
+        return len(self.ticks)
+
+    def between(self, t0: float, t1: float) -> slice:
+        """
+        Ticks with t0 <= tick < t1, found by binary search.
+        """
+        return slice(int(np.searchsorted(self.ticks, t0, "left")), int(np.searchsorted(self.ticks, t1, "left")))
+
+    def strip(self, ticks: slice = slice(None), poses: dict[str, CameraPose] = CAMERA_POSES,
+              columns: int = STRIP_COLUMNS) -> np.ndarray:
+        return surround_strip(self.frames[ticks], poses, columns)
+
+
+def match_frames(timestamps: np.ndarray, ticks: np.ndarray, direction: str = "nearest",
+                 tolerance: float | None = None) -> np.ndarray:
+    """
+    As-of match of sorted ticks to the sorted frame timestamps of a camera: the index of the last frame at or
+    before each tick ("backward"), the first at or after it ("forward") or the closer of both ("nearest",
+    the earlier one on ties), -1 where there is none or it is more than tolerance seconds away.
+    """
+    if direction not in ("nearest", "backward", "forward"):
+        raise ValueError(f"unknown direction: {direction}")
+    n = len(timestamps)
+    if n == 0:
+        return np.full(len(ticks), -1, dtype=np.int64)
+    before = np.searchsorted(timestamps, ticks, "right") - 1
+    after = np.searchsorted(timestamps, ticks, "left")
+    if direction == "backward":
+        rows = before
+    elif direction == "forward":
+        rows = np.where(after < n, after, -1)
+    else:
+        gap_before = np.where(before >= 0, ticks - timestamps[np.maximum(before, 0)], np.inf)
+        gap_after = np.where(after < n, timestamps[np.minimum(after, n - 1)] - ticks, np.inf)
+        rows = np.where(gap_before <= gap_after, before, after)
+        rows[np.isinf(np.minimum(gap_before, gap_after))] = -1
+    if tolerance is not None:
+        gap = np.abs(ticks - timestamps[np.clip(rows, 0, n - 1)])
+        rows = np.where(gap <= tolerance, rows, -1)
+    return rows
+
+
+def tick_times(timestamps: dict[str, np.ndarray], master: str = "main", period: float | None = None) -> np.ndarray:
+    """
+    The common ticks: the frames of the master camera, or every period seconds over the time all recorded cameras overlap.
+    """
+    if period is None:
+        if master not in timestamps:
+            raise ValueError(f"master camera {master} has no recording")
+        return timestamps[master]
+    recorded = [ts for ts in timestamps.values() if len(ts)]
+    start = max((ts[0] for ts in recorded), default=0.0)
+    end = min((ts[-1] for ts in recorded), default=0.0)
+    return start + period * np.arange(max(int(np.floor((end - start) / period)) + 1, 0))
+
+
+def surround_strip(frames: np.ndarray, poses: dict[str, CameraPose] = CAMERA_POSES,
+                   columns: int = STRIP_COLUMNS) -> np.ndarray:
+    """
+    Stitches (T, 4, 24, 32) surround frames into a (T, 24, columns) 360 degree strip, column c looking at
+    heading 360 * (c + 0.5) / columns - 180 (the back at the edges, the front in the middle). Each column
+    takes the camera column nearest its heading from the camera whose optical axis is closest;
+    headings no camera sees are NaN.
+    """
+    heading = 360.0 * (np.arange(columns) + 0.5) / columns - 180.0
+    best_offset = np.full(columns, np.inf)
+    camera = np.full(columns, -1)
+    column = np.zeros(columns, dtype=np.int64)
+    rows = np.tile(np.arange(FRAME_HEIGHT), (columns, 1))
+    for k, name in enumerate(THERMAL_CAMERAS):
+        pose = poses[name]
+        offset = (heading - pose.heading + 180.0) % 360.0 - 180.0
+        take = (np.abs(offset) <= pose.fov / 2) & (np.abs(offset) < best_offset)
+        col = np.clip(np.floor((offset / pose.fov + 0.5) * FRAME_WIDTH), 0, FRAME_WIDTH - 1).astype(np.int64)
+        if pose.mirrored != pose.upside_down:
+            col = FRAME_WIDTH - 1 - col
+        best_offset[take] = np.abs(offset[take])
+        camera[take] = k
+        column[take] = col[take]
+        if pose.upside_down:
+            rows[take] = FRAME_HEIGHT - 1 - np.arange(FRAME_HEIGHT)
+
+    # One gather for all ticks: strip[t, r, c] = frames[t, camera[c], rows[c, r], column[c]]
+    strip = frames[:, np.maximum(camera, 0)[None, :], rows.T, column[None, :]]
+    strip[:, :, camera < 0] = np.nan
+    return strip
+
+
+def surround_key(run_dir: str, master: str, period: float | None, direction: str, tolerance: float | None) -> str:
+    # The alignment parameters and the converted recordings they were computed from
+    sources = {}
+    for name in THERMAL_CAMERAS:
+        meta_path = store_paths(run_dir, name)[2]
+        if os.path.exists(meta_path):
+            with open(meta_path) as fh:
+                sources[name] = json.load(fh)
+    params = {"master": master, "period": period, "direction": direction, "tolerance": tolerance, "sources": sources}
+    return hashlib.blake2b(json.dumps(params, sort_keys=True).encode(), digest_size=8).hexdigest()
+
+
+def align_cameras(run_dir: str, path: str, master: str, period: float | None, direction: str,
+                  tolerance: float | None) -> None:
+    """
+    Writes the surround frames of a run to path (.npy) and the ticks and matched rows next to it,
+    CHUNK_ROWS ticks at a time.
+    """
+    recordings = {name: open_recording(run_dir, name) for name in THERMAL_CAMERAS
+                  if os.path.exists(os.path.join(run_dir, f"{name}.csv"))}
+    ticks = tick_times({name: rec.timestamps for name, rec in recordings.items()}, master, period)
+    rows = np.full((len(ticks), len(THERMAL_CAMERAS)), -1, dtype=np.int64)
+    for k, name in enumerate(THERMAL_CAMERAS):
+        if name in recordings:
+            rows[:, k] = match_frames(recordings[name].timestamps, ticks, direction, tolerance)
+
+    tmp_path = path + ".tmp"
+    frames = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32,
+                                       shape=(len(ticks), len(THERMAL_CAMERAS), FRAME_HEIGHT, FRAME_WIDTH))
+    for start in range(0, len(ticks), CHUNK_ROWS):
+        chunk = rows[start: start + CHUNK_ROWS]
+        for k, name in enumerate(THERMAL_CAMERAS):
+            matched = chunk[:, k] >= 0
+            block = np.full((len(chunk), FRAME_HEIGHT, FRAME_WIDTH), np.nan, dtype=np.float32)
+            if matched.any():
+                block[matched] = recordings[name].frames[chunk[matched, k]]
+            frames[start: start + len(chunk), k] = block
+    frames.flush()
+    del frames
+
+    base = path[: -len(".npy")]
+    np.save(base + "_ticks.npy", ticks)
+    np.save(base + "_rows.npy", rows)
+    # Renamed last, so the cached view is complete once it exists
+    os.replace(tmp_path, path)
+
+
+def surround_view(run_dir: str, master: str = "main", period: float | None = None, direction: str = "nearest",
+                  tolerance: float | None = None) -> SurroundView:
+    """
+    The four thermal streams of a run aligned onto common ticks (the main camera's frames, or every period seconds)
+    by as-of matching (see match_frames). The alignment is computed once per set of parameters and recordings and
+    cached in the run's thermal store; the frames are memory-mapped from the cache.
+    """
+    convert_runs([run_dir], workers=0)
+    path = os.path.join(run_dir, STORE_DIR, f"surround_{surround_key(run_dir, master, period, direction, tolerance)}.npy")
+    if not os.path.exists(path):
+        align_cameras(run_dir, path, master, period, direction, tolerance)
+    base = path[: -len(".npy")]
+    return SurroundView(np.load(base + "_ticks.npy"), np.load(path, mmap_mode="r"), np.load(base + "_rows.npy"))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Align the four thermal streams of a run onto common ticks.")
+    parser.add_argument("run_dir", help="recorded run, e.g. out/20250101_1200 or just the run id")
+    parser.add_argument("--master", choices=THERMAL_CAMERAS, default="main", help="camera whose frames are the ticks")
+    parser.add_argument("--period", type=float, help="tick every period seconds instead of the master's frames")
+    parser.add_argument("--direction", choices=("nearest", "backward", "forward"), default="nearest")
+    parser.add_argument("--tolerance", type=float, help="largest gap in seconds between a tick and its frame")
+    args = parser.parse_args()
+
+    run_dir = args.run_dir
+    if not os.path.isdir(run_dir):
+        run_dir = os.path.join(BASE_OUT_DIR, run_dir)
+    started = time.perf_counter()
+    view = surround_view(run_dir, args.master, args.period, args.direction, args.tolerance)
+    elapsed = time.perf_counter() - started
+    matched = (view.rows >= 0).mean(axis=0) if len(view) else np.zeros(len(THERMAL_CAMERAS))
+    print(f"{len(view)} ticks in {elapsed:.2f}s; frames {view.frames.shape} in {os.path.dirname(view.frames.filename)}")
+    for name, fraction in zip(THERMAL_CAMERAS, matched):
+        print(f"  {name} ({CAMERA_POSES[name].heading:.0f} deg): {100 * fraction:.1f}% of ticks matched")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+import argparse
+import csv
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+from server import BASE_OUT_DIR, TIMERCAM_NAMES
+
+# Thumbnails of a run live in <run_dir>/THUMB_DIR as <name>_thumbs.u8, (N, THUMB_HEIGHT, THUMB_WIDTH, 3) uint8
+# in the row order of <name>.csv, appended to while the run is recorded, and <name>.json with the indexed rows
+THUMB_DIR = "timercam_thumbs"
+THUMB_WIDTH = 160  # a quarter of the TimerCam's VGA frames, which the JPEG decoder produces directly
+THUMB_HEIGHT = 120
+THUMB_BYTES = THUMB_HEIGHT * THUMB_WIDTH * 3
+DECODE_THREADS = 4  # PIL releases the GIL while decoding
+TIMERCAMS = tuple(sorted(TIMERCAM_NAMES))
+
+
+@dataclass
+class FrameIndex:
+    name: str
+    timestamps: np.ndarray  # (N,) seconds, sorted
+    filenames: list[str]  # in timestamp order
+    rows: np.ndarray  # (N,) row of each frame in <name>.csv, i.e. in the thumbnail file
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def between(self, t0: float, t1: float) -> slice:
+        """
+        Frames with t0 <= timestamp < t1, found by binary search.
+        """
+        return slice(int(np.searchsorted(self.timestamps, t0, "left")), int(np.searchsorted(self.timestamps, t1, "left")))
+
+    def nearest(self, t: float) -> int:
+        i = int(np.searchsorted(self.timestamps, t))
+        if i == len(self) or (i > 0 and t - self.timestamps[i - 1] <= self.timestamps[i] - t):
+            i -= 1
+        return i
+
+
+def read_frame_csv(path: str) -> tuple[np.ndarray, list[str]]:
+    """
+    Timestamps and image filenames of a timercamN.csv in row order; a partly written last row is dropped.
+    """
+    with open(path, newline="") as fh:
+        text = fh.read()
+    lines = text.split("\n")[1:-1]  # the header, and whatever follows the last newline
+    rows = [row for row in csv.reader(lines) if len(row) == 3]
+    return np.array([float(row[0]) for row in rows], dtype=np.float64), [row[1] for row in rows]
+
+
+def load_index(run_dir: str, name: str) -> FrameIndex:
+    timestamps, filenames = read_frame_csv(os.path.join(run_dir, f"{name}.csv"))
+    order = np.argsort(timestamps, kind="stable")
+    return FrameIndex(name, timestamps[order], [filenames[i] for i in order], order)
+
+
+def decode_jpeg(path: str, size: Optional[tuple[int, int]] = None) -> np.ndarray:
+    """
+    A JPEG as an (H, W, 3) uint8 array; with size (width, height) it is decoded at the smallest DCT scale
+    (1/2, 1/4, 1/8) that still covers size and then resized, instead of decoding the full frame.
+    """
+    with Image.open(path) as img:
+        if size is not None:
+            img.draft("RGB", size)
+        rgb = img.convert("RGB")
+    if size is not None and rgb.size != size:
+        rgb = rgb.resize(size, Image.BILINEAR)
+    return np.asarray(rgb)
+
+
+def thumbnail(path: str) -> bytes:
+    # Missing or truncated images (e.g. the run was stopped mid-write) get a black thumbnail
+    try:
+        return decode_jpeg(path, (THUMB_WIDTH, THUMB_HEIGHT)).tobytes()
+    except (OSError, ValueError):
+        return bytes(THUMB_BYTES)
+
+
+def thumb_paths(run_dir: str, name: str) -> tuple[str, str]:
+    store = os.path.join(run_dir, THUMB_DIR)
+    return os.path.join(store, f"{name}_thumbs.u8"), os.path.join(store, f"{name}.json")
+
+
+def index_thumbnails(run_dir: str, name: str, pool: ThreadPoolExecutor) -> int:
+    """
+    Appends the thumbnails of the frames added to <name>.csv since the last call; the file is rebuilt if
+    the rows it was built from changed. Returns the number of new thumbnails.
+    """
+    thumbs_path, meta_path = thumb_paths(run_dir, name)
+    os.makedirs(os.path.dirname(thumbs_path), exist_ok=True)
+    _, filenames = read_frame_csv(os.path.join(run_dir, f"{name}.csv"))
+
+    indexed = 0
+    if os.path.exists(meta_path) and os.path.exists(thumbs_path):
+        with open(meta_path) as fh:
+            meta = json.load(fh)
+        if (meta["size"] == [THUMB_HEIGHT, THUMB_WIDTH] and 0 < meta["rows"] <= len(filenames)
+                and filenames[meta["rows"] - 1] == meta["last"]):
+            indexed = meta["rows"]
+    new = filenames[indexed:]
+    if not new:
+        return 0
+
+    # New frames are appended in place past the indexed rows; a rebuild is written next to the file and
+    # replaces it once complete, after the stale meta is removed, so readers never see data and meta disagree
+    image_dir = os.path.join(run_dir, name)
+    write_path = thumbs_path if indexed else thumbs_path + ".tmp"
+    with open(write_path, "r+b" if indexed else "wb") as fh:
+        fh.truncate(indexed * THUMB_BYTES)
+        fh.seek(indexed * THUMB_BYTES)
+        for data in pool.map(thumbnail, [os.path.join(image_dir, filename) for filename in new]):
+            fh.write(data)
+    if not indexed:
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        os.replace(write_path, thumbs_path)
+    with open(meta_path + ".tmp", "w") as fh:
+        json.dump({"size": [THUMB_HEIGHT, THUMB_WIDTH], "rows": len(filenames), "last": filenames[-1]}, fh, indent=4)
+    os.replace(meta_path + ".tmp", meta_path)
+    return len(new)
+
+
+def read_thumbnails(run_dir: str, name: str) -> np.ndarray:
+    """
+    The indexed thumbnails of a camera, memory-mapped as (N, THUMB_HEIGHT, THUMB_WIDTH, 3) in <name>.csv row order.
+    """
+    thumbs_path, meta_path = thumb_paths(run_dir, name)
+    if not os.path.exists(meta_path):
+        return np.zeros((0, THUMB_HEIGHT, THUMB_WIDTH, 3), dtype=np.uint8)
+    with open(meta_path) as fh:
+        rows = json.load(fh)["rows"]
+    return np.memmap(thumbs_path, dtype=np.uint8, mode="r", shape=(rows, THUMB_HEIGHT, THUMB_WIDTH, 3))
+
+
+class ThumbnailIndexer:
+    """
+    Keeps the thumbnails of a run's TimerCams up to date in a background thread, polling the timercamN.csv
+    files every interval seconds, so a run can be reviewed while it is still recorded.
+    """
+
+    def __init__(self, run_dir: str, cameras=TIMERCAMS, interval: float = 2.0):
+        self.run_dir = run_dir
+        self.cameras = cameras
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pool = ThreadPoolExecutor(max_workers=DECODE_THREADS, thread_name_prefix="thumbnail")
+
+    def update(self) -> dict[str, int]:
+        """
+        Indexes the new frames of every camera now; returns the number of new thumbnails per camera.
+        """
+        return {name: index_thumbnails(self.run_dir, name, self._pool) for name in self.cameras
+                if os.path.exists(os.path.join(self.run_dir, f"{name}.csv"))}
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="thumbnail-indexer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._pool.shutdown()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.update()
+            except Exception as exc:
+                print(f"[thumbnails] indexing failed: {exc}")
+            self._stop.wait(self.interval)
+
+
+class TimerCamReview:
+    """
+    Frames of a run's TimerCams by time, for scrubbing: full frames are decoded at most once while they stay
+    among the last cache_frames served (LRU), and the frames of a window are decoded in parallel.
+    """
+
+    def __init__(self, run_dir: str, cache_frames: int = 256):
+        self.run_dir = run_dir
+        self._indexes: dict[str, tuple[int, FrameIndex]] = {}
+        self._decode = lru_cache(maxsize=cache_frames)(decode_jpeg)
+        self._pool = ThreadPoolExecutor(max_workers=DECODE_THREADS, thread_name_prefix="review")
+
+    def index(self, name: str) -> FrameIndex:
+        # Reloaded when the CSV grows during a recording
+        size = os.path.getsize(os.path.join(self.run_dir, f"{name}.csv"))
+        if name not in self._indexes or self._indexes[name][0] != size:
+            self._indexes[name] = (size, load_index(self.run_dir, name))
+        return self._indexes[name][1]
+
+    def frame_path(self, name: str, i: int) -> str:
+        return os.path.join(self.run_dir, name, self.index(name).filenames[i])
+
+    def frame_at(self, name: str, t: float) -> tuple[float, np.ndarray]:
+        """
+        The frame nearest to t and its timestamp.
+        """
+        index = self.index(name)
+        if not len(index):
+            raise ValueError(f"{name} has no frames")
+        i = index.nearest(t)
+        return float(index.timestamps[i]), self._decode(self.frame_path(name, i))
+
+    def frames_around(self, name: str, t: float, before: float = 1.0, after: float = 1.0) -> tuple[np.ndarray, list[np.ndarray]]:
+        """
+        Timestamps and full frames within [t - before, t + after).
+        """
+        index = self.index(name)
+        rows = index.between(t - before, t + after)
+        paths = [self.frame_path(name, i) for i in range(rows.start, rows.stop)]
+        return index.timestamps[rows], list(self._pool.map(self._decode, paths))
+
+    def thumbnails_around(self, name: str, t: float, before: float = 5.0, after: float = 5.0) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Timestamps and indexed thumbnails within [t - before, t + after), as (N, THUMB_HEIGHT, THUMB_WIDTH, 3).
+        """
+        index = self.index(name)
+        thumbs = read_thumbnails(self.run_dir, name)
+        frames = index.between(t - before, t + after)
+        rows = index.rows[frames]
+        indexed = rows < len(thumbs)
+        return index.timestamps[frames][indexed], thumbs[rows[indexed]]
+
+    def collisions(self) -> np.ndarray:
+        """
+        Timestamps of the annotated collisions of the run.
+        """
+        path = os.path.join(self.run_dir, "annotation.csv")
+        if not os.path.exists(path):
+            return np.zeros(0)
+        with open(path, newline="") as fh:
+            return np.array([float(row["timestamp"]) for row in csv.DictReader(fh) if row["annotation"] == "True"])
+
+    def close(self) -> None:
+        self._pool.shutdown()
+        self._decode.cache_clear()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build the TimerCam thumbnail index of a run.")
+    parser.add_argument("run_dir", help="recorded run, e.g. out/20250101_1200 or just the run id")
+    parser.add_argument("--cameras", default=",".join(TIMERCAMS), help="comma-separated TimerCam streams")
+    parser.add_argument("--follow", action="store_true", help="keep indexing new frames until interrupted")
+    parser.add_argument("--interval", type=float, default=2.0, help="seconds between checks with --follow")
+    args = parser.parse_args()
+
+    run_dir = args.run_dir
+    if not os.path.isdir(run_dir):
+        run_dir = os.path.join(BASE_OUT_DIR, run_dir)
+    indexer = ThumbnailIndexer(run_dir, args.cameras.split(","), args.interval)
+    started = time.perf_counter()
+    counts = indexer.update()
+    elapsed = time.perf_counter() - started
+    print(f"Indexed {sum(counts.values())} new frames in {elapsed:.2f}s: {counts}")
+    if args.follow:
+        indexer.start()
+        try:
+            while True:
+                time.sleep(1.0)
+        except KeyboardInterrupt:
+            pass
+    indexer.stop()
+
+
+if __name__ == "__main__":
+    main()